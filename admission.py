@@ -0,0 +1,200 @@
+"""Admission control for Bedrock calls.
+
+Caps how many model and knowledge base calls a process has in flight. Callers beyond
+the cap wait in a bounded queue that is served round-robin across chat sessions, so
+one chatty session can't starve the others. A caller that finds the queue full, or
+can't start within the queue deadline, is rejected at once with AdmissionRejected
+and the chat layer answers with a friendly "busy" message instead of adding to a
+throttling storm.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Concurrent invoke_model calls per process
+BEDROCK_MAX_IN_FLIGHT = int(os.getenv('BEDROCK_MAX_IN_FLIGHT', '16'))
+# Concurrent knowledge base retrieve / retrieve_and_generate calls per process
+KB_MAX_IN_FLIGHT = int(os.getenv('KB_MAX_IN_FLIGHT', '16'))
+# Callers allowed to wait for a slot on each limiter; more are rejected immediately
+BEDROCK_QUEUE_SIZE = int(os.getenv('BEDROCK_QUEUE_SIZE', '64'))
+# Seconds a caller waits for a slot before it is turned away
+BEDROCK_QUEUE_TIMEOUT = float(os.getenv('BEDROCK_QUEUE_TIMEOUT', '5'))
+
+BUSY_MESSAGE = "We're helping a lot of customers right now. Please try again in a moment."
+
+REJECTED_QUEUE_FULL = "queue_full"
+REJECTED_TIMEOUT = "timeout"
+
+# Queue times kept per limiter for percentiles
+_QUEUE_TIME_SAMPLES = 1000
+_ANONYMOUS = "anonymous"
+
+
+class AdmissionRejected(Exception):
+    """A call was turned away because the limiter's queue was full or its deadline passed"""
+
+    def __init__(self, limiter: str, reason: str):
+        super().__init__(f"{limiter} admission rejected: {reason}")
+        self.limiter = limiter
+        self.reason = reason
+
+
+class _Waiter:
+    __slots__ = ('event', 'granted')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+
+class FairLimiter:
+    """Concurrency limit with a bounded wait queue, served one waiter per session in turn"""
+
+    def __init__(self, name: str, max_in_flight: int, queue_size: int = BEDROCK_QUEUE_SIZE,
+                 timeout: float = BEDROCK_QUEUE_TIMEOUT):
+        self.name = name
+        self.max_in_flight = max(1, max_in_flight)
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        # session -> its waiters in arrival order; sessions rotate to the back after each grant
+        self._queues: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self.queued = 0
+        self.admitted = 0
+        self.waited = 0
+        self.rejected = {REJECTED_QUEUE_FULL: 0, REJECTED_TIMEOUT: 0}
+        self._queue_times: Deque[float] = deque(maxlen=_QUEUE_TIME_SAMPLES)
+
+    def acquire(self, session_id: Optional[str] = None, timeout: Optional[float] = None) -> float:
+        """Take a slot, waiting if needed; returns the seconds spent queued"""
+        key = session_id or _ANONYMOUS
+        with self._lock:
+            if self.in_flight < self.max_in_flight and not self.queued:
+                self.in_flight += 1
+                self.admitted += 1
+                self._queue_times.append(0.0)
+                return 0.0
+            if self.queued >= self.queue_size:
+                self.rejected[REJECTED_QUEUE_FULL] += 1
+                raise AdmissionRejected(self.name, REJECTED_QUEUE_FULL)
+            waiter = _Waiter()
+            self._queues.setdefault(key, deque()).append(waiter)
+            self.queued += 1
+
+        start = time.perf_counter()
+        waiter.event.wait(self.timeout if timeout is None else timeout)
+        waited = time.perf_counter() - start
+        with self._lock:
+            # A slot handed over just as the wait timed out still counts
+            if waiter.granted:
+                self.admitted += 1
+                self.waited += 1
+                self._queue_times.append(waited)
+                return waited
+            queue = self._queues.get(key)
+            queue.remove(waiter)
+            if not queue:
+                del self._queues[key]
+            self.queued -= 1
+            self.rejected[REJECTED_TIMEOUT] += 1
+        logger.warning("%s call for session %s rejected after %.1fs in queue", self.name, session_id, waited)
+        raise AdmissionRejected(self.name, REJECTED_TIMEOUT)
+
+    def release(self) -> None:
+        """Hand the slot to the next session's oldest waiter, or free it"""
+        with self._lock:
+            if not self._queues:
+                self.in_flight -= 1
+                return
+            key, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            if queue:
+                self._queues.move_to_end(key)
+            else:
+                del self._queues[key]
+            self.queued -= 1
+            waiter.granted = True
+            waiter.event.set()
+
+    @contextmanager
+    def slot(self, session_id: Optional[str] = None):
+        queued = self.acquire(session_id)
+        if queued:
+            logger.debug("%s call for session %s queued %.3fs", self.name, session_id, queued)
+        try:
+            yield queued
+        finally:
+            self.release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            times = sorted(self._queue_times)
+            return {
+                "max_in_flight": self.max_in_flight,
+                "in_flight": self.in_flight,
+                "queued": self.queued,
+                "queued_sessions": len(self._queues),
+                "admitted": self.admitted,
+                "waited": self.waited,
+                "rejected": dict(self.rejected),
+                "queue_ms_p50": round(times[len(times) // 2] * 1000, 1) if times else 0.0,
+                "queue_ms_p95": round(times[min(len(times) - 1, int(len(times) * 0.95))] * 1000, 1) if times else 0.0,
+                "queue_ms_max": round(times[-1] * 1000, 1) if times else 0.0,
+            }
+
+
+# Process-wide limiters shared by the app, the API and batch jobs
+model_limiter = FairLimiter("invoke_model", BEDROCK_MAX_IN_FLIGHT)
+kb_limiter = FairLimiter("knowledge_base", KB_MAX_IN_FLIGHT)
+
+
+def busy_response() -> Dict[str, Any]:
+    """Chat response for a rejected call; flagged as an error so it is never cached"""
+    return {"type": "text", "content": BUSY_MESSAGE, "error": True, "busy": True}
+
+
+def get_admission_stats() -> Dict[str, Any]:
+    return {limiter.name: limiter.stats() for limiter in (model_limiter, kb_limiter)}
+
+
+def _simulate(sessions: int = 20, calls_per_session: int = 10, chatty_calls: int = 200, call_seconds: float = 0.02):
+    """One chatty session against many normal ones: queue times with per-session fairness vs plain FIFO"""
+    import random
+    for fair in (False, True):
+        limiter = FairLimiter("simulated", max_in_flight=4, queue_size=400, timeout=30)
+        queue_times = {"chatty": [], "normal": []}
+
+        def call(session_id, kind):
+            # FIFO is the same limiter with every caller in one lane
+            queued = limiter.acquire(session_id if fair else "everyone")
+            try:
+                time.sleep(call_seconds * random.uniform(0.5, 1.5))
+            finally:
+                limiter.release()
+            queue_times[kind].append(queued)
+
+        jobs = [("chatty", "chatty")] * chatty_calls
+        jobs += [(f"session-{i}", "normal") for i in range(sessions) for _ in range(calls_per_session)]
+        start = time.perf_counter()
+        # The chatty session's burst arrives first; one thread per call, like concurrent chat requests
+        threads = [threading.Thread(target=call, args=job) for job in jobs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        print(f"{'fair' if fair else 'fifo'}: {len(jobs)} calls through 4 slots in {time.perf_counter() - start:.2f}s")
+        for kind, times in queue_times.items():
+            times.sort()
+            print(f"  {kind:>7}: {len(times)} calls, queue p50 {times[len(times) // 2] * 1000:.0f} ms, "
+                  f"p95 {times[int(len(times) * 0.95)] * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    _simulate()
@@ -0,0 +1,282 @@
+"""Precomputed answers for the stable FAQ and Products questions.
+
+Build (or rebuild) the store offline:
+    python answer_store.py build [--paraphrases 3]
+"""
+import glob
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+from kb_reranker import tokenize
+
+logger = logging.getLogger(__name__)
+
+KNOWLEDGE_BASE_PATH = os.getenv('KNOWLEDGE_BASE_PATH', 'rivertown_knowledge_base_2.json')
+ANSWER_QUESTIONS_PATH = os.getenv('ANSWER_QUESTIONS_PATH', 'answer_questions.json')
+ANSWER_STORE_DIR = os.getenv('ANSWER_STORE_DIR', 'answer_store')
+# Cosine similarity a query needs to be served a precomputed answer
+ANSWER_MATCH_THRESHOLD = float(os.getenv('ANSWER_MATCH_THRESHOLD', '0.75'))
+# Seconds between checks of the source JSON for changes
+ANSWER_SOURCE_CHECK_INTERVAL = float(os.getenv('ANSWER_SOURCE_CHECK_INTERVAL', '5'))
+
+_STORE_FILE_PATTERN = re.compile(r"answers-v(\d+)\.json$")
+
+
+def source_fingerprint(path: str = KNOWLEDGE_BASE_PATH) -> str:
+    """SHA-256 of the knowledge base JSON the answers were generated from"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _features(text: str) -> Counter:
+    """Word unigrams plus bigrams, with a light plural strip"""
+    words = [w[:-1] if len(w) > 3 and w.endswith('s') else w for w in tokenize(text)]
+    features = Counter(words)
+    features.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+    return features
+
+
+class AnswerIndex:
+    """TF-IDF cosine matcher from question variants to precomputed answers"""
+
+    def __init__(self, entries: List[Dict[str, Any]]):
+        self.entries = entries
+        documents: List[Tuple[int, Counter]] = []
+        for index, entry in enumerate(entries):
+            for text in [entry['question']] + entry.get('variants', []):
+                documents.append((index, _features(text)))
+
+        document_frequency = Counter()
+        for _, features in documents:
+            document_frequency.update(features.keys())
+        total = len(documents)
+        self.idf = {f: math.log((1 + total) / (1 + df)) + 1.0 for f, df in document_frequency.items()}
+
+        # Inverted index: feature -> [(document, normalized weight)]
+        self.postings: Dict[str, List[Tuple[int, float]]] = {}
+        self.document_entry: List[int] = []
+        for doc_id, (entry_index, features) in enumerate(documents):
+            weights = {f: (1 + math.log(c)) * self.idf[f] for f, c in features.items()}
+            norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+            for feature, weight in weights.items():
+                self.postings.setdefault(feature, []).append((doc_id, weight / norm))
+            self.document_entry.append(entry_index)
+
+    def match(self, query: str) -> Tuple[Optional[Dict[str, Any]], float]:
+        """Best matching entry and its similarity"""
+        features = _features(query)
+        weights = {f: (1 + math.log(c)) * self.idf[f] for f, c in features.items() if f in self.idf}
+        # Unknown query terms still count towards the query norm, lowering similarity
+        unknown = sum(((1 + math.log(c)) * 2.0) ** 2 for f, c in features.items() if f not in self.idf)
+        norm = math.sqrt(sum(w * w for w in weights.values()) + unknown)
+        if not weights or norm == 0:
+            return None, 0.0
+
+        scores: Dict[int, float] = {}
+        for feature, weight in weights.items():
+            for doc_id, doc_weight in self.postings[feature]:
+                scores[doc_id] = scores.get(doc_id, 0.0) + weight * doc_weight
+        doc_id, score = max(scores.items(), key=lambda item: item[1])
+        return self.entries[self.document_entry[doc_id]], score / norm
+
+
+def latest_store_path(directory: str = ANSWER_STORE_DIR) -> Optional[str]:
+    """Path of the highest-versioned store file"""
+    versions = []
+    for path in glob.glob(os.path.join(directory, "answers-v*.json")):
+        match = _STORE_FILE_PATTERN.search(path)
+        if match:
+            versions.append((int(match.group(1)), path))
+    return max(versions)[1] if versions else None
+
+
+class AnswerStore:
+    """Loads the latest answer store and drops it when the source JSON changes"""
+
+    def __init__(self, directory: str = ANSWER_STORE_DIR, source_path: str = KNOWLEDGE_BASE_PATH,
+                 threshold: float = ANSWER_MATCH_THRESHOLD):
+        self.directory = directory
+        self.source_path = source_path
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._index: Optional[AnswerIndex] = None
+        self._fingerprint: Optional[str] = None
+        self._source_mtime: Optional[float] = None
+        self._next_check = 0.0
+        self.version: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def load(self) -> None:
+        path = latest_store_path(self.directory)
+        with self._lock:
+            self._index = None
+            self.version = None
+            if not path:
+                logger.info("No precomputed answer store in %s", self.directory)
+                return
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    store = json.load(f)
+                self._source_mtime = os.stat(self.source_path).st_mtime
+                current = source_fingerprint(self.source_path)
+            except Exception as e:
+                logger.warning("Could not load answer store %s: %s", path, e)
+                return
+            if store.get('source_sha256') != current:
+                logger.warning("Answer store %s was built from a different knowledge base, ignoring it", path)
+                return
+            self._fingerprint = current
+            self._index = AnswerIndex(store['entries'])
+            self.version = store.get('version')
+            logger.info("Loaded %s precomputed answers (version %s)", len(store['entries']), self.version)
+
+    def _check_source(self) -> None:
+        """Invalidate the store when the source JSON changes (checked at most every few seconds)"""
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + ANSWER_SOURCE_CHECK_INTERVAL
+        try:
+            mtime = os.stat(self.source_path).st_mtime
+        except OSError:
+            return
+        if mtime == self._source_mtime:
+            return
+        self._source_mtime = mtime
+        if source_fingerprint(self.source_path) != self._fingerprint:
+            logger.warning("Knowledge base JSON changed, precomputed answers invalidated")
+            with self._lock:
+                self._index = None
+
+    def lookup(self, query: str) -> Optional[Dict[str, Any]]:
+        """Precomputed answer for the query if it is similar enough to a curated question"""
+        if self._index is None:
+            return None
+        self._check_source()
+        index = self._index
+        if index is None:
+            return None
+        entry, score = index.match(query)
+        if entry is None or score < self.threshold:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        logger.debug("Precomputed answer %s matched with similarity %.2f", entry['id'], score)
+        return {"type": "text", "content": entry['answer'], "precomputed": entry['id'], "similarity": score}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"version": self.version, "loaded": self._index is not None,
+                    "hits": self.hits, "misses": self.misses}
+
+
+_store: Optional[AnswerStore] = None
+_store_lock = threading.Lock()
+
+
+def get_answer_store() -> AnswerStore:
+    """Process-wide answer store, loaded on first use"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = AnswerStore()
+        return _store
+
+
+def get_precomputed_answer(query: str) -> Optional[Dict[str, Any]]:
+    return get_answer_store().lookup(query)
+
+
+def _generate_paraphrases(runtime_client, question: str, count: int) -> List[str]:
+    from bedrock_utils import get_claude_response
+
+    prompt = (f"Write {count} different ways a customer might ask this question, as a JSON array "
+              f"of strings and nothing else:\n{question}")
+    response = get_claude_response(runtime_client, prompt, profile="short_faq")
+    try:
+        paraphrases = json.loads(re.search(r'\[[\s\S]*\]', response['content']).group())
+        return [p for p in paraphrases if isinstance(p, str)][:count]
+    except (AttributeError, TypeError, ValueError):
+        logger.warning("Could not parse paraphrases for: %s", question)
+        return []
+
+
+def build_answer_store(runtime_client, paraphrases: int = 0, questions_path: str = ANSWER_QUESTIONS_PATH,
+                       source_path: str = KNOWLEDGE_BASE_PATH, directory: str = ANSWER_STORE_DIR) -> str:
+    """Generate canonical answers for the curated questions into a new store version"""
+    from bedrock_utils import get_claude_response, CLAUDE_MODEL_ID
+    from response_profiles import select_profile
+
+    with open(source_path, 'r', encoding='utf-8') as f:
+        knowledge_base = json.load(f)
+    with open(questions_path, 'r', encoding='utf-8') as f:
+        questions = json.load(f)
+
+    entries = []
+    for item in questions:
+        # Ground each answer in the exact source passage it is curated from
+        passage = knowledge_base[item['section']][item.get('item', 0)]
+        response = get_claude_response(runtime_client, item['question'], context=passage,
+                                       profile=select_profile(item['question']))
+        if response.get('error'):
+            logger.error("Skipping %s: %s", item['id'], response['content'])
+            continue
+        variants = list(item.get('variants', []))
+        if paraphrases:
+            variants += _generate_paraphrases(runtime_client, item['question'], paraphrases)
+        entries.append({
+            "id": item['id'],
+            "section": item['section'],
+            "question": item['question'],
+            "variants": variants,
+            "answer": response['content'],
+        })
+        logger.info("Generated answer for %s", item['id'])
+
+    previous = latest_store_path(directory)
+    version = int(_STORE_FILE_PATTERN.search(previous).group(1)) + 1 if previous else 1
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"answers-v{version}.json")
+    store = {
+        "version": version,
+        "generated_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "model": CLAUDE_MODEL_ID,
+        "source_sha256": source_fingerprint(source_path),
+        "entries": entries,
+    }
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(store, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    logger.info("Wrote %s answers to %s", len(entries), path)
+    return path
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+    from bedrock_utils import init_bedrock
+
+    parser = argparse.ArgumentParser(description="Precomputed answer store")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--paraphrases", type=int, default=0,
+                        help="extra paraphrase variants to generate per question")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    load_dotenv()
+    print(build_answer_store(init_bedrock(), paraphrases=args.paraphrases))
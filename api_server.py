@@ -0,0 +1,387 @@
+"""Headless HTTP chat API.
+
+Run with:
+    uvicorn api_server:app --host 0.0.0.0 --port 8080
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.middleware import Middleware
+from starlette.routing import Route
+from bedrock_utils import init_bedrock, get_secret
+from knowledge_base import init_knowledge_base, get_kb_session_stats
+from dynamo_utils import init_dynamodb, lookup_customer_orders
+from chat_service import get_combined_response, stream_combined_response, extract_phone_request
+from bland_utils import request_callback
+from usage_tracking import get_usage_metrics
+from health import get_health, start_prewarm
+from region_router import get_region_stats
+from answer_store import get_answer_store
+from session_memory import get_memory_report
+from turn_scheduler import start_turn, route_turn, context_provider, get_turn_stats, ROUTE_ANALYTICS
+from admission import get_admission_stats
+from prompt_cache import get_prompt_cache_stats
+from shared_cache import get_cache_stats
+from profiling import profile_turn
+from log_utils import configure_logging, shutdown_logging, request_context, bind_session
+
+logger = logging.getLogger(__name__)
+
+# Threads running blocking AWS calls
+API_WORKERS = int(os.getenv('API_WORKERS', '16'))
+# Requests allowed to wait for a worker before new ones are rejected
+API_QUEUE_SIZE = int(os.getenv('API_QUEUE_SIZE', '64'))
+# Seconds a request may wait for a free slot
+API_QUEUE_TIMEOUT = float(os.getenv('API_QUEUE_TIMEOUT', '5'))
+
+_STREAM_END = object()
+
+
+class ServiceState:
+    """Clients and worker pool shared by every request"""
+
+    def __init__(self):
+        self.secrets = {}
+        self.runtime_client = None
+        self.kb_client = None
+        self.executor = None
+        self.slots = None
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._local = threading.local()
+
+    def start(self):
+        self.secrets = get_secret() or {}
+        self.runtime_client = init_bedrock()
+        self.kb_client = init_knowledge_base()
+        self.executor = ThreadPoolExecutor(max_workers=API_WORKERS, thread_name_prefix="chat-api")
+        self.slots = asyncio.Semaphore(API_WORKERS)
+        start_prewarm(self.runtime_client, self.kb_client, init_dynamodb())
+        logger.info("Chat API started with %s workers, queue size %s", API_WORKERS, API_QUEUE_SIZE)
+
+    def stop(self):
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def dynamodb(self):
+        # boto3 resources are not thread safe, so each worker thread gets its own
+        if not hasattr(self._local, 'dynamodb'):
+            self._local.dynamodb = init_dynamodb()
+        return self._local.dynamodb
+
+
+state = ServiceState()
+
+
+class Overloaded(Exception):
+    """The queue was full, or no worker slot became free within API_QUEUE_TIMEOUT"""
+
+
+async def _acquire_slot():
+    # Counters are only touched on the event loop thread
+    if not state.slots.locked():
+        # A worker is free; acquire() returns without suspending
+        await state.slots.acquire()
+    elif state.waiting >= API_QUEUE_SIZE:
+        # Queue full: reject now rather than after API_QUEUE_TIMEOUT
+        state.rejected += 1
+        raise Overloaded()
+    else:
+        state.waiting += 1
+        try:
+            await asyncio.wait_for(state.slots.acquire(), timeout=API_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            state.rejected += 1
+            raise Overloaded()
+        finally:
+            state.waiting -= 1
+    state.in_flight += 1
+
+
+def _release_slot():
+    state.in_flight -= 1
+    state.slots.release()
+
+
+def _release_when_done(future, cleanup=None):
+    """Free the slot once the worker call returns, even if the request was cancelled first"""
+    loop = asyncio.get_running_loop()
+
+    def finish():
+        try:
+            if cleanup is not None:
+                cleanup()
+        finally:
+            _release_slot()
+
+    def done(_):
+        try:
+            loop.call_soon_threadsafe(finish)
+        except RuntimeError:
+            # Event loop already closed at shutdown
+            pass
+
+    future.add_done_callback(done)
+
+
+async def run_in_pool(func, *args, **kwargs):
+    """Run a blocking call on the worker pool, respecting the queue bound"""
+    await _acquire_slot()
+    # Executor threads don't inherit contextvars, so carry the request's logging context over
+    context = contextvars.copy_context()
+    try:
+        future = state.executor.submit(context.run, func, *args, **kwargs)
+    except RuntimeError:
+        _release_slot()
+        raise
+    _release_when_done(future)
+    return await asyncio.wrap_future(future)
+
+
+def _overloaded_response():
+    return JSONResponse(
+        {"error": "overloaded", "message": "We're busy right now, please try again in a moment."},
+        status_code=503,
+        headers={"Retry-After": "1"}
+    )
+
+
+async def _json_body(request: Request):
+    try:
+        body = await request.json()
+    except (json.JSONDecodeError, ValueError):
+        return None
+    return body if isinstance(body, dict) else None
+
+
+def _chat_turn(message: str, session_id: str):
+    with profile_turn("api-chat", session_id):
+        return _routed_chat_turn(message, session_id)
+
+
+def _routed_chat_turn(message: str, session_id: str):
+    # Chat turns start retrieval as soon as they are routed; spend and order history questions skip the model
+    turn = start_turn(message, state.kb_client, session_id=session_id, order_lookups=False)
+    route_kind = turn.route.kind
+    try:
+        route, result = route_turn(turn, state.dynamodb())
+        route_kind = route.kind
+        if route.kind == ROUTE_ANALYTICS:
+            return {"type": "text", "content": result['content']}
+        return get_combined_response(state.runtime_client, state.kb_client, message, session_id=session_id,
+                                     context_provider=context_provider(turn))
+    finally:
+        turn.finish(route_kind)
+
+
+def _stream_turn(message: str, session_id: str):
+    # Runs on the worker pool one chunk at a time, so the order lookup also stays off the event loop
+    turn = start_turn(message, state.kb_client, session_id=session_id, order_lookups=False)
+    route_kind = turn.route.kind
+    try:
+        route, result = route_turn(turn, state.dynamodb())
+        route_kind = route.kind
+        if route.kind == ROUTE_ANALYTICS:
+            yield result['content']
+            return
+        yield from stream_combined_response(state.runtime_client, state.kb_client, message, session_id=session_id,
+                                            context_provider=context_provider(turn))
+    finally:
+        turn.finish(route_kind)
+
+
+async def chat(request: Request):
+    """POST /chat {"message": ..., "session_id": ...}"""
+    body = await _json_body(request)
+    if not body or not body.get('message'):
+        return JSONResponse({"error": "message is required"}, status_code=400)
+    session_id = body.get('session_id') or str(uuid.uuid4())
+    bind_session(session_id)
+
+    try:
+        response = await run_in_pool(_chat_turn, body['message'], session_id)
+    except Overloaded:
+        return _overloaded_response()
+    if response.get('busy'):
+        # Bedrock admission control turned the call away
+        return _overloaded_response()
+
+    phone_request = extract_phone_request(response.get('content'))
+    if phone_request:
+        return JSONResponse({"session_id": session_id, "type": "phone_request", "content": phone_request['message']})
+    return JSONResponse({"session_id": session_id, "type": response.get('type', 'text'), "content": response.get('content')})
+
+
+async def chat_stream(request: Request):
+    """POST /chat/stream, streams newline-delimited JSON chunks"""
+    body = await _json_body(request)
+    if not body or not body.get('message'):
+        return JSONResponse({"error": "message is required"}, status_code=400)
+    session_id = body.get('session_id') or str(uuid.uuid4())
+    bind_session(session_id)
+
+    try:
+        await _acquire_slot()
+    except Overloaded:
+        return _overloaded_response()
+
+    chunks = _stream_turn(body['message'], session_id)
+    context = contextvars.copy_context()
+
+    def close_chunks():
+        # Runs the turn's cleanup, including releasing its model slot
+        try:
+            context.run(chunks.close)
+        except Exception as e:
+            logger.error("Error closing chat stream: %s", e)
+
+    async def event_stream():
+        pending = None
+        try:
+            yield json.dumps({"session_id": session_id, "type": "start"}) + "\n"
+            while True:
+                pending = state.executor.submit(context.run, next, chunks, _STREAM_END)
+                chunk = await asyncio.wrap_future(pending)
+                if chunk is _STREAM_END:
+                    break
+                yield json.dumps({"type": "delta", "text": chunk}) + "\n"
+            yield json.dumps({"type": "end"}) + "\n"
+        finally:
+            if pending is None:
+                close_chunks()
+                _release_slot()
+            else:
+                # If the client went away while a worker was producing a chunk, the
+                # generator can only be closed, and the slot freed, once that returns
+                _release_when_done(pending, close_chunks)
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+
+async def orders(request: Request):
+    """GET /orders?name=... (or first_name=...&last_name=...), names are matched fuzzily"""
+    name = request.query_params.get('name') or ' '.join(
+        filter(None, (request.query_params.get('first_name'), request.query_params.get('last_name'))))
+    if not name.strip():
+        return JSONResponse({"error": "name (or first_name and last_name) is required"}, status_code=400)
+
+    try:
+        match, result, suggestions = await run_in_pool(lambda: lookup_customer_orders(state.dynamodb(), name))
+    except Overloaded:
+        return _overloaded_response()
+
+    if result is None:
+        return JSONResponse({"error": "customer not found", "did_you_mean": suggestions}, status_code=404)
+    return JSONResponse({"first_name": match['first_name'], "last_name": match['last_name'], "orders": result})
+
+
+async def callback(request: Request):
+    """POST /callback {"phone_number": ..., "first_name": ...}"""
+    body = await _json_body(request)
+    if not body or not body.get('phone_number') or not body.get('first_name'):
+        return JSONResponse({"error": "phone_number and first_name are required"}, status_code=400)
+
+    try:
+        queued = await run_in_pool(
+            request_callback, state.secrets.get('BLAND_API_KEY'), body['phone_number'], body['first_name']
+        )
+    except Overloaded:
+        return _overloaded_response()
+
+    if not queued:
+        return JSONResponse({"queued": False, "message": "We couldn't place the call, please try again."}, status_code=502)
+    return JSONResponse({"queued": True, "message": "You should receive a call shortly."})
+
+
+async def metrics(request: Request):
+    """GET /metrics, token usage and worker pool state"""
+    return JSONResponse({
+        "usage": get_usage_metrics(),
+        "regions": get_region_stats(),
+        "answer_store": get_answer_store().stats(),
+        "session_memory": get_memory_report(),
+        "kb_sessions": get_kb_session_stats(),
+        "turns": get_turn_stats(),
+        "admission": get_admission_stats(),
+        "prompt_cache": get_prompt_cache_stats(),
+        "cache": get_cache_stats(),
+        "pool": {
+            "workers": API_WORKERS,
+            "queue_size": API_QUEUE_SIZE,
+            "in_flight": state.in_flight,
+            "queued": state.waiting,
+            "rejected": state.rejected,
+        },
+    })
+
+
+async def health(request: Request):
+    """GET /health serves cached results; /health?deep=1 refreshes expired checks"""
+    if request.query_params.get('deep'):
+        try:
+            result = await run_in_pool(get_health, deep=True)
+        except Overloaded:
+            return _overloaded_response()
+    else:
+        result = get_health()
+    return JSONResponse(result, status_code=200 if result["status"] == "ok" else 503)
+
+
+class RequestContextMiddleware:
+    """Tags every log record with a request ID and echoes it in the X-Request-ID header"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        incoming = dict(scope.get('headers') or []).get(b'x-request-id', b'').decode('latin-1')[:64]
+        with request_context(request_id=incoming or None) as request_id:
+            async def send_with_request_id(message):
+                if message['type'] == 'http.response.start':
+                    message.setdefault('headers', []).append((b'x-request-id', request_id.encode('latin-1')))
+                await send(message)
+
+            await self.app(scope, receive, send_with_request_id)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    configure_logging()
+    state.start()
+    yield
+    state.stop()
+    shutdown_logging()
+
+
+app = Starlette(
+    routes=[
+        Route("/chat", chat, methods=["POST"]),
+        Route("/chat/stream", chat_stream, methods=["POST"]),
+        Route("/orders", orders, methods=["GET"]),
+        Route("/callback", callback, methods=["POST"]),
+        Route("/metrics", metrics, methods=["GET"]),
+        Route("/health", health, methods=["GET"]),
+    ],
+    middleware=[Middleware(RequestContextMiddleware)],
+    lifespan=lifespan,
+)
+
+
+if __name__ == "__main__":
+    import uvicorn
+    configure_logging()
+    uvicorn.run(app, host=os.getenv('API_HOST', '0.0.0.0'), port=int(os.getenv('API_PORT', '8080')), log_config=None)
@@ -1,21 +1,26 @@
 import streamlit as st
 from bedrock_utils import init_bedrock, get_secret
-from knowledge_base import init_knowledge_base
-from chat_service import get_combined_response
-import json
+from knowledge_base import init_knowledge_base, end_kb_session
+from chat_service import get_combined_response, extract_phone_request
+from usage_tracking import get_usage_metrics
 import logging
 import os
+import uuid
 from dotenv import load_dotenv
-from streamlit.components.v1 import html as st_html  # Import Streamlit's HTML component
-import re
-import requests
-from dynamo_utils import init_dynamodb, get_customer_orders
+from dynamo_utils import init_dynamodb
+from bland_utils import request_callback
+from health import start_prewarm
+from log_utils import configure_logging, request_context
+from profiling import profile_turn
+from session_memory import get_transcript, compact_orders, KIND_ORDERS
+from turn_scheduler import start_turn, route_turn, context_provider, ROUTE_ANALYTICS, ROUTE_ORDERS, ROUTE_CHAT
 from datetime import datetime
 
 # Load environment variables
 load_dotenv()
 
 # Initialize logger
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Get secrets from AWS Secrets Manager
@@ -24,10 +29,17 @@ if not secrets:
     st.error("Failed to get secrets from AWS Secrets Manager")
     st.stop()
 
-# Initialize clients
-runtime_client = init_bedrock()
-kb_client = init_knowledge_base()
-dynamodb_client = init_dynamodb()
+# Initialize clients once per process and share them across sessions and reruns
+@st.cache_resource(show_spinner=False)
+def init_clients():
+    runtime_client = init_bedrock()
+    kb_client = init_knowledge_base()
+    dynamodb_client = init_dynamodb()
+    # Open pooled connections in the background so the first question skips TLS handshakes
+    start_prewarm(runtime_client, kb_client, dynamodb_client)
+    return runtime_client, kb_client, dynamodb_client
+
+runtime_client, kb_client, dynamodb_client = init_clients()
 
 # Set page config with custom theme and hidden menu
 st.set_page_config(
@@ -132,31 +144,63 @@ with col2:
     """, unsafe_allow_html=True)
 
 # Initialize session state variables
-if "messages" not in st.session_state:
-    st.session_state.messages = []
-    # Add welcome message
-    st.session_state.messages.append({
-        "role": "assistant",
-        "content": "Welcome to Rivertown Ball Company! How can I help you today?"
-    })
+if "session_id" not in st.session_state:
+    st.session_state.session_id = str(uuid.uuid4())
 if "phone_number" not in st.session_state:
     st.session_state.phone_number = None
 if "first_name" not in st.session_state:
     st.session_state.first_name = None
 if "phone_request_stage" not in st.session_state:
     st.session_state.phone_request_stage = None
+if "customer" not in st.session_state:
+    # (first_name, last_name) of the customer looked up last, for "how much have I spent"
+    st.session_state.customer = None
+
+# Chat history lives in a bounded, process-wide transcript rather than in session_state
+transcript = get_transcript(st.session_state.session_id)
+if not len(transcript) and not transcript.spilled:
+    transcript.append("assistant", "Welcome to Rivertown Ball Company! How can I help you today?")
+
+
+def render_orders(customer_name, orders):
+    """Order cards for an order lookup result"""
+    formatted_response = [f"## 📦 Orders for {customer_name}"]
+    for order_id, product, quantity, date_str, total_price in orders:
+        try:
+            date_obj = datetime.strptime(date_str, '%Y-%m-%d')
+            formatted_date = date_obj.strftime('%B %d, %Y')
+        except:
+            formatted_date = date_str
+
+        formatted_response.append(f"""
+<div style="background-color: rgba(255, 255, 255, 0.1); padding: 15px; border-radius: 10px; margin: 10px 0;">
+
+🔖 **Order ID**: `{order_id}`
+
+🎁 **Product**: {product}
+
+📊 **Quantity**: {quantity}
+
+📅 **Date**: {formatted_date}
+
+💰 **Total**: ${total_price:.2f}
+</div>""")
+    return "\n".join(formatted_response)
+
 
 # Create a container for chat messages
 chat_container = st.container()
 
 # Display chat messages from history on app rerun
 with chat_container:
-    for message in st.session_state.messages:
-        with st.chat_message(message["role"], avatar="🟤" if message["role"] == "assistant" else "👤"):
-            if message["role"] == "assistant" and isinstance(message["content"], dict) and message["content"].get("type") == "html":
-                st_html(message["content"]["content"], height=600, scrolling=True)
+    if transcript.spilled:
+        st.caption(f"{transcript.spilled} earlier messages archived")
+    for message in transcript.messages():
+        with st.chat_message(message.role, avatar="🟤" if message.role == "assistant" else "👤"):
+            if message.kind == KIND_ORDERS:
+                st.markdown(render_orders(*message.content), unsafe_allow_html=True)
             else:
-                st.markdown(message["content"])
+                st.markdown(message.content)
 
 # Accept user input
 if prompt := st.chat_input("Ask about our products..."):
@@ -165,10 +209,11 @@ if prompt := st.chat_input("Ask about our products..."):
         st.markdown(prompt)
     
     # Add user message to chat history
-    st.session_state.messages.append({"role": "user", "content": prompt})
+    transcript.append("user", prompt)
     
     # Display assistant response with thinking indicator
-    with st.chat_message("assistant", avatar="🟤"):
+    with st.chat_message("assistant", avatar="🟤"), request_context(session_id=st.session_state.session_id), \
+            profile_turn("app-turn", st.session_state.session_id):
         response_placeholder = st.empty()
         thinking_placeholder = st.empty()
         thinking_placeholder.markdown("_Thinking..._")
@@ -179,171 +224,108 @@ if prompt := st.chat_input("Ask about our products..."):
             response = "Great! Now, could you please provide your phone number?"
             thinking_placeholder.empty()
             response_placeholder.markdown(response)
-            st.session_state.messages.append({
-                "role": "assistant",
-                "content": response
-            })
+            transcript.append("assistant", response)
             st.session_state.phone_request_stage = "phone"
             st.stop()
             
         elif st.session_state.phone_request_stage == "phone":
             st.session_state.phone_number = prompt
             # Now we can make the call
-            bland_url = "https://api.bland.ai/v1/calls"
-            headers = {
-                "Authorization": f"Bearer {secrets.get('BLAND_API_KEY')}",
-                "Content-Type": "application/json"
-            }
-            
-            call_data = {
-                "phone_number": st.session_state.phone_number,
-                "task": "You are Sara from Rivertown Ball Company. Be friendly and professional while helping customers with wooden craft balls.",
-                "voice": "alexa",
-                "model": "turbo",
-                "first_sentence": f"Hello, is this {st.session_state.first_name}?",
-                "wait_for_greeting": True,
-                "after_greeting": f"Hey {st.session_state.first_name}, this is Sara from the Rivertown Ball Company. You were just online chatting and requested a quick call. How can I help you today?",
-                "temperature": 0.8,
-                "max_duration": 8
-            }
-            
-            try:
-                bland_response = requests.post(bland_url, json=call_data, headers=headers)
-                response = "Great! I'm connecting you with Sara right now. You should receive a call shortly." if bland_response.status_code == 200 else "I apologize, but I'm having trouble connecting the call. Please try again."
-            except Exception as e:
-                logger.error(f"Error making Bland API call: {e}")
+            if request_callback(secrets.get('BLAND_API_KEY'), st.session_state.phone_number, st.session_state.first_name):
+                response = "Great! I'm connecting you with Sara right now. You should receive a call shortly."
+            else:
                 response = "I apologize, but I'm having trouble connecting the call. Please try again."
             
             thinking_placeholder.empty()
             response_placeholder.markdown(response)
-            st.session_state.messages.append({
-                "role": "assistant",
-                "content": response
-            })
+            transcript.append("assistant", response)
             st.session_state.phone_request_stage = None
             st.stop()
         
-        # Check for order lookup requests first
-        if any(phrase in prompt.lower() for phrase in ['orders for', 'order for', 'show orders']):
+        # Route the prompt; a chat turn starts knowledge base retrieval right away
+        turn = start_turn(prompt, kb_client, session_id=st.session_state.session_id)
+        route_kind = ROUTE_CHAT
+        try:
             try:
-                # Extract name using regex to better handle the full phrase
-                name_match = re.search(r'(?:orders for|order for|show orders for)\s+([a-zA-Z]+)\s+([a-zA-Z]+)', prompt.lower())
-                
-                if name_match:
-                    first_name, last_name = name_match.groups()
-                    
-                    # Query DynamoDB
-                    table = dynamodb_client.Table('Rivertownball-cus')
-                    response = table.scan(
-                        FilterExpression='#fn = :fn and #ln = :ln',
-                        ExpressionAttributeNames={
-                            '#fn': 'first_name',
-                            '#ln': 'last_name'
-                        },
-                        ExpressionAttributeValues={
-                            ':fn': first_name.title(),
-                            ':ln': last_name.title()
-                        }
-                    )
-                    
-                    if 'Items' in response and len(response['Items']) > 0:
-                        customer = response['Items'][0]
-                        formatted_response = [f"## 📦 Orders for {first_name.title()} {last_name.title()}"]
-                        
-                        if 'orders' in customer and customer['orders']:
-                            for order in customer['orders']:
-                                date_str = order.get('order_date', '')
-                                try:
-                                    date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-                                    formatted_date = date_obj.strftime('%B %d, %Y')
-                                except:
-                                    formatted_date = date_str
-
-                                formatted_response.append(f"""
-<div style="background-color: rgba(255, 255, 255, 0.1); padding: 15px; border-radius: 10px; margin: 10px 0;">
-
-🔖 **Order ID**: `{order.get('order_id')}`
-
-🎁 **Product**: {order.get('product')}
-
-📊 **Quantity**: {order.get('quantity')}
-
-📅 **Date**: {formatted_date}
-
-💰 **Total**: ${float(order.get('total_price', 0)):.2f}
-</div>""")
-                        
-                        response_text = "\n".join(formatted_response)
-                        thinking_placeholder.empty()
-                        response_placeholder.markdown(response_text, unsafe_allow_html=True)
-                        st.session_state.messages.append({
-                            "role": "assistant",
-                            "content": response_text
-                        })
-                        st.stop()
-                    else:
-                        error_msg = f"I couldn't find any orders for {first_name.title()} {last_name.title()}. Please verify the spelling or try another name."
-                        thinking_placeholder.empty()
-                        response_placeholder.markdown(error_msg)
-                        st.session_state.messages.append({
-                            "role": "assistant",
-                            "content": error_msg
-                        })
-                        st.stop()
-                        
+                route, result = route_turn(turn, dynamodb_client, st.session_state.customer)
+                route_kind = route.kind
             except Exception as e:
-                logger.error(f"Error looking up orders: {str(e)}")
+                logger.error("Error looking up orders: %s", e)
                 error_msg = "I apologize, but I encountered an error while looking up the orders. Please try again."
                 thinking_placeholder.empty()
                 response_placeholder.markdown(error_msg)
-                st.session_state.messages.append({
-                    "role": "assistant",
-                    "content": error_msg
-                })
+                transcript.append("assistant", error_msg)
                 st.stop()
-        
-        # If no order lookup matched, get normal response from Claude
-        response = get_combined_response(runtime_client, kb_client, prompt)
-        
-        # Try to parse JSON from string response
-        if isinstance(response['content'], str):
-            try:
-                json_match = re.search(r'\{[\s\S]*\}', response['content'])
-                if json_match:
-                    content = json.loads(json_match.group())
-                    if content.get('type') == 'phone_request':
-                        response['content'] = content
-                        st.session_state.phone_request_stage = "name"
-            except (json.JSONDecodeError, AttributeError):
-                pass
+            
+            # Spend and order history questions are answered from the order data
+            if route.kind == ROUTE_ANALYTICS:
+                if result['customer']:
+                    st.session_state.customer = result['customer']
+                thinking_placeholder.empty()
+                response_placeholder.markdown(result['content'])
+                transcript.append("assistant", result['content'])
+                st.stop()
+            
+            # Order lookups: only a confident name match was looked up in DynamoDB
+            if route.kind == ROUTE_ORDERS:
+                match, orders, suggestions = result
+                if orders is not None:
+                    st.session_state.customer = (match['first_name'], match['last_name'])
+                    # Keep the raw order fields; the cards are rendered again on each rerun
+                    order_result = (f"{match['first_name']} {match['last_name']}", compact_orders(orders))
+                    thinking_placeholder.empty()
+                    response_placeholder.markdown(render_orders(*order_result), unsafe_allow_html=True)
+                    transcript.append("assistant", order_result, KIND_ORDERS)
+                    st.stop()
+                else:
+                    if suggestions:
+                        options = " or ".join(f"**{c['first_name']} {c['last_name']}**" for c in suggestions)
+                        error_msg = f"I couldn't find a customer named {route.name}. Did you mean {options}? Ask for \"orders for\" that name to see them."
+                    else:
+                        error_msg = f"I couldn't find any orders for {route.name}. Please verify the spelling or try another name."
+                    thinking_placeholder.empty()
+                    response_placeholder.markdown(error_msg)
+                    transcript.append("assistant", error_msg)
+                    st.stop()
+            
+            # If no order lookup matched, get normal response from Claude with the prefetched context
+            response = get_combined_response(runtime_client, kb_client, prompt, session_id=st.session_state.session_id,
+                                             context_provider=context_provider(turn))
+            
+            # Try to parse JSON from string response
+            phone_request = extract_phone_request(response['content'])
+            if phone_request:
+                st.session_state.phone_request_stage = "name"
 
-        # Remove thinking message and display response
-        thinking_placeholder.empty()
-        
-        # Display response
-        if isinstance(response['content'], dict) and response['content'].get('type') == 'phone_request':
-            message = response['content']['message']
-            response_placeholder.markdown(message)
-            st.session_state.messages.append({
-                "role": "assistant",
-                "content": message
-            })
-        else:
-            response_placeholder.markdown(response['content'])
-            st.session_state.messages.append({
-                "role": "assistant",
-                "content": response['content']
-            })
+            # Remove thinking message and display response
+            thinking_placeholder.empty()
+            
+            # Display response
+            if phone_request:
+                message = phone_request['message']
+                response_placeholder.markdown(message)
+                transcript.append("assistant", message)
+            else:
+                response_placeholder.markdown(response['content'])
+                transcript.append("assistant", response['content'])
+        finally:
+            turn.finish(route_kind)
 
 # Sidebar with reset button and additional info
 with st.sidebar:
     st.markdown("### Chat Controls")
     if st.button("Reset Chat", key="reset"):
-        st.session_state.messages = []
+        transcript.clear()
+        end_kb_session(st.session_state.session_id)
+        # Token usage stays with the session, so resetting the chat doesn't renew its budget
         st.session_state.phone_number = None
+        st.session_state.customer = None
         st.session_state.cs_mode = False
         st.experimental_rerun()
     
+    session_usage = get_usage_metrics(st.session_state.session_id)
+    st.caption(f"Tokens used this session: {session_usage['total_tokens']} ({session_usage['calls']} model calls)")
+    
     st.markdown("---")
     st.markdown("""
         ### About Us
@@ -351,21 +333,3 @@ with st.sidebar:
         for over a century. Our commitment to quality and craftsmanship 
         makes us the leading choice for wooden ball products.
     """)
-# Make the Bland API call
-bland_url = "https://api.bland.ai/v1/calls"
-headers = {
-    "Authorization": f"Bearer {secrets.get('BLAND_API_KEY')}",
-    "Content-Type": "application/json"
-}
-
-call_data = {
-    "phone_number": st.session_state.phone_number,
-    "task": "You are Sara from Rivertown Ball Company. Be friendly and professional while helping customers with wooden craft balls.",
-    "voice": "alexa",
-    "model": "turbo",
-    "first_sentence": f"Hello, is this {st.session_state.first_name}?",
-    "wait_for_greeting": True,
-    "after_greeting": f"Hey {st.session_state.first_name}, this is Sara from the Rivertown Ball Company. You were just online chatting and requested a quick call. How can I help you today?",
-    "temperature": 0.8,
-    "max_duration": 8
-}
@@ -1,14 +1,34 @@
 import boto3
 import json
 import logging
+from botocore.config import Config
 from botocore.exceptions import ClientError
-from typing import Dict, Optional
+from typing import Any, Dict, Iterator, Optional
 import os
+import time
+from usage_tracking import record_usage, get_budget_state, BUDGET_OK, DEGRADED_MAX_TOKENS
+from response_profiles import get_profile
+from cassette import wrap_client, is_replaying
+from region_router import RegionRouter, RoutedClient, parse_regions
+from admission import model_limiter, AdmissionRejected, busy_response, BUSY_MESSAGE
+from prompt_cache import system_blocks, user_blocks, stats as prompt_cache_stats
 
 logger = logging.getLogger(__name__)
 
+# Connections kept per client; must cover the number of threads sharing a client
+AWS_MAX_POOL_CONNECTIONS = int(os.getenv('AWS_MAX_POOL_CONNECTIONS', '50'))
+
+def client_config() -> Config:
+    """botocore config shared by all AWS clients"""
+    return Config(max_pool_connections=AWS_MAX_POOL_CONNECTIONS)
+
 def get_secret() -> Optional[Dict[str, str]]:
     """Get secrets from AWS Secrets Manager or fallback to environment variables"""
+    if is_replaying():
+        # Replay runs offline and secrets are never written to cassettes
+        logger.info("Cassette replay mode, using environment variables for secrets")
+        return _secrets_from_env()
+
     try:
         # First try to get secrets from AWS Secrets Manager
         session = boto3.session.Session()
@@ -21,8 +41,8 @@ def get_secret() -> Optional[Dict[str, str]]:
         
         # Update secret name to rivertownchat and add logging
         secret_name = os.getenv('SECRET_NAME', 'rivertownchat')
-        logger.info(f"Attempting to fetch secret with name: {secret_name}")
-        logger.info(f"Using AWS Region: {os.getenv('AWS_REGION', 'us-east-1')}")
+        logger.info("Attempting to fetch secret with name: %s", secret_name)
+        logger.info("Using AWS Region: %s", os.getenv('AWS_REGION', 'us-east-1'))
         
         try:
             get_secret_value_response = client.get_secret_value(SecretId=secret_name)
@@ -30,20 +50,25 @@ def get_secret() -> Optional[Dict[str, str]]:
                 logger.info("Successfully retrieved secret from AWS Secrets Manager")
                 return json.loads(get_secret_value_response['SecretString'])
         except client.exceptions.ResourceNotFoundException:
-            logger.warning(f"Secret {secret_name} not found in AWS Secrets Manager")
+            logger.warning("Secret %s not found in AWS Secrets Manager", secret_name)
         except Exception as e:
-            logger.warning(f"Error accessing AWS Secrets Manager: {str(e)}")
+            logger.warning("Error accessing AWS Secrets Manager: %s", e)
             
     except Exception as e:
-        logger.warning(f"Could not initialize AWS Secrets Manager client: {str(e)}")
+        logger.warning("Could not initialize AWS Secrets Manager client: %s", e)
     
     # Fallback to environment variables
     logger.info("Falling back to environment variables")
+    return _secrets_from_env()
+
+def _secrets_from_env() -> Dict[str, str]:
     return {
         'AWS_ACCESS_KEY_ID': os.getenv('AWS_ACCESS_KEY_ID'),
         'AWS_SECRET_ACCESS_KEY': os.getenv('AWS_SECRET_ACCESS_KEY'),
         'AWS_REGION': os.getenv('AWS_REGION', 'us-east-1'),
         'BLAND_API_KEY': os.getenv('BLAND_API_KEY'),
+        'BEDROCK_KB_ID': os.getenv('BEDROCK_KB_ID'),
+        'BEDROCK_MODEL_ARN': os.getenv('BEDROCK_MODEL_ARN'),
     }
 
 def init_bedrock():
@@ -54,29 +79,37 @@ def init_bedrock():
         if not secrets:
             raise Exception("Failed to get secrets from AWS Secrets Manager")
         
-        session = boto3.Session(
-            aws_access_key_id=secrets.get('AWS_ACCESS_KEY_ID'),
-            aws_secret_access_key=secrets.get('AWS_SECRET_ACCESS_KEY'),
-            region_name='us-east-1'
-        )
+        # Comma-separated list of regions to route between, e.g. "us-east-1,us-west-2"
+        regions = parse_regions(os.getenv('BEDROCK_REGIONS'))
+        clients = {}
+        for region in regions:
+            session = boto3.Session(
+                aws_access_key_id=secrets.get('AWS_ACCESS_KEY_ID'),
+                aws_secret_access_key=secrets.get('AWS_SECRET_ACCESS_KEY'),
+                region_name=region
+            )
+            
+            clients[region] = session.client(
+                service_name='bedrock-runtime',
+                region_name=region,
+                endpoint_url=f'https://bedrock-runtime.{region}.amazonaws.com',
+                config=client_config()
+            )
         
-        runtime_client = session.client(
-            service_name='bedrock-runtime',
-            region_name='us-east-1',
-            endpoint_url='https://bedrock-runtime.us-east-1.amazonaws.com'
-        )
+        runtime_client = clients[regions[0]]
+        if len(clients) > 1:
+            runtime_client = RoutedClient(RegionRouter('bedrock-runtime', clients))
         
-        return runtime_client
+        return wrap_client(runtime_client, 'bedrock-runtime')
         
     except Exception as e:
-        logger.error(f"Error initializing Bedrock runtime: {str(e)}")
+        logger.error("Error initializing Bedrock runtime: %s", e)
         raise e
 
-def get_claude_response(runtime_client, prompt: str) -> Dict[str, str]:
-    """Get response from Claude 3 Haiku"""
-    try:
-        # Format the system prompt
-        system_prompt = """You are assisting customers at Rivertown Ball Company, specializing in high-end wooden craft balls.
+# Bedrock model ID or inference profile; prompt caching needs a model listed in PROMPT_CACHE_MODELS
+CLAUDE_MODEL_ID = os.getenv('CLAUDE_MODEL_ID', "anthropic.claude-3-haiku-20240307-v1:0")
+
+SYSTEM_PROMPT = """You are assisting customers at Rivertown Ball Company, specializing in high-end wooden craft balls.
 
 Keep responses natural, concise, and friendly. Avoid formal phrases like "Thank you for your inquiry" or "As a knowledgeable assistant." Instead, respond as a helpful person would in a natural conversation.
 
@@ -89,34 +122,81 @@ If a customer asks to speak with someone, wants to make a phone call, or request
 
 For all other responses, be direct and friendly while sharing information about our premium wooden craft balls."""
 
-        # Combine system prompt with user prompt
-        full_prompt = f"{system_prompt}\n\nHuman: {prompt}\n\nAssistant:"
-
-        body = json.dumps({
-            "anthropic_version": "bedrock-2023-05-31",
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": full_prompt
-                        }
-                    ]
-                }
-            ],
-            "max_tokens": 2048,
-            "temperature": 0.7
-        })
+def _build_request_body(prompt: str, session_id: Optional[str], profile: Optional[str],
+                        context: Optional[str] = None):
+    """Build the invoke_model request body; returns (body bytes, max_tokens)"""
+    # Response-length profile decides max_tokens, stop sequences and length hint
+    profile_settings = get_profile(profile)
+    max_tokens = profile_settings["max_tokens"]
+
+    # Shorten responses once the session is over its soft token budget
+    if get_budget_state(session_id) != BUDGET_OK:
+        max_tokens = min(max_tokens, DEGRADED_MAX_TOKENS)
+        logger.info("Session %s over token budget, limiting max_tokens to %s", session_id, max_tokens)
+
+    hint = profile_settings.get("hint")
+    if hint:
+        prompt = f"{prompt}\n\n(Response length: {hint})"
+
+    # The system prefix is identical across calls, so Bedrock can serve it from its prompt cache
+    body = json.dumps({
+        "anthropic_version": "bedrock-2023-05-31",
+        "system": system_blocks(SYSTEM_PROMPT, CLAUDE_MODEL_ID),
+        "messages": [
+            {
+                "role": "user",
+                "content": user_blocks(prompt, context)
+            }
+        ],
+        "max_tokens": max_tokens,
+        "temperature": profile_settings["temperature"],
+        "stop_sequences": profile_settings["stop_sequences"]
+    })
+    return body.encode('utf-8'), max_tokens
+
+def get_claude_response(runtime_client, prompt: str, session_id: Optional[str] = None,
+                        profile: Optional[str] = None, context: Optional[str] = None) -> Dict[str, str]:
+    """Get response from Claude, within the process-wide limit on concurrent model calls.
+
+    `context` is retrieved knowledge base context sent ahead of the query.
+    """
+    try:
+        with model_limiter.slot(session_id):
+            return _invoke_claude(runtime_client, prompt, session_id, profile, context)
+    except AdmissionRejected:
+        return busy_response()
+
+def _invoke_claude(runtime_client, prompt: str, session_id: Optional[str], profile: Optional[str],
+                   context: Optional[str]) -> Dict[str, str]:
+    try:
+        body, max_tokens = _build_request_body(prompt, session_id, profile, context)
 
+        start_time = time.perf_counter()
         response = runtime_client.invoke_model(
-            modelId="anthropic.claude-3-haiku-20240307-v1:0",
+            modelId=CLAUDE_MODEL_ID,
             contentType="application/json",
             accept="application/json",
-            body=body.encode('utf-8')
+            body=body
         )
         
         response_body = json.loads(response['body'].read())
+        latency = time.perf_counter() - start_time
+
+        usage = response_body.get('usage', {})
+        cache_read, cache_write = prompt_cache_stats.record(usage, latency)
+        record_usage(
+            session_id,
+            CLAUDE_MODEL_ID,
+            usage.get('input_tokens', 0),
+            usage.get('output_tokens', 0),
+            latency,
+            source="invoke_model",
+            max_tokens=max_tokens,
+            profile=profile,
+            stop_reason=response_body.get('stop_reason'),
+            cache_read_input_tokens=cache_read,
+            cache_write_input_tokens=cache_write
+        )
         
         if 'content' in response_body:
             return {
@@ -124,19 +204,103 @@ For all other responses, be direct and friendly while sharing information about
                 "content": response_body['content'][0]['text'] if isinstance(response_body['content'], list) else response_body['content']
             }
         else:
-            logger.error(f"Unexpected response structure: {response_body.keys()}")
+            logger.error("Unexpected response structure: %s", response_body.keys())
             return {
                 "type": "text",
-                "content": "Error: Unexpected response format"
+                "content": "Error: Unexpected response format",
+                "error": True
             }
 
     except Exception as e:
-        logger.error(f"Error getting Claude response: {str(e)}")
+        logger.error("Error getting Claude response: %s", e)
         return {
             "type": "text",
-            "content": "I apologize, but I'm having trouble connecting. Please try again."
+            "content": "I apologize, but I'm having trouble connecting. Please try again.",
+            "error": True
         }
 
+def stream_claude_response(runtime_client, prompt: str, session_id: Optional[str] = None,
+                           profile: Optional[str] = None, context: Optional[str] = None,
+                           outcome: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+    """Stream response text chunks from Claude.
+
+    The model slot is held from the request until the response ends, fails or the
+    generator is closed. A consumer that may stop early must close it (see
+    contextlib.closing); an abandoned generator keeps the slot until it is collected.
+    Failures still yield a message for the user; `outcome`, if given, then gets the
+    same "error" (and "busy") flags as a get_claude_response() result.
+    """
+    if outcome is None:
+        outcome = {}
+    try:
+        queued = model_limiter.acquire(session_id)
+    except AdmissionRejected:
+        outcome.update(error=True, busy=True)
+        yield BUSY_MESSAGE
+        return
+    if queued:
+        logger.debug("invoke_model stream for session %s queued %.3fs", session_id, queued)
+    try:
+        yield from _stream_claude(runtime_client, prompt, session_id, profile, context, outcome)
+    finally:
+        model_limiter.release()
+
+def _stream_claude(runtime_client, prompt: str, session_id: Optional[str], profile: Optional[str],
+                   context: Optional[str], outcome: Dict[str, Any]) -> Iterator[str]:
+    response = None
+    try:
+        body, max_tokens = _build_request_body(prompt, session_id, profile, context)
+
+        start_time = time.perf_counter()
+        response = runtime_client.invoke_model_with_response_stream(
+            modelId=CLAUDE_MODEL_ID,
+            contentType="application/json",
+            accept="application/json",
+            body=body
+        )
+
+        usage = {}
+        output_tokens = 0
+        stop_reason = None
+        for event in response['body']:
+            chunk = json.loads(event['chunk']['bytes'])
+            if chunk.get('type') == 'message_start':
+                usage = chunk['message'].get('usage', {})
+            elif chunk.get('type') == 'content_block_delta':
+                text = chunk.get('delta', {}).get('text')
+                if text:
+                    yield text
+            elif chunk.get('type') == 'message_delta':
+                output_tokens = chunk.get('usage', {}).get('output_tokens', output_tokens)
+                stop_reason = chunk.get('delta', {}).get('stop_reason', stop_reason)
+
+        latency = time.perf_counter() - start_time
+        cache_read, cache_write = prompt_cache_stats.record(usage, latency)
+        record_usage(
+            session_id,
+            CLAUDE_MODEL_ID,
+            usage.get('input_tokens', 0),
+            output_tokens,
+            latency,
+            source="invoke_model",
+            max_tokens=max_tokens,
+            profile=profile,
+            stop_reason=stop_reason,
+            streamed=True,
+            cache_read_input_tokens=cache_read,
+            cache_write_input_tokens=cache_write
+        )
+
+    except Exception as e:
+        logger.error("Error streaming Claude response: %s", e)
+        outcome["error"] = True
+        yield "I apologize, but I'm having trouble connecting. Please try again."
+    finally:
+        # Stopping early (GeneratorExit) must not leave the HTTP connection streaming
+        close = getattr(response['body'], 'close', None) if response else None
+        if close:
+            close()
+
 def verify_bedrock_setup():
     """Verify that Bedrock is set up correctly"""
     try:
@@ -148,23 +312,21 @@ def verify_bedrock_setup():
             raise Exception("Failed to get secrets from AWS Secrets Manager")
             
         # Log partial keys for verification
-        logger.info(f"AWS_ACCESS_KEY_ID: {secrets.get('AWS_ACCESS_KEY_ID', '')[:4]}...{secrets.get('AWS_ACCESS_KEY_ID', '')[-4:]}")
-        logger.info(f"AWS_SECRET_ACCESS_KEY: {secrets.get('AWS_SECRET_ACCESS_KEY', '')[:4]}...{secrets.get('AWS_SECRET_ACCESS_KEY', '')[-4:]}")
-        logger.info(f"AWS_REGION: {secrets.get('AWS_REGION', 'us-east-1')}")
-        
-        # Initialize Bedrock client
-        runtime_client = init_bedrock()
+        logger.info("AWS_ACCESS_KEY_ID: %s...%s", secrets.get('AWS_ACCESS_KEY_ID', '')[:4], secrets.get('AWS_ACCESS_KEY_ID', '')[-4:])
+        logger.info("AWS_SECRET_ACCESS_KEY: %s...%s", secrets.get('AWS_SECRET_ACCESS_KEY', '')[:4], secrets.get('AWS_SECRET_ACCESS_KEY', '')[-4:])
+        logger.info("AWS_REGION: %s", secrets.get('AWS_REGION', 'us-east-1'))
         
-        # Test basic response
+        # Cheap control-plane checks instead of a model generation
+        from health import check_credentials, check_bedrock_model
         try:
-            test_response = get_claude_response(runtime_client, "Say 'test' if you can hear me")
-            logger.info(f"Test response: {test_response}")
+            logger.info(check_credentials(secrets))
+            logger.info(check_bedrock_model(secrets))
             logger.info("✅ Bedrock setup verification completed successfully")
             return True
         except Exception as e:
-            logger.error(f"❌ Bedrock setup verification failed: {str(e)}")
+            logger.error("❌ Bedrock setup verification failed: %s", e)
             raise e
             
     except Exception as e:
-        logger.error(f"❌ Error verifying Bedrock setup: {str(e)}")
+        logger.error("❌ Error verifying Bedrock setup: %s", e)
         return False
\ No newline at end of file
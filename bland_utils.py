@@ -0,0 +1,36 @@
+import logging
+from typing import Optional
+from cassette import http_post
+
+logger = logging.getLogger(__name__)
+
+BLAND_CALLS_URL = "https://api.bland.ai/v1/calls"
+
+def request_callback(api_key: Optional[str], phone_number: str, first_name: str) -> bool:
+    """Ask Bland AI to call the customer back. Returns True if the call was queued"""
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+
+    call_data = {
+        "phone_number": phone_number,
+        "task": "You are Sara from Rivertown Ball Company. Be friendly and professional while helping customers with wooden craft balls.",
+        "voice": "alexa",
+        "model": "turbo",
+        "first_sentence": f"Hello, is this {first_name}?",
+        "wait_for_greeting": True,
+        "after_greeting": f"Hey {first_name}, this is Sara from the Rivertown Ball Company. You were just online chatting and requested a quick call. How can I help you today?",
+        "temperature": 0.8,
+        "max_duration": 8
+    }
+
+    try:
+        bland_response = http_post(BLAND_CALLS_URL, call_data, headers=headers)
+        if bland_response.status_code != 200:
+            logger.error("Bland API returned %s: %s", bland_response.status_code, bland_response.text)
+            return False
+        return True
+    except Exception as e:
+        logger.error("Error making Bland API call: %s", e)
+        return False
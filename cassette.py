@@ -0,0 +1,363 @@
+import base64
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+from botocore.exceptions import ClientError
+from botocore.eventstream import EventStream
+from botocore.response import StreamingBody
+
+logger = logging.getLogger(__name__)
+
+MODE_OFF = "off"
+MODE_RECORD = "record"
+MODE_REPLAY = "replay"
+
+# off / record / replay
+CASSETTE_MODE = os.getenv('CASSETTE_MODE', MODE_OFF).lower()
+CASSETTE_PATH = os.getenv('CASSETTE_PATH', 'cassettes/default.jsonl.gz')
+# Sleep for the recorded duration when replaying
+CASSETTE_SIMULATE_LATENCY = os.getenv('CASSETTE_SIMULATE_LATENCY', 'false').lower() in ('1', 'true', 'yes')
+
+# Request fields that vary between environments or runs and must not affect matching
+IGNORED_KEY_FIELDS = frozenset({'knowledgeBaseId', 'modelArn', 'sessionId', 'Authorization'})
+
+# Client attributes that are never recorded
+_PASSTHROUGH_ATTRIBUTES = frozenset({
+    'meta', 'exceptions', 'can_paginate', 'get_paginator', 'get_waiter', 'close',
+})
+
+# DynamoDB Table operations that are recorded
+_TABLE_OPERATIONS = frozenset({
+    'scan', 'query', 'get_item', 'put_item', 'update_item', 'delete_item',
+})
+
+
+class CassetteMiss(Exception):
+    """Raised in replay mode when no recorded interaction matches a request"""
+
+
+class ReplayedError(Exception):
+    """A non-AWS exception that was recorded and is being replayed"""
+
+
+def _encode(value: Any) -> Any:
+    """Convert a boto3/requests response into JSON-safe data"""
+    if isinstance(value, dict):
+        return {k: _encode(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    if isinstance(value, (bytes, bytearray)):
+        return {"__bytes__": base64.b64encode(bytes(value)).decode('ascii')}
+    if isinstance(value, Decimal):
+        return {"__decimal__": str(value)}
+    if isinstance(value, (set, frozenset)):
+        return {"__set__": [_encode(v) for v in sorted(value, key=str)]}
+    if isinstance(value, datetime.datetime):
+        return {"__datetime__": value.isoformat()}
+    return value
+
+
+def _decode(value: Any) -> Any:
+    """Inverse of _encode"""
+    if isinstance(value, dict):
+        if "__bytes__" in value:
+            return base64.b64decode(value["__bytes__"])
+        if "__decimal__" in value:
+            return Decimal(value["__decimal__"])
+        if "__set__" in value:
+            return set(_decode(v) for v in value["__set__"])
+        if "__datetime__" in value:
+            return datetime.datetime.fromisoformat(value["__datetime__"])
+        return {k: _decode(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    return value
+
+
+def _key_view(value: Any) -> Any:
+    """Request data used for matching, without volatile fields"""
+    if isinstance(value, dict):
+        return {k: _key_view(v) for k, v in value.items() if k not in IGNORED_KEY_FIELDS}
+    if isinstance(value, (list, tuple)):
+        return [_key_view(v) for v in value]
+    if isinstance(value, (bytes, bytearray)):
+        # invoke_model bodies are JSON; match on their content rather than byte layout
+        try:
+            return _key_view(json.loads(value))
+        except ValueError:
+            return base64.b64encode(bytes(value)).decode('ascii')
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def request_key(service: str, operation: str, request: Dict[str, Any]) -> str:
+    """Stable hash identifying a request"""
+    canonical = json.dumps([service, operation, _key_view(request)], sort_keys=True, default=str)
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+def _with_streaming_bodies(response: Dict[str, Any]) -> Dict[str, Any]:
+    """Read StreamingBody values so they can be stored, returning the raw bytes"""
+    materialized = {}
+    for key, value in response.items():
+        if isinstance(value, StreamingBody):
+            value = value.read()
+        elif isinstance(value, EventStream):
+            # Response streams are recorded as the list of their events
+            value = list(value)
+        materialized[key] = value
+    return materialized
+
+
+def _as_streaming_bodies(response: Dict[str, Any]) -> Dict[str, Any]:
+    """Wrap top-level bytes values back into StreamingBody objects"""
+    restored = dict(response)
+    for key, value in response.items():
+        if isinstance(value, bytes):
+            restored[key] = StreamingBody(io.BytesIO(value), len(value))
+    return restored
+
+
+class Cassette:
+    """Recorded request/response pairs stored as gzipped JSON lines"""
+
+    def __init__(self, path: str, mode: str, simulate_latency: bool = False):
+        self.path = path
+        self.mode = mode
+        self.simulate_latency = simulate_latency
+        self._lock = threading.Lock()
+        self._interactions: Dict[str, List[Dict[str, Any]]] = {}
+        self._cursors: Dict[str, int] = {}
+        if mode == MODE_REPLAY:
+            self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            logger.warning("Cassette %s does not exist, every request will miss", self.path)
+            return
+        count = 0
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                self._interactions.setdefault(entry["key"], []).append(entry)
+                count += 1
+        logger.info("Loaded %s recorded interactions from %s", count, self.path)
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        line = json.dumps(entry, separators=(',', ':')) + "\n"
+        with self._lock:
+            # Each append is its own gzip member; gzip readers concatenate them
+            with gzip.open(self.path, 'at', encoding='utf-8') as f:
+                f.write(line)
+
+    def call(self, service: str, operation: str, func, request: Dict[str, Any],
+             encode_response=None, decode_response=None):
+        """Run a call through the cassette according to the current mode"""
+        key = request_key(service, operation, request)
+        if self.mode == MODE_REPLAY:
+            return self._replay(key, service, operation, decode_response)
+        if self.mode == MODE_RECORD:
+            return self._record(key, service, operation, func, encode_response)
+        return func()
+
+    def _record(self, key: str, service: str, operation: str, func, encode_response):
+        entry = {"key": key, "service": service, "operation": operation}
+        start_time = time.perf_counter()
+        try:
+            response = func()
+        except ClientError as e:
+            entry["duration"] = time.perf_counter() - start_time
+            entry["client_error"] = _encode(e.response)
+            self._append(entry)
+            raise
+        except Exception as e:
+            entry["duration"] = time.perf_counter() - start_time
+            entry["error"] = {"type": type(e).__name__, "message": str(e)}
+            self._append(entry)
+            raise
+        entry["duration"] = time.perf_counter() - start_time
+
+        stored, response = encode_response(response) if encode_response else (response, response)
+        entry["response"] = _encode(stored)
+        self._append(entry)
+        return response
+
+    def _replay(self, key: str, service: str, operation: str, decode_response):
+        with self._lock:
+            entries = self._interactions.get(key)
+            if not entries:
+                raise CassetteMiss(f"No recorded {service}.{operation} matches this request ({key})")
+            # Repeated identical requests replay in recorded order, then stick to the last one
+            cursor = self._cursors.get(key, 0)
+            entry = entries[min(cursor, len(entries) - 1)]
+            self._cursors[key] = cursor + 1
+
+        if self.simulate_latency:
+            time.sleep(entry.get("duration", 0))
+
+        if "client_error" in entry:
+            raise ClientError(_decode(entry["client_error"]), operation)
+        if "error" in entry:
+            raise ReplayedError(f"{entry['error']['type']}: {entry['error']['message']}")
+
+        response = _decode(entry["response"])
+        return decode_response(response) if decode_response else response
+
+
+def _encode_boto_response(response):
+    materialized = _with_streaming_bodies(response)
+    # Return a fresh StreamingBody so callers can still .read() the body
+    return materialized, _as_streaming_bodies(materialized)
+
+
+class RecordingClient:
+    """Proxy around a boto3 client that records or replays every API call"""
+
+    def __init__(self, client, service: str, cassette: Cassette):
+        self._client = client
+        self._service = service
+        self._cassette = cassette
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name in _PASSTHROUGH_ATTRIBUTES:
+            return getattr(self._client, name)
+        # Replay never touches the real client, so it may be a placeholder
+        attribute = None
+        if self._cassette.mode != MODE_REPLAY:
+            attribute = getattr(self._client, name)
+            if not callable(attribute):
+                return attribute
+
+        def recorded_call(*args, **kwargs):
+            return self._cassette.call(
+                self._service, name, lambda: attribute(*args, **kwargs), kwargs,
+                encode_response=_encode_boto_response,
+                decode_response=_as_streaming_bodies
+            )
+        return recorded_call
+
+
+class RecordingTable:
+    """Proxy around a DynamoDB Table resource recording item operations"""
+
+    def __init__(self, table, cassette: Cassette):
+        self._table = table
+        self._cassette = cassette
+
+    def __getattr__(self, name):
+        if name not in _TABLE_OPERATIONS:
+            return getattr(self._table, name)
+        attribute = getattr(self._table, name)
+
+        def recorded_call(*args, **kwargs):
+            request = dict(kwargs, TableName=self._table.name)
+            return self._cassette.call('dynamodb', name, lambda: attribute(*args, **kwargs), request)
+        return recorded_call
+
+
+class RecordingResource:
+    """Proxy around a DynamoDB service resource whose tables are recorded"""
+
+    def __init__(self, resource, cassette: Cassette):
+        self._resource = resource
+        self._cassette = cassette
+
+    def Table(self, name):
+        return RecordingTable(self._resource.Table(name), self._cassette)
+
+    def __getattr__(self, name):
+        return getattr(self._resource, name)
+
+
+class ReplayedHTTPResponse:
+    """Minimal stand-in for requests.Response built from a recorded interaction"""
+
+    def __init__(self, status_code: int, text: str, headers: Optional[Dict[str, str]] = None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def _encode_http_response(response):
+    stored = {
+        "status_code": response.status_code,
+        "text": response.text,
+        "headers": {"Content-Type": response.headers.get("Content-Type", "")},
+    }
+    return stored, response
+
+
+def _decode_http_response(stored):
+    return ReplayedHTTPResponse(stored["status_code"], stored["text"], stored.get("headers"))
+
+
+_active_cassette: Optional[Cassette] = None
+_active_lock = threading.Lock()
+
+
+def get_cassette() -> Optional[Cassette]:
+    """Process-wide cassette for the configured mode, or None when disabled"""
+    global _active_cassette
+    if CASSETTE_MODE not in (MODE_RECORD, MODE_REPLAY):
+        return None
+    with _active_lock:
+        if _active_cassette is None:
+            _active_cassette = Cassette(CASSETTE_PATH, CASSETTE_MODE, CASSETTE_SIMULATE_LATENCY)
+            logger.info("Cassette %s mode using %s", CASSETTE_MODE, CASSETTE_PATH)
+        return _active_cassette
+
+
+def is_replaying() -> bool:
+    return CASSETTE_MODE == MODE_REPLAY
+
+
+def wrap_client(client, service: str):
+    """Wrap a boto3 client for record/replay; returns it unchanged when disabled"""
+    cassette = get_cassette()
+    if cassette is None:
+        return client
+    return RecordingClient(client, service, cassette)
+
+
+def wrap_dynamodb_resource(resource):
+    """Wrap a DynamoDB service resource for record/replay"""
+    cassette = get_cassette()
+    if cassette is None:
+        return resource
+    return RecordingResource(resource, cassette)
+
+
+def http_post(url: str, json_body: Dict[str, Any], headers: Optional[Dict[str, str]] = None, **kwargs):
+    """requests.post through the cassette (headers are never stored or matched)"""
+    import requests
+
+    cassette = get_cassette()
+    send = lambda: requests.post(url, json=json_body, headers=headers, **kwargs)
+    if cassette is None:
+        return send()
+    return cassette.call(
+        'http', f"POST {url}", send, {"url": url, "json": json_body},
+        encode_response=_encode_http_response,
+        decode_response=_decode_http_response
+    )
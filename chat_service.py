@@ -1,27 +1,156 @@
-from typing import Dict
-from bedrock_utils import get_claude_response
-from knowledge_base import get_knowledge_base_response
+from typing import Callable, Dict, Iterator, Optional, Any
+from contextlib import closing
+from functools import lru_cache
+import hashlib
+import json
+import re
+from bedrock_utils import get_claude_response, stream_claude_response, CLAUDE_MODEL_ID, SYSTEM_PROMPT
+from knowledge_base import get_knowledge_base_response, KB_CONTEXT_MODE
+from usage_tracking import get_budget_state, BUDGET_EXHAUSTED
+from response_profiles import select_profile
+from answer_store import get_precomputed_answer, source_fingerprint, KNOWLEDGE_BASE_PATH
+from log_utils import Payload
+from admission import AdmissionRejected, busy_response, BUSY_MESSAGE
+from profiling import profile_turn
+from shared_cache import get_cache
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
-def get_combined_response(runtime_client, kb_client, prompt: str) -> Dict[str, str]:
-    """Combine knowledge base and Claude responses"""
+BUDGET_EXHAUSTED_MESSAGE = (
+    "We've chatted quite a bit! For anything else, please reach out to our team "
+    "directly and we'll be happy to help."
+)
+
+# Namespace and lifetime of generated answers in the shared cache, used to keep answering once a session's budget is spent
+ANSWER_CACHE_NAMESPACE = "answers"
+ANSWER_CACHE_TTL = float(os.getenv('ANSWER_CACHE_TTL', '86400'))
+
+@lru_cache(maxsize=1)
+def answer_cache_namespace() -> str:
+    """Answers namespace for the current model, system prompt and knowledge base.
+
+    A deploy that changes any of them starts from an empty namespace instead of
+    serving answers generated by the previous one; old entries expire by TTL.
+    """
+    digest = hashlib.sha256()
+    for part in (CLAUDE_MODEL_ID, SYSTEM_PROMPT, KB_CONTEXT_MODE):
+        digest.update(part.encode('utf-8') + b'\0')
     try:
-        # First try to get relevant knowledge
-        kb_context = get_knowledge_base_response(kb_client, prompt)
-        logger.debug(f"Knowledge base context: {kb_context}")
+        digest.update(source_fingerprint(KNOWLEDGE_BASE_PATH).encode('ascii'))
+    except OSError as e:
+        logger.warning("Knowledge base %s not readable for the answer cache version: %s", KNOWLEDGE_BASE_PATH, e)
+    return f"{ANSWER_CACHE_NAMESPACE}-{digest.hexdigest()[:12]}"
+
+def _cache_key(prompt: str) -> str:
+    return " ".join(prompt.lower().split())
 
-        # Combine context with prompt
-        full_prompt = f"""Context:
-{kb_context if kb_context else 'No additional context available.'}
+def _remember_answer(prompt: str, response: Dict[str, str]) -> None:
+    if response.get('error'):
+        return
+    get_cache().set(answer_cache_namespace(), _cache_key(prompt), response, ttl=ANSWER_CACHE_TTL)
 
-Customer Query:
-{prompt}"""
+def get_cached_answer(prompt: str) -> Optional[Dict[str, str]]:
+    """Return a previously generated answer for the same question, from any worker process"""
+    return get_cache().get(answer_cache_namespace(), _cache_key(prompt))
+
+def extract_phone_request(content: Any) -> Optional[Dict[str, Any]]:
+    """Return the phone_request JSON embedded in a Claude answer, if present"""
+    if isinstance(content, dict):
+        return content if content.get('type') == 'phone_request' else None
+    if not isinstance(content, str):
+        return None
+    try:
+        json_match = re.search(r'\{[\s\S]*\}', content)
+        if json_match:
+            parsed = json.loads(json_match.group())
+            if isinstance(parsed, dict) and parsed.get('type') == 'phone_request':
+                return parsed
+    except (json.JSONDecodeError, AttributeError):
+        pass
+    return None
+
+def _budget_exhausted_response(prompt: str, session_id: Optional[str]) -> Optional[Dict[str, str]]:
+    """Sessions that spent their token budget only get cached answers"""
+    if get_budget_state(session_id) != BUDGET_EXHAUSTED:
+        return None
+    logger.info("Session %s exhausted its token budget, serving cache only", session_id)
+    cached = get_cached_answer(prompt)
+    if cached:
+        return cached
+    return {"type": "text", "content": BUDGET_EXHAUSTED_MESSAGE}
+
+def _kb_context(kb_client, prompt: str, session_id: Optional[str], context_provider: Optional[Callable[[], str]]) -> str:
+    # A turn scheduler may already have started retrieval for this prompt
+    if context_provider is not None:
+        return context_provider()
+    return get_knowledge_base_response(kb_client, prompt, session_id=session_id)
+
+def get_combined_response(runtime_client, kb_client, prompt: str, session_id: Optional[str] = None,
+                          context_provider: Optional[Callable[[], str]] = None) -> Dict[str, str]:
+    """Combine knowledge base and Claude responses"""
+    with profile_turn("combined-response", session_id):
+        return _combined_response(runtime_client, kb_client, prompt, session_id, context_provider)
+
+def _combined_response(runtime_client, kb_client, prompt: str, session_id: Optional[str],
+                       context_provider: Optional[Callable[[], str]]) -> Dict[str, str]:
+    # Curated FAQ/product questions are answered from the precomputed store
+    precomputed = get_precomputed_answer(prompt)
+    if precomputed:
+        return precomputed
+
+    exhausted = _budget_exhausted_response(prompt, session_id)
+    if exhausted:
+        return exhausted
+
+    profile = select_profile(prompt)
+    logger.debug("Selected response profile: %s", profile)
+
+    try:
+        # First try to get relevant knowledge
+        kb_context = _kb_context(kb_client, prompt, session_id, context_provider)
+        logger.debug("Knowledge base context: %s", Payload(kb_context))
 
         # Get Claude response
-        return get_claude_response(runtime_client, full_prompt)
+        response = get_claude_response(runtime_client, prompt, session_id=session_id, profile=profile, context=kb_context)
+        _remember_answer(prompt, response)
+        return response
 
+    except AdmissionRejected:
+        # Too busy to retrieve context; calling Claude anyway would only deepen the backlog
+        return busy_response()
     except Exception as e:
-        logger.error(f"Error getting combined response: {str(e)}")
-        return get_claude_response(runtime_client, prompt)  # Fallback to just Claude 
\ No newline at end of file
+        logger.error("Error getting combined response: %s", e)
+        return get_claude_response(runtime_client, prompt, session_id=session_id, profile=profile)  # Fallback to just Claude
+
+def stream_combined_response(runtime_client, kb_client, prompt: str, session_id: Optional[str] = None,
+                             context_provider: Optional[Callable[[], str]] = None) -> Iterator[str]:
+    """Streaming variant of get_combined_response yielding text chunks"""
+    precomputed = get_precomputed_answer(prompt)
+    if precomputed:
+        yield precomputed['content']
+        return
+
+    exhausted = _budget_exhausted_response(prompt, session_id)
+    if exhausted:
+        yield exhausted['content']
+        return
+
+    profile = select_profile(prompt)
+    try:
+        kb_context = _kb_context(kb_client, prompt, session_id, context_provider)
+    except AdmissionRejected:
+        yield BUSY_MESSAGE
+        return
+
+    chunks = []
+    outcome: Dict[str, Any] = {}
+    # Closing this generator early (client gone) closes the model stream and frees its slot right away
+    with closing(stream_claude_response(runtime_client, prompt, session_id=session_id, profile=profile,
+                                        context=kb_context, outcome=outcome)) as stream:
+        for chunk in stream:
+            chunks.append(chunk)
+            yield chunk
+    # Busy and connection-failure messages are flagged in `outcome` and never cached
+    _remember_answer(prompt, dict(outcome, type="text", content="".join(chunks)))
@@ -18,9 +18,20 @@ def convert_json_to_text(json_file):
             print(clean_content)
             print("\n---\n")  # Separator between entries
 
+def build_binary_index(json_file, index_file):
+    """Write the memory-mapped search index the app opens (see kb_index.py)"""
+    from kb_index import build_index
+    counts = build_index(json_file, index_file)
+    print(f"Wrote {index_file}: {counts['chunks']} chunks, {counts['terms']} terms, "
+          f"{counts['postings']} postings, {counts['bytes']} bytes", file=sys.stderr)
+
 if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[2] == "--index":
+        build_binary_index(sys.argv[1], sys.argv[3])
+        sys.exit(0)
     if len(sys.argv) != 2:
         print("Usage: python convert_to_text.py input.json > output.txt")
+        print("       python convert_to_text.py input.json --index kb_index.bin")
         sys.exit(1)
     
     convert_json_to_text(sys.argv[1])
@@ -1,17 +1,56 @@
 import logging
-from typing import Optional, List, Dict
+import os
+import threading
+from typing import Any, Optional, List, Dict, Tuple
 import boto3
 from boto3.dynamodb.conditions import Attr
 from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
 from datetime import datetime
-from bedrock_utils import get_secret
+from bedrock_utils import get_secret, client_config
+from cassette import wrap_dynamodb_resource
+from log_utils import Payload
+from name_index import customer_index, CUSTOMER_TABLE, CUSTOMER_KEY_ATTRIBUTES
+from shared_cache import get_cache
+from order_store import customer_orders, query_orders, ORDERS_TABLE, ORDER_READ_MODE, ORDER_PARTITION_KEY, READ_ORDERS
 
 logger = logging.getLogger(__name__)
 deserializer = TypeDeserializer()
 
+# DynamoDB Local (or another compatible endpoint) instead of the regional service
+DYNAMODB_ENDPOINT_URL = os.getenv('DYNAMODB_ENDPOINT_URL')
+# Serve the customer table from a synthetic_data.py file in-process, with no AWS access at all
+DYNAMODB_LOCAL_DATA = os.getenv('DYNAMODB_LOCAL_DATA')
+# Seconds a customer's orders are served from the shared cache before DynamoDB is read again (0 disables)
+ORDER_CACHE_TTL = float(os.getenv('ORDER_CACHE_TTL', '60'))
+ORDER_CACHE_NAMESPACE = "orders"
+# Look up a name the index doesn't know with a filtered scan (once per name between refreshes), for customers
+# written by other processes since the last refresh. Each such scan reads the whole table
+NAME_INDEX_MISS_SCAN = os.getenv('NAME_INDEX_MISS_SCAN', 'false').lower() in ('1', 'true', 'yes')
+
+_local_dynamodb = None
+_local_lock = threading.Lock()
+# Set once GetItem has rejected the configured key attributes, so lookups stop trying it
+_key_schema_mismatch = False
+
+def _init_local_dynamodb():
+    """Shared in-process stand-in loaded from DYNAMODB_LOCAL_DATA"""
+    global _local_dynamodb
+    with _local_lock:
+        if _local_dynamodb is None:
+            from local_dynamodb import LocalDynamoDB
+            local = LocalDynamoDB()
+            count = local.load_jsonl(CUSTOMER_TABLE, DYNAMODB_LOCAL_DATA)
+            logger.info("Loaded %s customers from %s into the local table", count, DYNAMODB_LOCAL_DATA)
+            _local_dynamodb = local
+        return _local_dynamodb
+
 def init_dynamodb():
     """Initialize and return DynamoDB resource"""
     try:
+        if DYNAMODB_LOCAL_DATA:
+            return _init_local_dynamodb()
+
         # Get secrets from AWS Secrets Manager
         secrets = get_secret()
         if not secrets:
@@ -27,84 +66,190 @@ def init_dynamodb():
             'region_name': region
         }
         
+        if DYNAMODB_ENDPOINT_URL:
+            aws_config['endpoint_url'] = DYNAMODB_ENDPOINT_URL
+        
         # Initialize DynamoDB resource with explicit configuration
-        dynamodb = boto3.resource('dynamodb', **aws_config)
+        dynamodb = boto3.resource('dynamodb', config=client_config(), **aws_config)
         
-        return dynamodb
+        return wrap_dynamodb_resource(dynamodb)
         
     except Exception as e:
-        logger.error(f"Error initializing DynamoDB: {str(e)}")
+        logger.error("Error initializing DynamoDB: %s", e)
         raise e
 
+def resolve_customer_name(dynamodb, name: str) -> Tuple[Optional[Dict], List[Dict]]:
+    """
+    Match a typed customer name against the name index
+    Returns the confident match (or None) and ranked "did you mean" suggestions
+    """
+    if not customer_index.ensure_loaded(dynamodb):
+        return None, []
+    return customer_index.resolve(name)
+
+def lookup_customer_orders(dynamodb, name: str) -> Tuple[Optional[Dict], Optional[List[Dict]], List[Dict]]:
+    """
+    Orders for a typed customer name
+    Returns (match, orders, suggestions); orders is None when no customer matched exactly
+    """
+    match, suggestions = resolve_customer_name(dynamodb, name)
+    if match:
+        return match, get_customer_orders(dynamodb, match['first_name'], match['last_name']), suggestions
+    # The customer may have been added by another process since the index was last refreshed
+    first_name, _, last_name = ' '.join(name.split()).partition(' ')
+    orders = get_customer_orders(dynamodb, first_name, last_name) if last_name and NAME_INDEX_MISS_SCAN else None
+    if orders is None:
+        return None, None, suggestions
+    return {"first_name": first_name.title(), "last_name": last_name.title(), "score": 1.0}, orders, []
+
+def find_customer_by_key(table, key: Dict[str, Any], first_name: str, last_name: str) -> Optional[Dict]:
+    """Single GetItem for a customer whose key the name index knows; None if the key is stale"""
+    item = table.get_item(Key=key).get('Item')
+    if item and item.get('first_name') == first_name and item.get('last_name') == last_name:
+        return item
+    return None
+
+def find_customer_by_scan(table, first_name: str, last_name: str) -> Optional[Dict]:
+    """Filtered scan for a customer by exact name"""
+    scan_request = {
+        'FilterExpression': '#fn = :fn and #ln = :ln',
+        'ExpressionAttributeNames': {
+            '#fn': 'first_name',
+            '#ln': 'last_name'
+        },
+        'ExpressionAttributeValues': {
+            ':fn': first_name,
+            ':ln': last_name
+        }
+    }
+    # A filtered scan reads one page at a time, so keep going until the customer turns up
+    while True:
+        response = table.scan(**scan_request)
+        logger.debug("Raw DynamoDB response: %s", Payload(response))
+        items = response.get('Items', [])
+        if items or 'LastEvaluatedKey' not in response:
+            break
+        scan_request['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    
+    logger.info("Found %s matching customers", len(items))
+    return items[0] if items else None
+
+def _format_orders(order_list: List[Dict]) -> List[Dict]:
+    """Orders as shown to customers; malformed orders are logged and skipped"""
+    orders = []
+    for order in order_list:
+        try:
+            # Convert date to more readable format
+            date_obj = datetime.strptime(order['order_date'], '%Y-%m-%d')
+            formatted_date = date_obj.strftime('%B %d, %Y')
+            
+            processed_order = {
+                'order_id': order['order_id'],
+                'product': order['product'],
+                'quantity': int(order['quantity']),
+                'order_date': formatted_date,
+                'total_price': float(order['total_price'])
+            }
+            logger.debug("Processed order: %s", processed_order)
+            orders.append(processed_order)
+        except Exception as e:
+            logger.error("Error processing order: %s", e)
+            logger.error("Problem order data: %s", order)
+            continue
+    
+    logger.info("Successfully processed %s orders", len(orders))
+    return orders
+
+def _orders_from_table(dynamodb, customer_id) -> Optional[List[Dict]]:
+    """
+    Orders from the one-item-per-order table alone, or None to read the customer item
+    Only in "orders" mode: in dual mode the nested list may hold orders the table lacks
+    """
+    if ORDER_READ_MODE != READ_ORDERS or customer_id is None:
+        return None
+    items = query_orders(dynamodb.Table(ORDERS_TABLE), customer_id)
+    logger.info("Read %s orders for customer %s from %s", len(items), customer_id, ORDERS_TABLE)
+    return _format_orders(items)
+
 def get_customer_orders(dynamodb, first_name: str, last_name: str) -> Optional[List[Dict]]:
     """
     Retrieve customer orders from DynamoDB by customer name
     Returns None if customer not found
     """
-    table = dynamodb.Table('Rivertownball-cus')
-    
     try:
-        # Convert input names to title case for consistency
-        first_name = first_name.title()
-        last_name = last_name.title()
-        
-        logger.info(f"Querying DynamoDB for {first_name} {last_name}")
-        
-        response = table.scan(
-            FilterExpression='#fn = :fn and #ln = :ln',
-            ExpressionAttributeNames={
-                '#fn': 'first_name',
-                '#ln': 'last_name'
-            },
-            ExpressionAttributeValues={
-                ':fn': first_name,
-                ':ln': last_name
-            }
-        )
-        
-        logger.debug(f"Raw DynamoDB response: {response}")
-        
-        items = response.get('Items', [])
-        logger.info(f"Found {len(items)} matching customers")
-        
-        if not items:
-            logger.info("No customer found")
-            return None
-            
-        customer = items[0]
-        logger.debug(f"Customer data: {customer}")
-        
-        orders = []
-        if 'orders' in customer:
-            order_list = customer['orders']
-            logger.debug(f"Raw orders data: {order_list}")
-            
-            for order in order_list:
-                try:
-                    # Convert date to more readable format
-                    date_obj = datetime.strptime(order['order_date'], '%Y-%m-%d')
-                    formatted_date = date_obj.strftime('%B %d, %Y')
-                    
-                    processed_order = {
-                        'order_id': order['order_id'],
-                        'product': order['product'],
-                        'quantity': int(order['quantity']),
-                        'order_date': formatted_date,
-                        'total_price': float(order['total_price'])
-                    }
-                    logger.debug(f"Processed order: {processed_order}")
-                    orders.append(processed_order)
-                except Exception as e:
-                    logger.error(f"Error processing order: {e}")
-                    logger.error(f"Problem order data: {order}")
-                    continue
-            
-            logger.info(f"Successfully processed {len(orders)} orders")
+        key = None
+        match = None
+        if customer_index.ensure_loaded(dynamodb):
+            # Case, accent and punctuation variants resolve to the name as stored
+            match, _ = customer_index.resolve(f"{first_name} {last_name}")
+            if match:
+                first_name, last_name = match['first_name'], match['last_name']
+                key = customer_index.key_for(first_name, last_name)
+            else:
+                logger.info("%s %s is not in the name index", first_name, last_name)
+                if not (NAME_INDEX_MISS_SCAN and customer_index.claim_miss_scan(first_name, last_name)):
+                    return None
+        if not match:
+            # Index unavailable or missing the name: exact title-cased match as before
+            first_name = first_name.title()
+            last_name = last_name.title()
+
+        # Lookups from any worker process within the TTL share one DynamoDB read
+        cache_key = f"{first_name}\t{last_name}"
+        orders = get_cache().get(ORDER_CACHE_NAMESPACE, cache_key)
+        if orders is not None:
+            logger.info("Orders for %s %s served from the shared cache", first_name, last_name)
             return orders
-        
-        logger.info("No orders found in customer record")
-        return []
+
+        orders = _read_customer_orders(dynamodb, first_name, last_name, key)
+        if orders is not None and ORDER_CACHE_TTL > 0:
+            get_cache().set(ORDER_CACHE_NAMESPACE, cache_key, orders, ttl=ORDER_CACHE_TTL)
+        return orders
         
     except Exception as e:
-        logger.error(f"Error querying DynamoDB: {e}", exc_info=True)
+        logger.error("Error querying DynamoDB: %s", e, exc_info=True)
         return None
+
+def _read_customer_orders(dynamodb, first_name: str, last_name: str, key: Optional[Dict[str, Any]]) -> Optional[List[Dict]]:
+    """Orders of a customer by the name as stored, using the table key when the index knows it"""
+    global _key_schema_mismatch
+    table = dynamodb.Table(CUSTOMER_TABLE)
+    customer = None
+    if key:
+        # In "orders" mode the (large) customer item isn't read at all
+        orders = _orders_from_table(dynamodb, key.get(ORDER_PARTITION_KEY))
+        if orders is not None:
+            return orders
+    if key and not _key_schema_mismatch:
+        logger.info("Reading customer %s %s by key", first_name, last_name)
+        try:
+            customer = find_customer_by_key(table, key, first_name, last_name)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'ValidationException':
+                raise
+            _key_schema_mismatch = True
+            logger.error("Configuration error: CUSTOMER_KEY_ATTRIBUTES %s is not the key of %s (%s); "
+                         "falling back to scans for customer lookups", CUSTOMER_KEY_ATTRIBUTES, CUSTOMER_TABLE, e)
+    
+    if customer is None:
+        logger.info("Querying DynamoDB for %s %s", first_name, last_name)
+        customer = find_customer_by_scan(table, first_name, last_name)
+        if customer:
+            # Found by scan, so the index didn't have it (or had a stale key)
+            customer_index.add_customer(customer)
+    
+    if not customer:
+        logger.info("No customer found")
+        customer_index.remove(first_name, last_name)
+        return None
+        
+    logger.debug("Customer data: %s", Payload(customer))
+    
+    # The nested list, the orders table, or in dual mode both merged by order ID
+    order_list = customer_orders(dynamodb.Table(ORDERS_TABLE), customer, ORDER_READ_MODE)
+    if order_list:
+        logger.debug("Raw orders data: %s", Payload(order_list))
+        return _format_orders(order_list)
+    
+    logger.info("No orders found in customer record")
+    return []
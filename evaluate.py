@@ -0,0 +1,286 @@
+"""Offline evaluation of chat answers: accuracy, latency and token usage per variant.
+
+Usage:
+    python evaluate.py [--questions eval_questions.jsonl] [--concurrency 8] [--output eval_report.json]
+    python evaluate.py --variant baseline --variant "local-kb:KB_CONTEXT_MODE=local"
+
+Each line of the question set is a JSON object with an `id`, a `question`, an optional
+`category` and `expected`: the facts a good answer mentions. A fact is a string, or a
+list of alternative strings of which any one counts; matching ignores case and
+whitespace. An answer's coverage is the fraction of its facts found, and it passes when
+coverage reaches `--pass-coverage`.
+
+A variant is a name and environment overrides (`NAME:KEY=VALUE,KEY=VALUE`). Modules read
+their configuration at import, so each variant runs in its own process, with the answer
+cache in memory so one variant never answers from another's cache. Questions run
+through `get_combined_response` on a bounded thread pool, each in its own session, so
+token usage is per question.
+
+For offline runs set CASSETTE_MODE=replay (and optionally CASSETTE_SIMULATE_LATENCY=true)
+against a cassette recorded from the same question set and variants.
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+DEFAULT_QUESTIONS = "eval_questions.jsonl"
+DEFAULT_VARIANT = "baseline"
+
+# Environment every variant starts from; a variant's own overrides win
+VARIANT_DEFAULTS = {"CACHE_BACKEND": "memory"}
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def load_questions(path: str) -> List[Dict[str, Any]]:
+    """Read a JSONL question set, skipping blank lines"""
+    questions = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            question = json.loads(line)
+            if not question.get('question'):
+                raise ValueError(f"{path}:{line_number}: missing question")
+            question.setdefault('id', f"q{line_number}")
+            question.setdefault('category', "Uncategorized")
+            question.setdefault('expected', [])
+            questions.append(question)
+    return questions
+
+
+def score_answer(answer: str, expected: List[Any]) -> Tuple[float, List[str]]:
+    """Fraction of expected facts the answer mentions, and the facts it missed"""
+    if not expected:
+        return 1.0, []
+    text = _normalize(answer)
+    missing = []
+    for fact in expected:
+        alternatives = fact if isinstance(fact, list) else [fact]
+        if not any(_normalize(alternative) in text for alternative in alternatives):
+            missing.append(" | ".join(alternatives))
+    return (len(expected) - len(missing)) / len(expected), missing
+
+
+def parse_variant(spec: str) -> Tuple[str, Dict[str, str]]:
+    """`name:KEY=VALUE,KEY=VALUE` -> (name, overrides)"""
+    name, _, assignments = spec.partition(':')
+    overrides = {}
+    for assignment in filter(None, (a.strip() for a in assignments.split(','))):
+        key, sep, value = assignment.partition('=')
+        if not sep or not key.strip():
+            raise ValueError(f"Variant {name!r}: expected KEY=VALUE, got {assignment!r}")
+        overrides[key.strip()] = value.strip()
+    return name.strip() or DEFAULT_VARIANT, overrides
+
+
+def _answer_source(response: Dict[str, Any]) -> str:
+    if response.get('busy'):
+        return "busy"
+    if response.get('error'):
+        return "error"
+    if response.get('precomputed'):
+        return "precomputed"
+    return "model"
+
+
+def run_questions(questions: List[Dict[str, Any]], concurrency: int,
+                  pass_coverage: float = 1.0) -> List[Dict[str, Any]]:
+    """Answer every question with the configured backends and score the answers"""
+    # Imported here so a variant's environment is in place before modules read it
+    from dotenv import load_dotenv
+    load_dotenv()
+    from bedrock_utils import init_bedrock
+    from chat_service import get_combined_response
+    from knowledge_base import init_knowledge_base
+    from usage_tracking import end_usage_session, get_usage_metrics
+
+    runtime_client = init_bedrock()
+    kb_client = init_knowledge_base()
+
+    def answer(question):
+        session_id = f"eval-{uuid.uuid4()}"
+        start = time.perf_counter()
+        try:
+            response = get_combined_response(runtime_client, kb_client, question['question'], session_id=session_id)
+        except Exception as e:
+            response = {"type": "text", "content": "", "error": True, "exception": str(e)}
+        elapsed = time.perf_counter() - start
+        content = response.get('content') if isinstance(response.get('content'), str) else ""
+        coverage, missing = score_answer(content, question['expected'])
+        usage = get_usage_metrics(session_id)
+        end_usage_session(session_id)
+        source = _answer_source(response)
+        return {
+            "id": question['id'],
+            "category": question['category'],
+            "question": question['question'],
+            "source": source,
+            "latency_seconds": elapsed,
+            "coverage": coverage,
+            "passed": source in ("model", "precomputed") and coverage >= pass_coverage,
+            "missing": missing,
+            "calls": usage["calls"],
+            "input_tokens": usage["input_tokens"],
+            "output_tokens": usage["output_tokens"],
+            "answer": content,
+            "exception": response.get('exception'),
+        }
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        return list(pool.map(answer, questions))
+
+
+def summarize(name: str, overrides: Dict[str, str], results: List[Dict[str, Any]],
+              wall_seconds: float) -> Dict[str, Any]:
+    """Accuracy, latency percentiles and token usage over one variant's results"""
+    count = len(results)
+    answered = [r for r in results if r["source"] in ("model", "precomputed")]
+    latencies = sorted(r["latency_seconds"] for r in answered)
+    sources: Dict[str, int] = {}
+    categories: Dict[str, List[bool]] = {}
+    for r in results:
+        sources[r["source"]] = sources.get(r["source"], 0) + 1
+        categories.setdefault(r["category"], []).append(r["passed"])
+    input_tokens = sum(r["input_tokens"] for r in results)
+    output_tokens = sum(r["output_tokens"] for r in results)
+    return {
+        "variant": name,
+        "overrides": overrides,
+        "questions": count,
+        "wall_seconds": wall_seconds,
+        "accuracy": sum(r["passed"] for r in results) / count if count else 0.0,
+        "mean_coverage": sum(r["coverage"] for r in results) / count if count else 0.0,
+        "accuracy_by_category": {c: sum(p) / len(p) for c, p in categories.items()},
+        "sources": sources,
+        "latency_p50": _percentile(latencies, 50),
+        "latency_p95": _percentile(latencies, 95),
+        "latency_p99": _percentile(latencies, 99),
+        "model_calls": sum(r["calls"] for r in results),
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "tokens_per_question": (input_tokens + output_tokens) / count if count else 0.0,
+        "results": results,
+    }
+
+
+def run_variant(name: str, overrides: Dict[str, str], questions_path: str, concurrency: int,
+                pass_coverage: float) -> Dict[str, Any]:
+    """Run one variant in a child process with its environment overrides"""
+    env = dict(os.environ)
+    env.update(VARIANT_DEFAULTS)
+    env.update(overrides)
+    fd, result_path = tempfile.mkstemp(prefix="eval-", suffix=".json")
+    os.close(fd)
+    try:
+        command = [sys.executable, os.path.abspath(__file__), "--questions", questions_path,
+                   "--concurrency", str(concurrency), "--pass-coverage", str(pass_coverage),
+                   "--worker-output", result_path]
+        completed = subprocess.run(command, env=env)
+        if completed.returncode != 0:
+            raise RuntimeError(f"Variant {name!r} exited with status {completed.returncode}")
+        with open(result_path, 'r', encoding='utf-8') as f:
+            results = json.load(f)
+    finally:
+        os.remove(result_path)
+    return summarize(name, overrides, results["results"], results["wall_seconds"])
+
+
+def format_report(summaries: List[Dict[str, Any]]) -> str:
+    """Side-by-side table of the variants"""
+    rows = [
+        ("accuracy", lambda s: f"{s['accuracy']:.0%}"),
+        ("mean coverage", lambda s: f"{s['mean_coverage']:.0%}"),
+        ("p50 latency (s)", lambda s: f"{s['latency_p50']:.2f}"),
+        ("p95 latency (s)", lambda s: f"{s['latency_p95']:.2f}"),
+        ("p99 latency (s)", lambda s: f"{s['latency_p99']:.2f}"),
+        ("model calls", lambda s: str(s['model_calls'])),
+        ("input tokens", lambda s: str(s['input_tokens'])),
+        ("output tokens", lambda s: str(s['output_tokens'])),
+        ("tokens/question", lambda s: f"{s['tokens_per_question']:.0f}"),
+        ("precomputed", lambda s: str(s['sources'].get('precomputed', 0))),
+        ("busy/errors", lambda s: f"{s['sources'].get('busy', 0)}/{s['sources'].get('error', 0)}"),
+        ("wall time (s)", lambda s: f"{s['wall_seconds']:.1f}"),
+    ]
+    categories = sorted({c for s in summaries for c in s["accuracy_by_category"]})
+    for category in categories:
+        rows.append((f"  {category}", lambda s, c=category: (
+            f"{s['accuracy_by_category'][c]:.0%}" if c in s['accuracy_by_category'] else "-")))
+
+    label_width = max(len(label) for label, _ in rows)
+    widths = [max(10, len(s["variant"])) for s in summaries]
+    lines = [" " * label_width + "  " + "  ".join(s["variant"].rjust(w) for s, w in zip(summaries, widths))]
+    for label, cell in rows:
+        lines.append(label.ljust(label_width) + "  " + "  ".join(cell(s).rjust(w) for s, w in zip(summaries, widths)))
+
+    failures = []
+    for s in summaries:
+        for r in s["results"]:
+            if not r["passed"]:
+                answered = r["source"] in ("model", "precomputed")
+                detail = f"missing: {', '.join(r['missing'])}" if answered else r["source"]
+                failures.append(f"  [{s['variant']}] {r['id']}: {detail}")
+    if failures:
+        lines.append("\nFailed questions:")
+        lines.extend(failures)
+    return "\n".join(lines)
+
+
+def _worker(args) -> None:
+    logging.basicConfig(level=logging.WARNING)
+    questions = load_questions(args.questions)
+    started = time.perf_counter()
+    results = run_questions(questions, args.concurrency, args.pass_coverage)
+    with open(args.worker_output, 'w', encoding='utf-8') as f:
+        json.dump({"wall_seconds": time.perf_counter() - started, "results": results}, f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate chat answer quality, latency and token usage")
+    parser.add_argument("--questions", default=DEFAULT_QUESTIONS)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--pass-coverage", type=float, default=1.0,
+                        help="fraction of expected facts an answer needs to pass")
+    parser.add_argument("--variant", action="append", default=[],
+                        help="NAME[:KEY=VALUE,...]; repeat to compare variants")
+    parser.add_argument("--output", help="write the full report, with every answer, as JSON")
+    parser.add_argument("--worker-output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker_output:
+        _worker(args)
+        sys.exit(0)
+
+    try:
+        variants = [parse_variant(spec) for spec in (args.variant or [DEFAULT_VARIANT])]
+    except ValueError as e:
+        parser.error(str(e))
+    questions_path = os.path.abspath(args.questions)
+    load_questions(questions_path)  # fail fast on a malformed set
+    summaries: List[Dict[str, Any]] = []
+    for name, overrides in variants:
+        print(f"Running variant {name} ...", file=sys.stderr)
+        summaries.append(run_variant(name, overrides, questions_path, args.concurrency, args.pass_coverage))
+
+    print(format_report(summaries))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"questions": questions_path, "variants": summaries}, f, indent=2)
+        print(f"\nReport written to {args.output}")
@@ -0,0 +1,258 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, Optional, List
+import boto3
+from botocore.exceptions import ClientError
+from bedrock_utils import get_secret, client_config, CLAUDE_MODEL_ID
+from cassette import is_replaying
+from dynamo_utils import init_dynamodb
+from region_router import parse_regions, parse_region_overrides
+from name_index import customer_index, CUSTOMER_TABLE
+
+logger = logging.getLogger(__name__)
+
+# Seconds a check result is reused before the check runs again
+HEALTH_CACHE_TTL = float(os.getenv('HEALTH_CACHE_TTL', '30'))
+# Connections opened per client by the pre-warm
+PREWARM_CONNECTIONS = int(os.getenv('PREWARM_CONNECTIONS', '2'))
+
+STATUS_OK = "ok"
+STATUS_FAILED = "failed"
+STATUS_SKIPPED = "skipped"
+
+
+def _session(secrets: Dict[str, str]):
+    return boto3.Session(
+        aws_access_key_id=secrets.get('AWS_ACCESS_KEY_ID'),
+        aws_secret_access_key=secrets.get('AWS_SECRET_ACCESS_KEY'),
+        region_name=secrets.get('AWS_REGION') or 'us-east-1'
+    )
+
+
+def check_config(secrets: Dict[str, str]) -> str:
+    """Validate that required configuration is present (no network)"""
+    missing = [name for name in ('BEDROCK_KB_ID', 'BLAND_API_KEY') if not secrets.get(name)]
+    if missing:
+        raise Exception(f"Missing configuration: {', '.join(missing)}")
+    if bool(secrets.get('AWS_ACCESS_KEY_ID')) != bool(secrets.get('AWS_SECRET_ACCESS_KEY')):
+        raise Exception("Only one of AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY is set")
+    return "configuration complete"
+
+
+def check_credentials(secrets: Dict[str, str]) -> str:
+    """Validate AWS credentials with STS GetCallerIdentity"""
+    identity = _session(secrets).client('sts', config=client_config()).get_caller_identity()
+    return f"authenticated as {identity.get('Arn')}"
+
+
+def _check_regions(regions: List[str], check: Callable[[str], str]) -> str:
+    """Run a per-region check; fails only if no region passes, since the router fails over"""
+    passed, failed = [], []
+    for region in regions:
+        try:
+            passed.append(f"{check(region)} in {region}")
+        except Exception as e:
+            failed.append(f"{region}: {e}")
+    if not passed:
+        raise Exception("; ".join(failed))
+    if failed:
+        return "; ".join(passed) + " (failing: " + "; ".join(failed) + ")"
+    return "; ".join(passed)
+
+
+def check_bedrock_model(secrets: Dict[str, str]) -> str:
+    """Check the Claude model is available in each BEDROCK_REGIONS region with a control-plane call"""
+    def check(region):
+        client = _session(secrets).client('bedrock', region_name=region, config=client_config())
+        details = client.get_foundation_model(modelIdentifier=CLAUDE_MODEL_ID).get('modelDetails', {})
+        status = details.get('modelLifecycle', {}).get('status', 'UNKNOWN')
+        if status != 'ACTIVE':
+            raise Exception(f"Model {CLAUDE_MODEL_ID} lifecycle status is {status}")
+        return f"{CLAUDE_MODEL_ID} active"
+
+    return _check_regions(parse_regions(os.getenv('BEDROCK_REGIONS')), check)
+
+
+def check_knowledge_base(secrets: Dict[str, str]) -> str:
+    """Check the knowledge base is ACTIVE in each KB_REGIONS region with a control-plane call"""
+    default_id = secrets.get('BEDROCK_KB_ID')
+    overrides = parse_region_overrides(os.getenv('KB_REGION_IDS'), 'knowledgeBaseId')
+
+    def check(region):
+        kb_id = overrides.get(region, {}).get('knowledgeBaseId', default_id)
+        if not kb_id:
+            raise Exception("BEDROCK_KB_ID is not set")
+        client = _session(secrets).client('bedrock-agent', region_name=region, config=client_config())
+        status = client.get_knowledge_base(knowledgeBaseId=kb_id)['knowledgeBase']['status']
+        if status != 'ACTIVE':
+            raise Exception(f"Knowledge base {kb_id} status is {status}")
+        return f"knowledge base {kb_id} active"
+
+    return _check_regions(parse_regions(os.getenv('KB_REGIONS')), check)
+
+
+_dynamodb = None
+
+
+def check_dynamodb(secrets: Dict[str, str]) -> str:
+    """Check the customer table the app reads (AWS, DynamoDB Local or in-process) is ACTIVE"""
+    global _dynamodb
+    if _dynamodb is None:
+        _dynamodb = init_dynamodb()
+    resource = getattr(_dynamodb, '_resource', _dynamodb)
+    if not hasattr(resource, 'meta'):
+        # The in-process stand-in (DYNAMODB_LOCAL_DATA) has no control plane
+        return f"{CUSTOMER_TABLE} in process, {resource.Table(CUSTOMER_TABLE).item_count} items"
+    status = resource.meta.client.describe_table(TableName=CUSTOMER_TABLE)['Table']['TableStatus']
+    if status != 'ACTIVE':
+        raise Exception(f"Table {CUSTOMER_TABLE} status is {status}")
+    return f"{CUSTOMER_TABLE} active"
+
+
+CHECKS: Dict[str, Callable[[Dict[str, str]], str]] = {
+    "config": check_config,
+    "credentials": check_credentials,
+    "bedrock": check_bedrock_model,
+    "knowledge_base": check_knowledge_base,
+    "dynamodb": check_dynamodb,
+}
+
+
+class HealthMonitor:
+    """Runs cheap health checks and caches their results"""
+
+    def __init__(self, checks: Dict[str, Callable] = None, ttl: float = HEALTH_CACHE_TTL):
+        self.checks = checks or CHECKS
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._results: Dict[str, Dict[str, Any]] = {}
+
+    def _run_check(self, name: str, check: Callable, secrets: Dict[str, str]) -> Dict[str, Any]:
+        previous = self._results.get(name, {})
+        start_time = time.perf_counter()
+        result = {
+            "checked_at": time.time(),
+            "last_success": previous.get("last_success"),
+        }
+        if is_replaying() and name != "config":
+            result.update(status=STATUS_SKIPPED, detail="cassette replay mode")
+        else:
+            try:
+                result.update(status=STATUS_OK, detail=check(secrets))
+                result["last_success"] = result["checked_at"]
+            except Exception as e:
+                logger.warning("Health check %s failed: %s", name, e)
+                result.update(status=STATUS_FAILED, detail=str(e))
+        result["latency_seconds"] = time.perf_counter() - start_time
+        return result
+
+    def run(self, names: Optional[List[str]] = None, force: bool = False) -> Dict[str, Any]:
+        """Run (or reuse cached) checks and return the overall status"""
+        names = names or list(self.checks)
+        now = time.time()
+        with self._lock:
+            stale = [n for n in names
+                     if force or n not in self._results or now - self._results[n]["checked_at"] > self.ttl]
+
+        if stale:
+            secrets = get_secret() or {}
+            with ThreadPoolExecutor(max_workers=len(stale)) as pool:
+                results = dict(zip(stale, pool.map(lambda n: self._run_check(n, self.checks[n], secrets), stale)))
+            with self._lock:
+                self._results.update(results)
+
+        return self.snapshot(names)
+
+    def snapshot(self, names: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Last known results without running anything (for liveness probes)"""
+        with self._lock:
+            checks = {n: dict(self._results[n]) for n in (names or self._results) if n in self._results}
+        healthy = all(c["status"] != STATUS_FAILED for c in checks.values())
+        return {"status": STATUS_OK if healthy else STATUS_FAILED, "checks": checks}
+
+
+monitor = HealthMonitor()
+
+
+def get_health(deep: bool = False, force: bool = False) -> Dict[str, Any]:
+    """Cached health; deep=True runs any checks whose cached result expired"""
+    if deep:
+        return monitor.run(force=force)
+    return monitor.snapshot()
+
+
+# A cheap read per service; any answer, access denied included, leaves a pooled connection behind
+_WARM_CALLS = {
+    'dynamodb': ('list_tables', {'Limit': 1}),
+    'bedrock-runtime': ('list_async_invokes', {'maxResults': 1}),
+    'bedrock-agent-runtime': ('list_sessions', {'maxResults': 1}),
+}
+
+
+def _open_connection(client) -> None:
+    """Open a pooled TLS connection with one cheap API call"""
+    client = getattr(client, '_client', client)
+    service = client.meta.service_model.service_name
+    operation, params = _WARM_CALLS.get(service, (None, None))
+    if not operation or not hasattr(client, operation):
+        raise Exception(f"No warm-up call for {service}")
+    try:
+        getattr(client, operation)(**params)
+    except ClientError as e:
+        logger.debug("Warm-up %s.%s answered %s", service, operation, e.response.get('Error', {}).get('Code'))
+
+
+def prewarm_connections(clients: Dict[str, Any], connections: int = PREWARM_CONNECTIONS) -> Dict[str, Any]:
+    """Open pooled connections for each client so the first request skips the TLS handshake"""
+    results = {}
+    if is_replaying():
+        return results
+
+    def warm(name, client):
+        start_time = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=connections) as pool:
+                list(pool.map(lambda _: _open_connection(client), range(connections)))
+            results[name] = {"status": STATUS_OK, "latency_seconds": time.perf_counter() - start_time}
+        except Exception as e:
+            logger.warning("Could not pre-warm %s connections: %s", name, e)
+            results[name] = {"status": STATUS_FAILED, "detail": str(e)}
+
+    threads = [threading.Thread(target=warm, args=item, daemon=True) for item in clients.items()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    logger.info("Pre-warmed connections: %s", results)
+    return results
+
+
+def start_prewarm(runtime_client=None, kb_client=None, dynamodb=None, run_checks: bool = True) -> threading.Thread:
+    """Pre-warm connections and the customer name index (and optionally run health checks) in the background"""
+    clients = {}
+    for name, client in (('bedrock-runtime', runtime_client), ('bedrock-agent-runtime', kb_client)):
+        if client is None:
+            continue
+        client = getattr(client, '_client', client)
+        # Routed clients are warmed in every region
+        for region, regional_client in getattr(client, 'clients', {None: client}).items():
+            clients[f"{name}:{region}" if region else name] = regional_client
+    if dynamodb is not None:
+        resource = getattr(dynamodb, '_resource', dynamodb)
+        # The offline stand-in has no HTTP connection to warm
+        if hasattr(resource, 'meta'):
+            clients['dynamodb'] = resource.meta.client
+
+    def run():
+        prewarm_connections(clients)
+        if dynamodb is not None:
+            customer_index.ensure_loaded(dynamodb)
+        if run_checks:
+            monitor.run()
+
+    thread = threading.Thread(target=run, name="prewarm", daemon=True)
+    thread.start()
+    return thread
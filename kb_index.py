@@ -0,0 +1,334 @@
+"""Prebuilt, memory-mapped index of the knowledge base corpus.
+
+`python convert_to_text.py rivertown_knowledge_base_2.json --index kb_index.bin` chunks
+the corpus, tokenizes it and writes one binary file:
+
+- a fixed header: magic, format version, counts, the source file's size, mtime and
+  SHA-256, and the offset and length of every array below
+- chunk text (UTF-8 blob plus uint64 offsets) and each chunk's section
+- the term dictionary: sorted UTF-8 terms plus uint64 offsets, and float32 IDF
+- postings: uint64 offsets per term into uint32 chunk IDs and float32 weights
+  (sublinear TF x IDF, normalized per chunk)
+
+All arrays are little-endian and 8-byte aligned. KBIndex maps the file read-only and
+views the arrays in place with NumPy, so opening it parses nothing, takes the same
+time whatever the corpus size, and every worker process shares the same page cache.
+Terms are found by binary search over the sorted dictionary.
+"""
+import hashlib
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from answer_store import KNOWLEDGE_BASE_PATH
+from kb_reranker import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Prebuilt index file opened by the app
+KB_INDEX_PATH = os.getenv('KB_INDEX_PATH', 'kb_index.bin')
+# Target chunk size in tokens (~4 characters each); chunks break at paragraph boundaries
+KB_CHUNK_TOKENS = int(os.getenv('KB_CHUNK_TOKENS', '200'))
+
+MAGIC = b"RTKBIDX\0"
+FORMAT_VERSION = 1
+
+# Arrays in file order: (name, dtype); None marks a raw UTF-8 blob
+_ARRAYS = [
+    ("chunk_offsets", np.uint64),
+    ("chunk_text", None),
+    ("chunk_sections", np.uint16),
+    ("section_offsets", np.uint64),
+    ("section_names", None),
+    ("term_offsets", np.uint64),
+    ("terms", None),
+    ("idf", np.float32),
+    ("posting_offsets", np.uint64),
+    ("posting_chunks", np.uint32),
+    ("posting_weights", np.float32),
+]
+_HEADER = struct.Struct("<8sIIIIQQQ32s" + "QQ" * len(_ARRAYS))
+_ALIGNMENT = 8
+
+
+class IndexFormatError(Exception):
+    """The file is not a knowledge base index this code can read"""
+
+
+def chunk_corpus(knowledge_base: Dict[str, List[str]], chunk_tokens: int = KB_CHUNK_TOKENS) -> List[Tuple[str, str]]:
+    """(section, text) chunks; paragraphs are packed until the next one would exceed the target size"""
+    max_chars = chunk_tokens * 4
+    chunks = []
+    for section, entries in knowledge_base.items():
+        for entry in entries:
+            # Same cleanup as the plain-text export
+            paragraphs = [p.strip() for p in entry.replace('**', '').replace('*', '').split("\n\n") if p.strip()]
+            current = []
+            for paragraph in paragraphs:
+                if current and len("\n\n".join(current + [paragraph])) > max_chars:
+                    chunks.append((section, "\n\n".join(current)))
+                    current = []
+                current.append(paragraph)
+            if current:
+                chunks.append((section, "\n\n".join(current)))
+    return chunks
+
+
+def _blob(strings: List[str]) -> Tuple[bytes, np.ndarray]:
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    offsets[1:] = np.cumsum([len(e) for e in encoded], dtype=np.uint64)
+    return b"".join(encoded), offsets
+
+
+def build_index(source_path: str, output_path: str, chunk_tokens: int = KB_CHUNK_TOKENS) -> Dict[str, int]:
+    """Build the binary index for a knowledge base JSON file; returns its counts"""
+    with open(source_path, 'rb') as f:
+        raw = f.read()
+    knowledge_base = json.loads(raw)
+    chunks = chunk_corpus(knowledge_base, chunk_tokens)
+
+    sections = list(knowledge_base.keys())
+    section_ids = {name: i for i, name in enumerate(sections)}
+    term_counts = [Counter(tokenize(text)) for _, text in chunks]
+
+    document_frequency = Counter()
+    for counts in term_counts:
+        document_frequency.update(counts.keys())
+    terms = sorted(document_frequency)
+    term_ids = {term: i for i, term in enumerate(terms)}
+    total = len(chunks)
+    idf = np.array([math.log((1 + total) / (1 + document_frequency[t])) + 1.0 for t in terms], dtype=np.float32)
+
+    # Per-term postings, in chunk order
+    postings: List[List[Tuple[int, float]]] = [[] for _ in terms]
+    for chunk_id, counts in enumerate(term_counts):
+        weights = {t: (1 + math.log(c)) * idf[term_ids[t]] for t, c in counts.items()}
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        for term, weight in weights.items():
+            postings[term_ids[term]].append((chunk_id, weight / norm))
+
+    posting_offsets = np.zeros(len(terms) + 1, dtype=np.uint64)
+    posting_offsets[1:] = np.cumsum([len(p) for p in postings], dtype=np.uint64)
+    posting_chunks = np.fromiter((c for p in postings for c, _ in p), dtype=np.uint32, count=int(posting_offsets[-1]))
+    posting_weights = np.fromiter((w for p in postings for _, w in p), dtype=np.float32, count=int(posting_offsets[-1]))
+
+    chunk_text, chunk_offsets = _blob([text for _, text in chunks])
+    section_names, section_offsets = _blob(sections)
+    term_blob, term_offsets = _blob(terms)
+    arrays = {
+        "chunk_offsets": chunk_offsets,
+        "chunk_text": chunk_text,
+        "chunk_sections": np.array([section_ids[s] for s, _ in chunks], dtype=np.uint16),
+        "section_offsets": section_offsets,
+        "section_names": section_names,
+        "term_offsets": term_offsets,
+        "terms": term_blob,
+        "idf": idf,
+        "posting_offsets": posting_offsets,
+        "posting_chunks": posting_chunks,
+        "posting_weights": posting_weights,
+    }
+
+    stat = os.stat(source_path)
+    layout, payload, position = [], [], _HEADER.size
+    for name, dtype in _ARRAYS:
+        data = arrays[name] if dtype is None else np.ascontiguousarray(arrays[name], dtype=np.dtype(dtype).newbyteorder('<')).tobytes()
+        padding = -position % _ALIGNMENT
+        payload.append(b"\0" * padding)
+        position += padding
+        layout += [position, len(data)]
+        payload.append(data)
+        position += len(data)
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, len(chunks), len(terms), len(sections), int(posting_offsets[-1]),
+                          stat.st_size, stat.st_mtime_ns, hashlib.sha256(raw).digest(), *layout)
+
+    # Write then rename, so processes never map a half-written file
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        for part in payload:
+            f.write(part)
+    os.replace(tmp_path, output_path)
+    return {"chunks": len(chunks), "terms": len(terms), "postings": int(posting_offsets[-1]), "bytes": position}
+
+
+class KBIndex:
+    """Read-only view of a prebuilt index file"""
+
+    def __init__(self, path: str = KB_INDEX_PATH):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < _HEADER.size:
+            raise IndexFormatError(f"{path} is too short to be an index")
+        fields = _HEADER.unpack_from(self._map, 0)
+        magic, version, self.chunk_count, self.term_count, self.section_count, self.posting_count = fields[:6]
+        self.source_size, self.source_mtime_ns, digest = fields[6:9]
+        if magic != MAGIC:
+            raise IndexFormatError(f"{path} is not a knowledge base index")
+        if version != FORMAT_VERSION:
+            raise IndexFormatError(f"{path} has index format {version}, expected {FORMAT_VERSION}; rebuild it")
+        self.source_sha256 = digest.hex()
+
+        layout = fields[9:]
+        self._arrays = {}
+        for i, (name, dtype) in enumerate(_ARRAYS):
+            offset, length = layout[2 * i], layout[2 * i + 1]
+            if dtype is None:
+                # Blobs are sliced from the map on demand
+                self._arrays[name] = (offset, length)
+            else:
+                item = np.dtype(dtype).newbyteorder('<')
+                self._arrays[name] = np.frombuffer(self._map, dtype=item, count=length // item.itemsize, offset=offset)
+        self._text_start = self._arrays["chunk_text"][0]
+        self._terms_start = self._arrays["terms"][0]
+        self._names_start = self._arrays["section_names"][0]
+
+    def __len__(self) -> int:
+        return self.chunk_count
+
+    def chunk(self, chunk_id: int) -> str:
+        offsets = self._arrays["chunk_offsets"]
+        start = self._text_start + int(offsets[chunk_id])
+        return self._map[start:self._text_start + int(offsets[chunk_id + 1])].decode('utf-8')
+
+    def section(self, chunk_id: int) -> str:
+        return self.section_name(int(self._arrays["chunk_sections"][chunk_id]))
+
+    def section_name(self, section_id: int) -> str:
+        offsets = self._arrays["section_offsets"]
+        start = self._names_start + int(offsets[section_id])
+        return self._map[start:self._names_start + int(offsets[section_id + 1])].decode('utf-8')
+
+    def _term(self, term_id: int) -> bytes:
+        offsets = self._arrays["term_offsets"]
+        return self._map[self._terms_start + int(offsets[term_id]):self._terms_start + int(offsets[term_id + 1])]
+
+    def lookup(self, term: str) -> Optional[int]:
+        """Term ID by binary search over the sorted dictionary"""
+        target = term.encode('utf-8')
+        low, high = 0, self.term_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._term(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.term_count and self._term(low) == target:
+            return low
+        return None
+
+    def search(self, query: str, top_k: int = 10) -> List[Tuple[int, float]]:
+        """(chunk ID, score) pairs for the chunks best matching the query, by TF-IDF weighted overlap"""
+        scores = np.zeros(self.chunk_count, dtype=np.float32)
+        offsets = self._arrays["posting_offsets"]
+        idf = self._arrays["idf"]
+        matched = False
+        for term, count in Counter(tokenize(query)).items():
+            term_id = self.lookup(term)
+            if term_id is None:
+                continue
+            matched = True
+            start, end = int(offsets[term_id]), int(offsets[term_id + 1])
+            # A term lists each chunk once, so fancy-index addition is safe
+            scores[self._arrays["posting_chunks"][start:end]] += (
+                self._arrays["posting_weights"][start:end] * idf[term_id] * (1 + math.log(count)))
+        if not matched:
+            return []
+        top_k = min(top_k, self.chunk_count)
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        return [(int(i), float(scores[i])) for i in best if scores[i] > 0]
+
+    def is_stale(self, source_path: str = KNOWLEDGE_BASE_PATH) -> bool:
+        """Whether the source JSON changed since the build (by size and mtime, without reading it)"""
+        try:
+            stat = os.stat(source_path)
+        except OSError:
+            return False
+        return stat.st_size != self.source_size or stat.st_mtime_ns != self.source_mtime_ns
+
+    def close(self) -> None:
+        self._arrays = {}
+        self._map.close()
+
+
+_index: Optional[KBIndex] = None
+_index_loaded = False
+_index_lock = threading.Lock()
+
+
+def get_kb_index() -> Optional[KBIndex]:
+    """Process-wide index from KB_INDEX_PATH, or None if it hasn't been built"""
+    global _index, _index_loaded
+    if _index_loaded:
+        return _index
+    with _index_lock:
+        if not _index_loaded:
+            try:
+                _index = KBIndex(KB_INDEX_PATH)
+                if _index.is_stale():
+                    logger.warning("%s is older than %s; rebuild it with convert_to_text.py --index",
+                                   KB_INDEX_PATH, KNOWLEDGE_BASE_PATH)
+                logger.info("Mapped knowledge base index %s: %s chunks, %s terms",
+                            KB_INDEX_PATH, _index.chunk_count, _index.term_count)
+            except FileNotFoundError:
+                logger.info("No knowledge base index at %s", KB_INDEX_PATH)
+            except (OSError, ValueError, IndexFormatError) as e:
+                logger.error("Error opening knowledge base index %s: %s", KB_INDEX_PATH, e)
+            _index_loaded = True
+    return _index
+
+
+def _benchmark(source_path: str = KNOWLEDGE_BASE_PATH, scales=(1, 10, 100), queries: int = 200) -> None:
+    """Startup time of parsing and indexing the JSON vs mapping a prebuilt index, as the corpus grows"""
+    import tempfile
+    with open(source_path, 'r', encoding='utf-8') as f:
+        knowledge_base = json.load(f)
+    sample_queries = ["what sizes do the maple balls come in", "shipping and returns policy",
+                      "custom engraving for weddings", "how are the balls finished"]
+    with tempfile.TemporaryDirectory() as directory:
+        for scale in scales:
+            # Copies of every entry stand in for a larger catalog
+            corpus = {f"{section} {copy}": entries for copy in range(scale) for section, entries in knowledge_base.items()}
+            corpus_path = os.path.join(directory, f"kb-{scale}.json")
+            index_path = os.path.join(directory, f"kb-{scale}.bin")
+            with open(corpus_path, 'w', encoding='utf-8') as f:
+                json.dump(corpus, f)
+            counts = build_index(corpus_path, index_path)
+
+            start = time.perf_counter()
+            with open(corpus_path, 'r', encoding='utf-8') as f:
+                parsed = json.load(f)
+            tokenized = [Counter(tokenize(text)) for _, text in chunk_corpus(parsed)]
+            parse_ms = (time.perf_counter() - start) * 1000
+            del tokenized
+
+            start = time.perf_counter()
+            index = KBIndex(index_path)
+            open_ms = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            for i in range(queries):
+                index.search(sample_queries[i % len(sample_queries)], 10)
+            search_ms = (time.perf_counter() - start) * 1000 / queries
+            index.close()
+            print(f"x{scale:<4} {counts['chunks']:>6} chunks {counts['terms']:>6} terms {counts['bytes'] / 2**20:>7.2f} MB: "
+                  f"parse+tokenize {parse_ms:>8.1f} ms, mmap open {open_ms:.3f} ms, search {search_ms:.3f} ms/query")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        _benchmark()
+    else:
+        print("Usage: python kb_index.py bench   (build with: python convert_to_text.py input.json --index kb_index.bin)")
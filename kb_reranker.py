@@ -0,0 +1,135 @@
+import logging
+import os
+import re
+from typing import List, Dict, Any
+import numpy as np
+from usage_tracking import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Token budget for the context block sent to Claude
+KB_CONTEXT_TOKEN_BUDGET = int(os.getenv('KB_CONTEXT_TOKEN_BUDGET', '900'))
+# Cosine similarity above which two passages are treated as duplicates
+KB_DEDUPE_THRESHOLD = float(os.getenv('KB_DEDUPE_THRESHOLD', '0.85'))
+# Weight of the local lexical score vs the knowledge base's own vector score
+KB_LEXICAL_WEIGHT = float(os.getenv('KB_LEXICAL_WEIGHT', '0.6'))
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+_STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from has have how i if in is it its me my
+of on or our so than that the their them there these they this to was we were what when
+where which who why will with you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens without stopwords"""
+    return [t for t in _TOKEN_PATTERN.findall((text or "").lower()) if t not in _STOPWORDS]
+
+
+def _term_matrix(documents: List[List[str]]):
+    """Term-frequency matrix (documents x vocabulary) and the vocabulary index"""
+    vocabulary: Dict[str, int] = {}
+    for tokens in documents:
+        for token in tokens:
+            vocabulary.setdefault(token, len(vocabulary))
+
+    matrix = np.zeros((len(documents), max(len(vocabulary), 1)), dtype=np.float32)
+    for row, tokens in enumerate(documents):
+        if tokens:
+            columns = np.fromiter((vocabulary[t] for t in tokens), dtype=np.int64, count=len(tokens))
+            np.add.at(matrix[row], columns, 1.0)
+    return matrix, vocabulary
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def score_passages(query: str, passages: List[str]):
+    """Score passages against the query by TF-IDF weighted term overlap.
+
+    Returns the scores and the normalized passage vectors (used for deduplication).
+    """
+    documents = [tokenize(p) for p in passages]
+    query_tokens = tokenize(query)
+    matrix, vocabulary = _term_matrix(documents + [query_tokens])
+    passage_tf, query_tf = matrix[:-1], matrix[-1]
+
+    # Smoothed IDF over the candidate set
+    document_frequency = np.count_nonzero(passage_tf, axis=0)
+    idf = np.log((1.0 + len(passages)) / (1.0 + document_frequency)) + 1.0
+
+    # Sublinear TF damps passages that just repeat a query term
+    weighted = np.log1p(passage_tf) * idf
+    vectors = _normalize_rows(weighted)
+    query_vector = np.log1p(query_tf) * idf
+    query_norm = np.linalg.norm(query_vector)
+    if query_norm == 0:
+        return np.zeros(len(passages), dtype=np.float32), vectors
+    return vectors @ (query_vector / query_norm), vectors
+
+
+def _trim_to_budget(text: str, token_budget: int) -> str:
+    """Cut text at a sentence boundary so it fits in the token budget"""
+    max_chars = token_budget * 4
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    boundary = max(cut.rfind(". "), cut.rfind("\n"))
+    if boundary > max_chars // 2:
+        cut = cut[:boundary + 1]
+    return cut.rstrip()
+
+
+def rerank_passages(query: str, candidates: List[Dict[str, Any]],
+                    token_budget: int = KB_CONTEXT_TOKEN_BUDGET,
+                    dedupe_threshold: float = KB_DEDUPE_THRESHOLD,
+                    lexical_weight: float = KB_LEXICAL_WEIGHT) -> List[str]:
+    """Rerank retrieved candidates, drop near-duplicates and trim to a token budget.
+
+    Each candidate is a dict with "text" and an optional retrieval "score".
+    """
+    candidates = [c for c in candidates if c.get("text")]
+    if not candidates:
+        return []
+
+    texts = [c["text"] for c in candidates]
+    lexical, vectors = score_passages(query, texts)
+
+    retrieval = np.array([float(c.get("score") or 0.0) for c in candidates], dtype=np.float32)
+    if retrieval.max() > 0:
+        retrieval = retrieval / retrieval.max()
+    if lexical.max() > 0:
+        lexical = lexical / lexical.max()
+    combined = lexical_weight * lexical + (1.0 - lexical_weight) * retrieval
+
+    # Pairwise similarity between all candidates in one matrix product
+    similarity = vectors @ vectors.T
+
+    selected: List[str] = []
+    kept: List[int] = []
+    remaining = token_budget
+    for index in np.argsort(-combined, kind="stable"):
+        if remaining <= 0:
+            break
+        if kept and similarity[index, kept].max() >= dedupe_threshold:
+            continue
+        text = texts[index]
+        tokens = estimate_tokens(text)
+        if tokens > remaining:
+            # Only the top passage is worth truncating; skip other oversized ones
+            if selected:
+                continue
+            text = _trim_to_budget(text, remaining)
+            tokens = estimate_tokens(text)
+        selected.append(text)
+        kept.append(index)
+        remaining -= tokens
+
+    logger.debug("Reranked %s candidates down to %s passages (%s tokens)",
+                 len(candidates), len(selected), token_budget - remaining)
+    return selected
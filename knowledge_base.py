@@ -1,10 +1,119 @@
 import boto3
 import logging
+import os
+import threading
+import time
+from collections import OrderedDict
 from typing import Optional, Dict, Any
-from bedrock_utils import get_secret
+from bedrock_utils import get_secret, client_config
+from usage_tracking import record_usage, estimate_tokens
+from kb_reranker import rerank_passages
+from cassette import wrap_client
+from region_router import RegionRouter, RoutedClient, parse_regions, parse_region_overrides, is_retryable
+from log_utils import Payload
+from admission import kb_limiter
+from kb_index import get_kb_index
+
+# "passages" retrieves, reranks and compresses raw passages; "generate" uses retrieve_and_generate;
+# "local" searches the prebuilt kb_index.py file instead of calling the knowledge base
+KB_CONTEXT_MODE = os.getenv('KB_CONTEXT_MODE', 'passages')
+# Candidates fetched from the knowledge base before local reranking
+KB_CANDIDATE_COUNT = int(os.getenv('KB_CANDIDATE_COUNT', '10'))
+# Idle seconds after which a chat's retrieve_and_generate session is treated as expired and a new one started
+KB_SESSION_IDLE_SECONDS = float(os.getenv('KB_SESSION_IDLE_SECONDS', '600'))
+# Knowledge base sessions remembered at most; the least recently used are forgotten first
+KB_SESSION_MAX = int(os.getenv('KB_SESSION_MAX', '10000'))
 
 logger = logging.getLogger(__name__)
 
+
+class KBSessionStore:
+    """Chat session ID -> retrieve_and_generate sessionId, with idle expiry and per-turn stats"""
+
+    def __init__(self, idle_seconds: float = KB_SESSION_IDLE_SECONDS, max_sessions: int = KB_SESSION_MAX):
+        self.idle_seconds = idle_seconds
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+        self._turns = {kind: {"turns": 0, "latency": 0.0, "input_tokens": 0, "output_tokens": 0}
+                       for kind in ("new", "reused")}
+        self.expired = 0
+        self.recreated = 0
+
+    def get(self, session_id: Optional[str]) -> Optional[str]:
+        """Live KB sessionId for a chat, or None if there is none or it has gone idle"""
+        if not session_id:
+            return None
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            kb_session_id, last_used = entry
+            if time.time() - last_used > self.idle_seconds:
+                del self._sessions[session_id]
+                self.expired += 1
+                return None
+            return kb_session_id
+
+    def put(self, session_id: Optional[str], kb_session_id: str) -> None:
+        if not session_id:
+            return
+        with self._lock:
+            self._sessions[session_id] = (kb_session_id, time.time())
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def drop(self, session_id: Optional[str], rejected: bool = False) -> None:
+        """Forget a chat's KB session (chat reset, or the service rejected it)"""
+        with self._lock:
+            if self._sessions.pop(session_id, None) is not None and rejected:
+                self.recreated += 1
+
+    def record_turn(self, reused: bool, latency: float, input_tokens: int, output_tokens: int) -> None:
+        with self._lock:
+            totals = self._turns["reused" if reused else "new"]
+            totals["turns"] += 1
+            totals["latency"] += latency
+            totals["input_tokens"] += input_tokens
+            totals["output_tokens"] += output_tokens
+
+    def stats(self) -> Dict[str, Any]:
+        """Active sessions, expiries and mean latency/tokens of first vs follow-up turns"""
+        with self._lock:
+            turns = {}
+            for kind, totals in self._turns.items():
+                count = totals["turns"]
+                turns[kind] = {
+                    "turns": count,
+                    "mean_latency_ms": round(totals["latency"] / count * 1000, 1) if count else None,
+                    "mean_input_tokens": round(totals["input_tokens"] / count, 1) if count else None,
+                    "mean_output_tokens": round(totals["output_tokens"] / count, 1) if count else None,
+                }
+            return {"active": len(self._sessions), "expired": self.expired, "recreated": self.recreated,
+                    "turns": turns}
+
+
+# Process-wide store shared by the app and the API
+kb_sessions = KBSessionStore()
+
+
+def end_kb_session(session_id: Optional[str]) -> None:
+    """Start the next turn of this chat in a fresh knowledge base session"""
+    kb_sessions.drop(session_id)
+
+
+def get_kb_session_stats() -> Dict[str, Any]:
+    return kb_sessions.stats()
+
+
+def _is_session_error(error: Exception) -> bool:
+    """The service no longer knows the sessionId we sent (expired, ended or from another region)"""
+    code = getattr(error, 'response', {}).get('Error', {}).get('Code', '')
+    return code in ('ValidationException', 'ResourceNotFoundException', 'ConflictException') \
+        and 'session' in str(error).lower()
+
+
 def init_knowledge_base():
     """Initialize Bedrock Agent Runtime client for KB"""
     try:
@@ -15,27 +124,135 @@ def init_knowledge_base():
         
         # Get and verify KB ID
         kb_id = secrets.get('BEDROCK_KB_ID')
-        logger.info(f"Initializing Knowledge Base with ID: {kb_id}")
+        logger.info("Initializing Knowledge Base with ID: %s", kb_id)
         
-        session = boto3.Session(
-            aws_access_key_id=secrets.get('AWS_ACCESS_KEY_ID'),
-            aws_secret_access_key=secrets.get('AWS_SECRET_ACCESS_KEY'),
-            region_name='us-east-1'
-        )
+        # KB regions; knowledge bases in other regions need their own IDs ("us-west-2=KBID,...")
+        regions = parse_regions(os.getenv('KB_REGIONS'))
+        overrides = parse_region_overrides(os.getenv('KB_REGION_IDS'), 'knowledgeBaseId')
+        clients = {}
+        for region in regions:
+            session = boto3.Session(
+                aws_access_key_id=secrets.get('AWS_ACCESS_KEY_ID'),
+                aws_secret_access_key=secrets.get('AWS_SECRET_ACCESS_KEY'),
+                region_name=region
+            )
+            
+            clients[region] = session.client(
+                service_name='bedrock-agent-runtime',
+                region_name=region,
+                config=client_config()
+            )
         
-        kb_client = session.client(
-            service_name='bedrock-agent-runtime',
-            region_name='us-east-1'
-        )
+        kb_client = clients[regions[0]]
+        if len(clients) > 1:
+            kb_client = RoutedClient(RegionRouter('bedrock-agent-runtime', clients, overrides=overrides))
         
-        return kb_client
+        return wrap_client(kb_client, 'bedrock-agent-runtime')
         
     except Exception as e:
-        logger.error(f"Error initializing KB client: {str(e)}")
+        logger.error("Error initializing KB client: %s", e)
         raise e
 
-def get_knowledge_base_response(kb_client, query: str) -> str:
-    """Query the knowledge base"""
+def get_knowledge_base_response(kb_client, query: str, session_id: Optional[str] = None) -> str:
+    """Query the knowledge base, within the process-wide limit on concurrent KB calls.
+
+    Raises AdmissionRejected if no slot frees up before the queue deadline.
+    """
+    if KB_CONTEXT_MODE == 'local':
+        return get_local_passages(query, session_id=session_id)
+    with kb_limiter.slot(session_id):
+        if KB_CONTEXT_MODE == 'passages':
+            return get_knowledge_base_passages(kb_client, query, session_id=session_id)
+        return _retrieve_and_generate(kb_client, query, session_id=session_id)
+
+def get_knowledge_base_passages(kb_client, query: str, session_id: Optional[str] = None) -> str:
+    """Retrieve a wide candidate set, then rerank, dedupe and trim it locally"""
+    try:
+        if not kb_client:
+            logger.error("Knowledge base client is not initialized")
+            return ""
+
+        secrets = get_secret()
+        if not secrets:
+            raise Exception("Failed to get secrets from AWS Secrets Manager")
+
+        start_time = time.perf_counter()
+        response = kb_client.retrieve(
+            knowledgeBaseId=secrets.get('BEDROCK_KB_ID'),
+            retrievalQuery={
+                "text": query
+            },
+            retrievalConfiguration={
+                "vectorSearchConfiguration": {
+                    "numberOfResults": KB_CANDIDATE_COUNT
+                }
+            }
+        )
+        latency = time.perf_counter() - start_time
+
+        candidates = []
+        for result in response.get('retrievalResults', []):
+            content = result.get('content', {})
+            text = content.get('text') if isinstance(content, dict) else content
+            if text:
+                candidates.append({"text": text, "score": result.get('score', 0.0)})
+
+        passages = rerank_passages(query, candidates)
+        context = "\n\n".join(passages)
+        logger.info("KB retrieve returned %s candidates, kept %s", len(candidates), len(passages))
+
+        # Retrieval only embeds the query; context size is what Claude will be sent
+        record_usage(
+            session_id,
+            "knowledge-base-retrieve",
+            estimate_tokens(query),
+            0,
+            latency,
+            source="retrieve",
+            estimated=True,
+            candidates=len(candidates),
+            context_tokens=estimate_tokens(context)
+        )
+
+        return context
+
+    except Exception as e:
+        logger.error("Error retrieving knowledge base passages: %s", e)
+        # The prebuilt index, when there is one, still gives the answer some grounding
+        return get_local_passages(query, session_id=session_id)
+
+def get_local_passages(query: str, session_id: Optional[str] = None) -> str:
+    """Search the memory-mapped prebuilt index, then rerank, dedupe and trim like retrieved passages"""
+    index = get_kb_index()
+    if index is None:
+        return ""
+    try:
+        start_time = time.perf_counter()
+        candidates = [{"text": index.chunk(chunk_id), "score": score}
+                      for chunk_id, score in index.search(query, KB_CANDIDATE_COUNT)]
+        passages = rerank_passages(query, candidates)
+        context = "\n\n".join(passages)
+        logger.info("Local index returned %s candidates, kept %s", len(candidates), len(passages))
+
+        record_usage(
+            session_id,
+            "knowledge-base-local",
+            estimate_tokens(query),
+            0,
+            time.perf_counter() - start_time,
+            source="local_index",
+            estimated=True,
+            candidates=len(candidates),
+            context_tokens=estimate_tokens(context)
+        )
+        return context
+
+    except Exception as e:
+        logger.error("Error searching local knowledge base index: %s", e)
+        return ""
+
+def _retrieve_and_generate(kb_client, query: str, session_id: Optional[str] = None) -> str:
+    """Query the knowledge base with retrieve_and_generate, continuing the chat's KB session"""
     try:
         if not kb_client:
             logger.error("Knowledge base client is not initialized")
@@ -47,13 +264,13 @@ def get_knowledge_base_response(kb_client, query: str) -> str:
             raise Exception("Failed to get secrets from AWS Secrets Manager")
             
         # Get the model ARN from secrets or use Claude
-        model_arn = secrets.get('BEDROCK_MODEL_ARN', 'arn:aws:bedrock:us-east-1::foundation-model/anthropic.claude-3-haiku-20240307-v1:0')
+        model_arn = secrets.get('BEDROCK_MODEL_ARN') or 'arn:aws:bedrock:us-east-1::foundation-model/anthropic.claude-3-haiku-20240307-v1:0'
             
-        response = kb_client.retrieve_and_generate(
-            input={
+        request = {
+            "input": {
                 "text": query
             },
-            retrieveAndGenerateConfiguration={
+            "retrieveAndGenerateConfiguration": {
                 "type": "KNOWLEDGE_BASE",
                 "knowledgeBaseConfiguration": {
                     "knowledgeBaseId": secrets.get('BEDROCK_KB_ID'),
@@ -65,26 +282,62 @@ def get_knowledge_base_response(kb_client, query: str) -> str:
                     }
                 }
             }
-        )
+        }
+        # Follow-up questions continue the service-side conversation instead of starting cold
+        kb_session_id = kb_sessions.get(session_id)
+        if kb_session_id:
+            request["sessionId"] = kb_session_id
+            
+        start_time = time.perf_counter()
+        try:
+            response = kb_client.retrieve_and_generate(**request)
+        except Exception as e:
+            # A session can't move to a healthy region, so an outage in its region also means starting over
+            if not kb_session_id or not (_is_session_error(e) or is_retryable(e)):
+                raise
+            logger.info("KB session for %s was rejected (%s), starting a new one", session_id, e)
+            kb_sessions.drop(session_id, rejected=True)
+            del request["sessionId"]
+            kb_session_id = None
+            response = kb_client.retrieve_and_generate(**request)
+        
+        latency = time.perf_counter() - start_time
+        if response.get('sessionId'):
+            kb_sessions.put(session_id, response['sessionId'])
         
         # Debug logging
-        logger.debug(f"Raw KB response: {response}")
+        logger.debug("Raw KB response: %s", Payload(response))
         
         # Extract the generated text from the response
+        text = ""
         if 'output' in response and 'text' in response['output']:
-            return response['output']['text']
+            text = response['output']['text']
         elif 'retrievalResults' in response:
             # Fallback to just concatenating retrieval results if no generated text
             passages = []
             for result in response['retrievalResults']:
                 if 'content' in result:
                     passages.append(result['content'])
-            return "\n\n".join(passages)
+            text = "\n\n".join(passages)
+
+        # retrieve_and_generate does not report usage, so estimate it from the text sizes
+        input_tokens, output_tokens = estimate_tokens(query), estimate_tokens(text)
+        record_usage(
+            session_id,
+            model_arn,
+            input_tokens,
+            output_tokens,
+            latency,
+            source="retrieve_and_generate",
+            estimated=True,
+            kb_session="reused" if kb_session_id else "new"
+        )
+        kb_sessions.record_turn(bool(kb_session_id), latency, input_tokens, output_tokens)
         
-        return ""
+        return text
         
     except Exception as e:
-        logger.error(f"Error querying knowledge base: {str(e)}")
+        logger.error("Error querying knowledge base: %s", e)
         return ""
 
 def verify_kb_setup() -> bool:
@@ -102,21 +355,62 @@ def verify_kb_setup() -> bool:
         for var in required_vars:
             value = secrets.get(var)
             if not value:
-                logger.error(f"Missing required secret: {var}")
+                logger.error("Missing required secret: %s", var)
                 return False
-            logger.info(f"{var} is set")
+            logger.info("%s is set", var)
         
-        # Test KB connection
-        kb_client = init_knowledge_base()
-        test_response = get_knowledge_base_response(kb_client, "test query")
-        
-        if test_response:
-            logger.info("✅ Knowledge Base setup verification completed successfully")
-            return True
-        else:
-            logger.error("❌ Knowledge Base returned empty response")
-            return False
+        # Check the KB status with a control-plane call instead of a test query
+        from health import check_knowledge_base
+        logger.info(check_knowledge_base(secrets))
+        logger.info("✅ Knowledge Base setup verification completed successfully")
+        return True
             
     except Exception as e:
-        logger.error(f"❌ Error verifying Knowledge Base setup: {str(e)}")
-        return False 
\ No newline at end of file
+        logger.error("❌ Error verifying Knowledge Base setup: %s", e)
+        return False
+
+
+# Scripted conversation for the session benchmark; every turn after the first is a follow-up
+_BENCH_CONVERSATION = [
+    "What is the LuminaSphere?",
+    "How big does it come?",
+    "Can I get it in walnut?",
+    "How long would that take to ship?",
+]
+
+
+def _session_benchmark(kb_client, rounds: int = 3) -> None:
+    """Follow-up latency and input tokens: KB session affinity vs stateless calls that resend the history"""
+    import uuid
+    results = {"stateless": [], "session": []}
+    for _ in range(rounds):
+        for mode in results:
+            session_id = f"kb-bench-{uuid.uuid4()}" if mode == "session" else None
+            history = []
+            for turn, question in enumerate(_BENCH_CONVERSATION):
+                query = question
+                if mode == "stateless" and history:
+                    # Without a session the follow-up only makes sense with the earlier turns attached
+                    query = "\n".join(history + [f"Customer: {question}"])
+                start_time = time.perf_counter()
+                answer = _retrieve_and_generate(kb_client, query, session_id=session_id)
+                if turn:
+                    results[mode].append((time.perf_counter() - start_time, estimate_tokens(query)))
+                history += [f"Customer: {question}", f"Assistant: {answer}"]
+            end_kb_session(session_id)
+
+    for mode, samples in results.items():
+        latencies = sorted(latency for latency, _ in samples)
+        print(f"{mode:<10} follow-ups: {len(samples)}, p50 {latencies[len(latencies) // 2] * 1000:.0f} ms, "
+              f"mean input {sum(tokens for _, tokens in samples) / len(samples):.0f} tokens")
+    print("session store:", get_kb_session_stats())
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "session-bench":
+        from log_utils import configure_logging
+        configure_logging(fmt="text")
+        _session_benchmark(init_knowledge_base())
+    else:
+        print("usage: python knowledge_base.py session-bench   (live AWS, or CASSETTE_MODE=replay)")
@@ -0,0 +1,102 @@
+"""Load test for the headless chat API.
+
+Usage:
+    python load_test.py [--url http://localhost:8080] [--concurrency 32] [--duration 30]
+
+For offline runs start the API with CASSETTE_MODE=replay (and optionally
+CASSETTE_SIMULATE_LATENCY=true) against a cassette recorded from the same prompts.
+"""
+import argparse
+import itertools
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+DEFAULT_PROMPTS = [
+    "What is the company history?",
+    "What kind of balls do you sell?",
+    "What materials do you use for your balls?",
+    "Do you offer custom orders?",
+    "How long does shipping take?",
+]
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _post(url, payload, timeout):
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(payload).encode('utf-8'),
+        headers={"Content-Type": "application/json"},
+        method="POST"
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        response.read()
+        return response.status
+
+
+def run_load_test(base_url, concurrency, duration, prompts=None, timeout=60.0):
+    """Hit /chat from `concurrency` threads for `duration` seconds and summarize"""
+    prompts = itertools.cycle(prompts or DEFAULT_PROMPTS)
+    prompt_lock = threading.Lock()
+    results_lock = threading.Lock()
+    latencies, statuses = [], {}
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        session_id = str(uuid.uuid4())
+        while time.perf_counter() < deadline:
+            with prompt_lock:
+                prompt = next(prompts)
+            start = time.perf_counter()
+            try:
+                status = _post(f"{base_url}/chat", {"message": prompt, "session_id": session_id}, timeout)
+            except urllib.error.HTTPError as e:
+                status = e.code
+            except Exception:
+                status = "error"
+            elapsed = time.perf_counter() - start
+            with results_lock:
+                statuses[status] = statuses.get(status, 0) + 1
+                if status == 200:
+                    latencies.append(elapsed)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "duration_seconds": wall,
+        "requests": sum(statuses.values()),
+        "successful": len(latencies),
+        "requests_per_second": len(latencies) / wall if wall else 0.0,
+        "statuses": {str(k): v for k, v in statuses.items()},
+        "latency_p50": _percentile(latencies, 50),
+        "latency_p95": _percentile(latencies, 95),
+        "latency_p99": _percentile(latencies, 99),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the Rivertown chat API")
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30.0)
+    args = parser.parse_args()
+
+    summary = run_load_test(args.url.rstrip('/'), args.concurrency, args.duration)
+    print(json.dumps(summary, indent=2))
@@ -0,0 +1,413 @@
+"""In-process stand-in for DynamoDB tables, for offline runs and scale tests.
+
+Implements the subset of the Table API this app uses (scan with filter/projection
+expressions, 1 MB pages and parallel scan segments, query on the key or a global
+secondary index with sort key ranges, get_item, put_item, delete_item, batch_writer)
+and meters read/write capacity the way DynamoDB bills it. Nested attributes (order lists) are kept as compact JSON until an item is
+returned, so a million customers fit in memory.
+
+For the real engine, run DynamoDB Local and set DYNAMODB_ENDPOINT_URL instead.
+"""
+import bisect
+import gzip
+import json
+import math
+import re
+import threading
+import zlib
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from botocore.exceptions import ClientError
+
+# DynamoDB returns at most this much scanned data per Scan/Query page
+PAGE_BYTES = 1024 * 1024
+# Read units cover 4 KB (eventually consistent reads cost half), write units 1 KB
+READ_UNIT_BYTES = 4096
+WRITE_UNIT_BYTES = 1024
+
+# Key schema and indexes of the tables this app uses: table -> (key attributes, {index: (partition, sort)})
+TABLE_SCHEMAS = {
+    'Rivertownball-cus': (('customer_id',), {'name-index': ('last_name', 'first_name')}),
+    'Rivertownball-orders': (('customer_id', 'order_key'), {}),
+}
+DEFAULT_SCHEMA = (('id',), {})
+
+# One condition of an expression: begins_with(a, :v), a BETWEEN :lo AND :hi, or a comparison
+_CLAUSE = re.compile(
+    r"\s*(?:begins_with\(\s*(?P<prefix_of>[^,\s]+)\s*,\s*(?P<prefix>[^)\s]+)\s*\)"
+    r"|(?P<ranged>\S+)\s+between\s+(?P<low>\S+)\s+and\s+(?P<high>\S+)"
+    r"|(?P<left>[^\s<>=]+)\s*(?P<op><=|>=|<>|=|<|>)\s*(?P<right>[^\s<>=]+))\s*(?:and\s+|$)",
+    re.IGNORECASE)
+# Comparison with the operands swapped (":v < a" is "a > :v")
+_FLIPPED = {'=': '=', '<>': '<>', '<': '>', '>': '<', '<=': '>=', '>=': '<='}
+
+
+def _value_size(value: Any) -> int:
+    """Approximate DynamoDB storage size of an attribute value"""
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, bool) or value is None:
+        return 1
+    if isinstance(value, (int, float, Decimal)):
+        digits = len(str(value).lstrip('-').replace('.', '').lstrip('0')) or 1
+        return (digits + 1) // 2 + 1
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return 3 + sum(len(k.encode('utf-8')) + 1 + _value_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return 3 + sum(1 + _value_size(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return sum(_value_size(v) for v in value)
+    return len(str(value))
+
+
+def item_size(item: Dict[str, Any]) -> int:
+    return sum(len(name.encode('utf-8')) + _value_size(value) for name, value in item.items())
+
+
+def json_default(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def _loads(data: str) -> Any:
+    # Numbers come back as Decimal, like boto3's deserializer
+    return json.loads(data, parse_float=Decimal, parse_int=Decimal)
+
+
+class _StoredItem:
+    """Top-level scalars as-is, nested attributes as JSON"""
+
+    __slots__ = ('scalars', 'nested', 'size')
+
+    def __init__(self, item: Dict[str, Any]):
+        self.scalars = {k: v for k, v in item.items() if not isinstance(v, (dict, list, tuple, set, frozenset))}
+        nested = {k: v for k, v in item.items() if k not in self.scalars}
+        self.nested = json.dumps(nested, default=json_default, separators=(',', ':')) if nested else None
+        self.size = item_size(item)
+
+    def get(self, attribute: str) -> Any:
+        if attribute in self.scalars:
+            return self.scalars[attribute]
+        if self.nested is None:
+            return None
+        return _loads(self.nested).get(attribute)
+
+    def to_item(self, attributes: Optional[List[str]] = None) -> Dict[str, Any]:
+        if attributes is not None and all(a in self.scalars for a in attributes):
+            return {a: self.scalars[a] for a in attributes}
+        item = dict(self.scalars)
+        if self.nested is not None:
+            item.update(_loads(self.nested))
+        if attributes is not None:
+            item = {a: item[a] for a in attributes if a in item}
+        return item
+
+
+def _parse_conditions(expression: str, names: Dict[str, str], values: Dict[str, Any]) -> List[Tuple[str, str, Any]]:
+    """`#a = :a AND b BETWEEN :lo AND :hi` -> [(attribute, operator, value), ...]
+
+    Supports =, <>, <, <=, >, >=, BETWEEN and begins_with(), joined by AND.
+    """
+    conditions, position, expression = [], 0, expression.strip()
+    while position < len(expression):
+        match = _CLAUSE.match(expression, position)
+        if not match or match.end() == position:
+            raise ValueError(f"Unsupported expression: {expression[position:]!r}")
+        position = match.end()
+        if match.group('prefix_of'):
+            conditions.append((names.get(match.group('prefix_of'), match.group('prefix_of')), 'begins_with',
+                               values[match.group('prefix')]))
+        elif match.group('ranged'):
+            conditions.append((names.get(match.group('ranged'), match.group('ranged')), 'between',
+                               (values[match.group('low')], values[match.group('high')])))
+        else:
+            left, op, right = match.group('left'), match.group('op'), match.group('right')
+            if left.startswith(':') == right.startswith(':'):
+                raise ValueError(f"Unsupported expression: {match.group(0).strip()!r}")
+            if left.startswith(':'):
+                left, right, op = right, left, _FLIPPED[op]
+            conditions.append((names.get(left, left), op, values[right]))
+    return conditions
+
+
+def _matches(value: Any, op: str, operand: Any) -> bool:
+    if op == '=':
+        return value == operand
+    if op == '<>':
+        return value != operand
+    if value is None:
+        return False
+    if op == 'begins_with':
+        return isinstance(value, str) and value.startswith(operand)
+    if op == 'between':
+        return operand[0] <= value <= operand[1]
+    if op == '<':
+        return value < operand
+    if op == '<=':
+        return value <= operand
+    if op == '>':
+        return value > operand
+    return value >= operand
+
+
+def _segment(key: Tuple, total_segments: int) -> int:
+    """Parallel scan segment of an item key (stable across processes)"""
+    return zlib.crc32(repr(key).encode('utf-8')) % total_segments
+
+
+def _parse_projection(expression: Optional[str], names: Dict[str, str]) -> Optional[List[str]]:
+    if not expression:
+        return None
+    return [names.get(token.strip(), token.strip()) for token in expression.split(',')]
+
+
+class _BatchWriter:
+    def __init__(self, table: "LocalTable"):
+        self._table = table
+
+    def put_item(self, Item: Dict[str, Any]) -> None:
+        self._table.put_item(Item=Item)
+
+    def delete_item(self, Key: Dict[str, Any]) -> None:
+        self._table.delete_item(Key=Key)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class LocalTable:
+    """Thread-safe in-memory table with DynamoDB paging and capacity accounting"""
+
+    def __init__(self, name: str, key_attributes: Iterable[str] = ('id',),
+                 indexes: Optional[Dict[str, Tuple[str, Optional[str]]]] = None):
+        self.name = name
+        self.table_name = name
+        self.key_attributes = tuple(key_attributes)
+        self.indexes = dict(indexes or {})
+        self._lock = threading.RLock()
+        self._items: Dict[Tuple, _StoredItem] = {}
+        self._order: List[Tuple] = []
+        self._positions: Dict[Tuple, int] = {}
+        # index name -> partition value -> item keys
+        self._index_entries: Dict[str, Dict[Any, List[Tuple]]] = {name: {} for name in self.indexes}
+        # partition value -> item keys in sort key order, for tables with a sort key
+        self._partitions: Dict[Any, List[Tuple]] = {}
+        self.read_units = 0.0
+        self.write_units = 0.0
+        self.requests = 0
+
+    @property
+    def item_count(self) -> int:
+        return len(self._items)
+
+    @property
+    def size_bytes(self) -> int:
+        """Billable size of all items, as DescribeTable's TableSizeBytes"""
+        with self._lock:
+            return sum(stored.size for stored in self._items.values())
+
+    def _key(self, item: Dict[str, Any]) -> Tuple:
+        try:
+            return tuple(item[a] for a in self.key_attributes)
+        except KeyError as e:
+            raise ValueError(f"Item is missing key attribute {e} for table {self.name}")
+
+    def _key_dict(self, key: Tuple) -> Dict[str, Any]:
+        return dict(zip(self.key_attributes, key))
+
+    def _charge(self, read_bytes: int = 0, write_bytes: int = 0, consistent: bool = False,
+                request: Optional[Dict[str, Any]] = None, response: Optional[Dict[str, Any]] = None) -> None:
+        units = 0.0
+        if read_bytes:
+            units = math.ceil(read_bytes / READ_UNIT_BYTES) * (1.0 if consistent else 0.5)
+            self.read_units += units
+        if write_bytes:
+            units = math.ceil(write_bytes / WRITE_UNIT_BYTES)
+            self.write_units += units
+        self.requests += 1
+        if request is not None and response is not None and request.get('ReturnConsumedCapacity', 'NONE') != 'NONE':
+            response['ConsumedCapacity'] = {'TableName': self.name, 'CapacityUnits': units}
+
+    def put_item(self, Item: Dict[str, Any], **kwargs) -> Dict[str, Any]:
+        key = self._key(Item)
+        stored = _StoredItem(Item)
+        with self._lock:
+            previous = self._items.get(key)
+            if previous is not None:
+                self._unindex(key, previous)
+            if key not in self._positions:
+                self._positions[key] = len(self._order)
+                self._order.append(key)
+            if previous is None and len(self.key_attributes) > 1:
+                bisect.insort(self._partitions.setdefault(key[0], []), key)
+            self._items[key] = stored
+            self._index(key, stored)
+            response = {}
+            self._charge(write_bytes=max(stored.size, 1), request=kwargs, response=response)
+        return response
+
+    def delete_item(self, Key: Dict[str, Any], **kwargs) -> Dict[str, Any]:
+        key = self._key(Key)
+        with self._lock:
+            stored = self._items.pop(key, None)
+            if stored is not None:
+                self._unindex(key, stored)
+                if len(self.key_attributes) > 1:
+                    partition = self._partitions[key[0]]
+                    del partition[bisect.bisect_left(partition, key)]
+            response = {}
+            self._charge(write_bytes=stored.size if stored else 1, request=kwargs, response=response)
+        return response
+
+    def get_item(self, Key: Dict[str, Any], ProjectionExpression: Optional[str] = None,
+                 ExpressionAttributeNames: Optional[Dict[str, str]] = None,
+                 ConsistentRead: bool = False, **kwargs) -> Dict[str, Any]:
+        if set(Key) != set(self.key_attributes):
+            # As DynamoDB does, so callers' handling of a misconfigured key can be exercised offline
+            raise ClientError({"Error": {"Code": "ValidationException",
+                                         "Message": "The provided key element does not match the schema"}}, "GetItem")
+        key = self._key(Key)
+        with self._lock:
+            stored = self._items.get(key)
+        response = {}
+        if stored is not None:
+            response['Item'] = stored.to_item(_parse_projection(ProjectionExpression, ExpressionAttributeNames or {}))
+        with self._lock:
+            self._charge(read_bytes=stored.size if stored else 1, consistent=ConsistentRead,
+                         request=kwargs, response=response)
+        return response
+
+    def _index(self, key: Tuple, stored: _StoredItem) -> None:
+        for index_name, (partition, _) in self.indexes.items():
+            value = stored.scalars.get(partition)
+            if value is not None:
+                self._index_entries[index_name].setdefault(value, []).append(key)
+
+    def _unindex(self, key: Tuple, stored: _StoredItem) -> None:
+        for index_name, (partition, _) in self.indexes.items():
+            keys = self._index_entries[index_name].get(stored.scalars.get(partition))
+            if keys and key in keys:
+                keys.remove(key)
+
+    def _page(self, keys: Iterable[Tuple], conditions: List[Tuple[str, str, Any]], filters: List[Tuple[str, str, Any]],
+              projection: Optional[List[str]], limit: Optional[int], consistent: bool,
+              request: Dict[str, Any]) -> Dict[str, Any]:
+        """Read items in key order up to a 1 MB page, applying key conditions then filters"""
+        items, scanned, read_bytes, last_key, more = [], 0, 0, None, False
+        with self._lock:
+            for key in keys:
+                if read_bytes >= PAGE_BYTES or (limit and scanned >= limit):
+                    more = True
+                    break
+                stored = self._items.get(key)
+                if stored is None or not all(_matches(stored.get(a), op, v) for a, op, v in conditions):
+                    continue
+                scanned += 1
+                read_bytes += stored.size
+                last_key = key
+                if all(_matches(stored.get(a), op, v) for a, op, v in filters):
+                    items.append(stored.to_item(projection))
+            response = {'Items': items, 'Count': len(items), 'ScannedCount': scanned}
+            if more and last_key is not None:
+                response['LastEvaluatedKey'] = self._key_dict(last_key)
+            self._charge(read_bytes=max(read_bytes, 1), consistent=consistent, request=request, response=response)
+        return response
+
+    def scan(self, FilterExpression: Optional[str] = None, ProjectionExpression: Optional[str] = None,
+             ExpressionAttributeNames: Optional[Dict[str, str]] = None,
+             ExpressionAttributeValues: Optional[Dict[str, Any]] = None,
+             ExclusiveStartKey: Optional[Dict[str, Any]] = None, Limit: Optional[int] = None,
+             ConsistentRead: bool = False, Segment: Optional[int] = None, TotalSegments: Optional[int] = None,
+             **kwargs) -> Dict[str, Any]:
+        names = ExpressionAttributeNames or {}
+        filters = _parse_conditions(FilterExpression, names, ExpressionAttributeValues or {}) if FilterExpression else []
+        start = self._positions[self._key(ExclusiveStartKey)] + 1 if ExclusiveStartKey else 0
+        with self._lock:
+            keys = self._order[start:]
+        if TotalSegments:
+            keys = [k for k in keys if _segment(k, TotalSegments) == Segment]
+        return self._page(keys, [], filters, _parse_projection(ProjectionExpression, names), Limit,
+                          ConsistentRead, kwargs)
+
+    def query(self, KeyConditionExpression: str, IndexName: Optional[str] = None,
+              FilterExpression: Optional[str] = None, ProjectionExpression: Optional[str] = None,
+              ExpressionAttributeNames: Optional[Dict[str, str]] = None,
+              ExpressionAttributeValues: Optional[Dict[str, Any]] = None,
+              ExclusiveStartKey: Optional[Dict[str, Any]] = None, Limit: Optional[int] = None,
+              ConsistentRead: bool = False, ScanIndexForward: bool = True, **kwargs) -> Dict[str, Any]:
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        conditions = _parse_conditions(KeyConditionExpression, names, values)
+        filters = _parse_conditions(FilterExpression, names, values) if FilterExpression else []
+        partition = self.indexes[IndexName][0] if IndexName else self.key_attributes[0]
+        partition_value = next((v for a, op, v in conditions if a == partition and op == '='), None)
+        if partition_value is None:
+            raise ValueError(f"Query needs an equality condition on {partition}")
+
+        with self._lock:
+            if IndexName:
+                keys = list(self._index_entries[IndexName].get(partition_value, []))
+            else:
+                keys = [k for k in self._order if k[0] == partition_value] if len(self.key_attributes) == 1 \
+                    else self._partition_keys(partition_value)
+        if not ScanIndexForward:
+            keys.reverse()
+        if ExclusiveStartKey:
+            start_key = self._key(ExclusiveStartKey)
+            keys = keys[keys.index(start_key) + 1:] if start_key in keys else []
+        return self._page(keys, conditions, filters, _parse_projection(ProjectionExpression, names), Limit,
+                          ConsistentRead, kwargs)
+
+    def _partition_keys(self, partition_value: Any) -> List[Tuple]:
+        # Items of one partition in sort key order
+        return list(self._partitions.get(partition_value, []))
+
+    def batch_writer(self, **kwargs) -> _BatchWriter:
+        return _BatchWriter(self)
+
+    def capacity(self) -> Dict[str, float]:
+        with self._lock:
+            return {"read_units": self.read_units, "write_units": self.write_units, "requests": self.requests}
+
+
+class LocalDynamoDB:
+    """Resource-shaped container of LocalTables"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tables: Dict[str, LocalTable] = {}
+
+    def create_table(self, name: str, key_attributes: Iterable[str],
+                     indexes: Optional[Dict[str, Tuple[str, Optional[str]]]] = None) -> LocalTable:
+        with self._lock:
+            table = LocalTable(name, key_attributes, indexes)
+            self._tables[name] = table
+            return table
+
+    def Table(self, name: str) -> LocalTable:
+        with self._lock:
+            table = self._tables.get(name)
+        if table is None:
+            key_attributes, indexes = TABLE_SCHEMAS.get(name, DEFAULT_SCHEMA)
+            table = self.create_table(name, key_attributes, indexes)
+        return table
+
+    def load_jsonl(self, table_name: str, path: str) -> int:
+        """Load items from a (gzipped) JSON-lines file"""
+        table = self.Table(table_name)
+        opener = gzip.open if path.endswith('.gz') else open
+        count = 0
+        with opener(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    table.put_item(Item=_loads(line))
+                    count += 1
+        return count
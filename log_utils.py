@@ -0,0 +1,291 @@
+"""Structured, sampled, asynchronous logging for the request path.
+
+    configure_logging()                      # once at process start
+    with request_context(session_id=...):    # per chat turn / HTTP request
+        logger.debug("Raw KB response: %s", Payload(response))
+
+Run `python log_utils.py bench` to measure per-request logging overhead.
+"""
+import contextlib
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+import zlib
+from typing import Any, Dict, Optional
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# "json" for structured records, "text" for the classic format
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+# Maximum characters of any payload rendered into a record
+LOG_PAYLOAD_LIMIT = int(os.getenv('LOG_PAYLOAD_LIMIT', '2000'))
+# Fraction of requests whose DEBUG records are kept
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', '0.05'))
+# Hard cap on DEBUG records per second across the process
+LOG_DEBUG_MAX_PER_SECOND = float(os.getenv('LOG_DEBUG_MAX_PER_SECOND', '50'))
+# Records buffered for the background writer before new ones are dropped
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_request_id = contextvars.ContextVar('request_id', default=None)
+_session_id = contextvars.ContextVar('session_id', default=None)
+# Whether DEBUG records are kept for the current request (None outside requests)
+_debug_sampled = contextvars.ContextVar('debug_sampled', default=None)
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+# Top-level modules of this repository, whose loggers skip unsampled DEBUG calls up front
+_REPO_MODULES = frozenset(
+    os.path.splitext(name)[0] for name in os.listdir(os.path.dirname(os.path.abspath(__file__)))
+    if name.endswith('.py')) | {'__main__'}
+
+
+@contextlib.contextmanager
+def request_context(request_id: Optional[str] = None, session_id: Optional[str] = None):
+    """Tag every record logged inside the block with a request (and session) ID"""
+    request_id = request_id or uuid.uuid4().hex[:16]
+    request_token = _request_id.set(request_id)
+    session_token = _session_id.set(session_id)
+    sampled_token = _debug_sampled.set(is_request_sampled(request_id))
+    try:
+        yield request_id
+    finally:
+        _request_id.reset(request_token)
+        _session_id.reset(session_token)
+        _debug_sampled.reset(sampled_token)
+
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def bind_session(session_id: Optional[str]) -> None:
+    """Attach a session ID to the current request once it is known (e.g. after parsing the body)"""
+    _session_id.set(session_id)
+
+
+class Payload:
+    """Defers rendering of a (possibly large) object until a record is actually emitted,
+    and caps the rendered size"""
+
+    __slots__ = ('value', 'limit')
+
+    def __init__(self, value: Any, limit: int = LOG_PAYLOAD_LIMIT):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        text = self.value if isinstance(self.value, str) else repr(self.value)
+        if len(text) > self.limit:
+            return f"{text[:self.limit]}... [{len(text) - self.limit} more chars]"
+        return text
+
+    __repr__ = __str__
+
+
+def is_request_sampled(request_id: str, sample_rate: float = LOG_DEBUG_SAMPLE_RATE) -> bool:
+    """Deterministic per-request sampling decision, so sampled requests are complete"""
+    if sample_rate >= 1.0:
+        return True
+    return (zlib.crc32(request_id.encode('utf-8')) % 10000) < sample_rate * 10000
+
+
+class SampledLogger(logging.Logger):
+    """Logger that treats DEBUG as disabled for unsampled requests.
+
+    Checking in isEnabledFor means unsampled DEBUG calls return before a LogRecord
+    is built or the caller's frame is looked up. Only this repository's loggers are
+    switched to it; DebugSampleFilter covers everyone else's.
+    """
+
+    def isEnabledFor(self, level):
+        if level <= logging.DEBUG and _debug_sampled.get() is False:
+            return False
+        return super().isEnabledFor(level)
+
+
+class DebugSampleFilter(logging.Filter):
+    """Drops DEBUG records of unsampled requests.
+
+    Runs on the handler, so library loggers (botocore, urllib3, streamlit) are sampled
+    too without touching their class. Arguments are only rendered by the formatter,
+    so a dropped record costs its LogRecord and nothing more.
+    """
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or _debug_sampled.get() is not False
+
+
+class ContextFilter(logging.Filter):
+    """Copies the request context onto the record on the calling thread"""
+
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        record.session_id = _session_id.get()
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """Caps DEBUG records per second across the process (token bucket)"""
+
+    def __init__(self, max_per_second: float = LOG_DEBUG_MAX_PER_SECOND):
+        super().__init__()
+        self.max_per_second = max_per_second
+        self._tokens = max_per_second
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.max_per_second, self._tokens + (now - self._last_refill) * self.max_per_second)
+            self._last_refill = now
+            if self._tokens < 1:
+                self.dropped += 1
+                return False
+            self._tokens -= 1
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record"""
+
+    def format(self, record):
+        entry: Dict[str, Any] = {
+            "ts": self.formatTime(record, '%Y-%m-%dT%H:%M:%S') + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, 'request_id', None):
+            entry["request_id"] = record.request_id
+        if getattr(record, 'session_id', None):
+            entry["session_id"] = record.session_id
+        # Structured fields passed as logger.info(..., extra={"fields": {...}})
+        fields = getattr(record, 'fields', None)
+        if isinstance(fields, dict):
+            entry.update(fields)
+        if record.exc_info:
+            entry["exception"] = str(Payload(self.formatException(record.exc_info), LOG_PAYLOAD_LIMIT * 4))
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves message formatting to the background thread and
+    drops records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Formatting happens in the listener thread; only the record is enqueued
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT, asynchronous: bool = True,
+                      stream=None) -> logging.Handler:
+    """Install the structured/sampled/async handler on the root logger (idempotent)"""
+    global _listener
+    root = logging.getLogger()
+    if _listener is not None:
+        return root.handlers[0]
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+
+    if asynchronous:
+        handler = DeferredQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+        _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+        _listener.start()
+    else:
+        handler = output
+
+    # Filters run on the calling thread, before anything is queued; unsampled DEBUG
+    # records are dropped before they take a rate-limit token
+    handler.addFilter(ContextFilter())
+    handler.addFilter(DebugSampleFilter())
+    handler.addFilter(RateLimitFilter())
+
+    # This repo's loggers (created at import) return early on unsampled DEBUG calls
+    for name, existing_logger in list(logging.root.manager.loggerDict.items()):
+        if type(existing_logger) is logging.Logger and name.split('.')[0] in _REPO_MODULES:
+            existing_logger.__class__ = SampledLogger
+
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(getattr(logging, level, logging.INFO))
+    return handler
+
+
+def shutdown_logging() -> None:
+    """Flush and stop the background writer"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _benchmark(requests: int = 2000):
+    """Per-request logging overhead: eager synchronous f-strings vs this subsystem"""
+    devnull = open(os.devnull, 'w')
+    response = {"output": {"text": "x" * 4000}, "citations": [{"content": "y" * 2000}] * 5}
+    bench_logger = logging.getLogger(__name__)
+
+    def eager_request():
+        bench_logger.info(f"Querying knowledge base for {'what materials do you use'}")
+        bench_logger.debug(f"Raw KB response: {response}")
+        for i in range(10):
+            bench_logger.debug(f"Processed order: {response['citations'][0]}")
+        bench_logger.info(f"Successfully processed {10} orders")
+
+    def lazy_request():
+        with request_context():
+            bench_logger.info("Querying knowledge base for %s", 'what materials do you use')
+            bench_logger.debug("Raw KB response: %s", Payload(response))
+            for i in range(10):
+                bench_logger.debug("Processed order: %s", Payload(response['citations'][0]))
+            bench_logger.info("Successfully processed %d orders", 10)
+
+    def run(label, func, level):
+        bench_logger.setLevel(level)
+        start = time.perf_counter()
+        for _ in range(requests):
+            func()
+        per_request = (time.perf_counter() - start) / requests * 1e6
+        print(f"{label:<48} {per_request:8.1f} us/request")
+
+    root = logging.getLogger()
+    root.handlers = [logging.StreamHandler(devnull)]
+    root.handlers[0].setFormatter(logging.Formatter(TEXT_FORMAT))
+    run("eager f-strings, sync handler, INFO", eager_request, logging.INFO)
+    run("eager f-strings, sync handler, DEBUG", eager_request, logging.DEBUG)
+
+    configure_logging(fmt='json', asynchronous=True, stream=devnull)
+    run("lazy + sampled + async JSON, INFO", lazy_request, logging.INFO)
+    run("lazy + sampled + async JSON, DEBUG", lazy_request, logging.DEBUG)
+    shutdown_logging()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        _benchmark()
+    else:
+        print("Usage: python log_utils.py bench")
@@ -0,0 +1,405 @@
+"""In-memory customer name index for order lookups.
+
+Names are matched by character trigrams (typos, dropped letters) and Soundex codes
+(names that sound alike), so "jon smyth" still suggests "John Smith". Only a name
+that matches one customer exactly (ignoring case, accents and punctuation) is resolved;
+anything else becomes ranked "did you mean" suggestions, all without touching DynamoDB.
+
+Run `python name_index.py bench` to time lookups against a synthetic customer list.
+"""
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import unicodedata
+from array import array
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Minimum score for a "did you mean" suggestion
+NAME_SUGGEST_THRESHOLD = float(os.getenv('NAME_SUGGEST_THRESHOLD', '0.4'))
+# Seconds between background refreshes of the index from the customer table
+NAME_INDEX_REFRESH_SECONDS = float(os.getenv('NAME_INDEX_REFRESH_SECONDS', '300'))
+# Primary key attributes of the customer table, remembered per name so lookups can use GetItem instead of a scan
+CUSTOMER_KEY_ATTRIBUTES = [a.strip() for a in os.getenv('CUSTOMER_KEY_ATTRIBUTES', 'customer_id').split(',') if a.strip()]
+
+CUSTOMER_TABLE = 'Rivertownball-cus'
+
+# Weight of the phonetic match vs the trigram overlap
+_PHONETIC_WEIGHT = 0.3
+# Candidates are gathered from the rarest fraction of the query's trigrams, then verified
+_CANDIDATE_GRAM_FRACTION = 0.4
+_MAX_VERIFIED_CANDIDATES = 50
+# Names remembered as already scanned for since the last refresh; once full, misses are not scanned for
+_MAX_SCANNED_MISSES = 10000
+# Name parts whose trigrams and Soundex code are memoized; first and last names repeat a lot
+_TOKEN_CACHE_SIZE = 16384
+# Highest score a name that doesn't match exactly can get
+_MAX_FUZZY_SCORE = 0.99
+
+_NON_LETTERS = re.compile(r"[^a-z\s]")
+_SOUNDEX_CODES = {c: str(d) for d, letters in enumerate(
+    ("aeiouyhw", "bfpv", "cgjkqsxz", "dt", "l", "mn", "r")) for c in letters}
+
+NameKey = Tuple[str, str]
+
+
+def normalize_name(name: str) -> str:
+    """Lowercase ASCII letters and single spaces: "O'Neil-Brown " -> "oneil brown" """
+    ascii_name = unicodedata.normalize('NFKD', name or '').encode('ascii', 'ignore').decode('ascii').lower()
+    ascii_name = ascii_name.replace('-', ' ')
+    return ' '.join(_NON_LETTERS.sub('', ascii_name).split())
+
+
+@lru_cache(maxsize=_TOKEN_CACHE_SIZE)
+def _token_trigrams(token: str) -> FrozenSet[str]:
+    padded = f"  {token} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def trigrams(normalized: str) -> Set[str]:
+    """Character trigrams of each token, padded so first and last letters count"""
+    grams = set()
+    for token in normalized.split():
+        grams.update(_token_trigrams(token))
+    return grams
+
+
+@lru_cache(maxsize=_TOKEN_CACHE_SIZE)
+def soundex(token: str) -> str:
+    """American Soundex code of a single lowercase token"""
+    if not token:
+        return ""
+    code = token[0].upper()
+    previous = _SOUNDEX_CODES.get(token[0], '')
+    for char in token[1:]:
+        digit = _SOUNDEX_CODES.get(char, '')
+        if digit and digit != '0' and digit != previous:
+            code += digit
+        # h and w don't separate letters with the same code; vowels do
+        if char not in 'hw':
+            previous = digit
+    return (code + "000")[:4]
+
+
+def phonetic_keys(normalized: str) -> FrozenSet[str]:
+    return frozenset(soundex(token) for token in normalized.split())
+
+
+class NameIndex:
+    """Trigram + phonetic index over customer (first_name, last_name) pairs
+
+    Entries are numbered; postings are compact arrays of entry numbers, and a candidate's
+    trigrams and Soundex codes are recomputed from its name when it is scored rather than
+    stored per entry. Removed entries are blanked and skipped until the next rebuild.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids: Dict[NameKey, int] = {}
+        # Entry number -> name (None once removed) and table key values
+        self._names: List[Optional[NameKey]] = []
+        self._key_values: List[Any] = []
+        self._key_attributes: Tuple[str, ...] = tuple(CUSTOMER_KEY_ATTRIBUTES)
+        # Normalized name -> entry number, or a tuple of them when several customers share it
+        self._normalized: Dict[str, Any] = {}
+        self._trigrams: Dict[str, array] = {}
+        self._phonetic: Dict[str, array] = {}
+        self.ready = False
+        self.loaded_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _pack_key(self, key: Optional[Dict[str, Any]]) -> Any:
+        # Just the values, and a single-attribute key without a tuple around it
+        if not key or tuple(key) != self._key_attributes:
+            return None
+        values = tuple(key.values())
+        return values[0] if len(values) == 1 else values
+
+    def _unpack_key(self, values: Any) -> Dict[str, Any]:
+        if len(self._key_attributes) == 1:
+            return {self._key_attributes[0]: values}
+        return dict(zip(self._key_attributes, values))
+
+    def _add(self, name: NameKey, normalized: str, key: Optional[Dict[str, Any]]) -> None:
+        # Caller holds the lock (or owns an index nobody else can see yet)
+        entry_id = len(self._names)
+        # Interned so customers sharing a first or last name share one string
+        self._names.append((sys.intern(name[0]), sys.intern(name[1])))
+        self._key_values.append(self._pack_key(key))
+        self._ids[self._names[entry_id]] = entry_id
+        existing = self._normalized.get(normalized)
+        if existing is None:
+            self._normalized[normalized] = entry_id
+        else:
+            self._normalized[normalized] = (existing if isinstance(existing, tuple) else (existing,)) + (entry_id,)
+        for gram in trigrams(normalized):
+            self._trigrams.setdefault(gram, array('I')).append(entry_id)
+        for code in phonetic_keys(normalized):
+            self._phonetic.setdefault(code, array('I')).append(entry_id)
+
+    def add(self, first_name: str, last_name: str, key: Optional[Dict[str, Any]] = None) -> None:
+        """Index a customer name (no-op if it is already indexed)"""
+        name = (first_name or '', last_name or '')
+        normalized = normalize_name(f"{name[0]} {name[1]}")
+        if not normalized:
+            return
+        with self._lock:
+            if name not in self._ids:
+                self._add(name, normalized, key)
+
+    def remove(self, first_name: str, last_name: str) -> None:
+        name = (first_name or '', last_name or '')
+        with self._lock:
+            entry_id = self._ids.pop(name, None)
+            if entry_id is None:
+                return
+            self._names[entry_id] = None
+            self._key_values[entry_id] = None
+            normalized = normalize_name(f"{name[0]} {name[1]}")
+            existing = self._normalized.get(normalized)
+            if existing == entry_id:
+                del self._normalized[normalized]
+            elif isinstance(existing, tuple):
+                remaining = tuple(i for i in existing if i != entry_id)
+                self._normalized[normalized] = remaining if len(remaining) > 1 else remaining[0]
+
+    def key_for(self, first_name: str, last_name: str) -> Optional[Dict[str, Any]]:
+        """Table key of the customer with this exact name, if known"""
+        with self._lock:
+            entry_id = self._ids.get((first_name or '', last_name or ''))
+            values = self._key_values[entry_id] if entry_id is not None else None
+        return self._unpack_key(values) if values is not None else None
+
+    def sync(self, names: Iterable[NameKey], keys: Optional[Dict[NameKey, Dict[str, Any]]] = None) -> Tuple[int, int]:
+        """Bring the index in line with a full list of names (and their table keys). Returns (added, removed)"""
+        current = set(names)
+        with self._lock:
+            existing = set(self._ids)
+            blanked = len(self._names) - len(self._ids)
+        added, removed = current - existing, existing - current
+        if blanked + len(removed) > len(current) // 4:
+            # Mostly new or mostly stale: build a fresh index off the lock and swap it in
+            self._rebuild(current, keys or {})
+        else:
+            for name in removed:
+                self.remove(*name)
+            for name in added:
+                self.add(*name, key=(keys or {}).get(name))
+            if keys is not None:
+                with self._lock:
+                    for name, key in keys.items():
+                        entry_id = self._ids.get(name)
+                        if entry_id is not None:
+                            self._key_values[entry_id] = self._pack_key(key)
+        self.ready = True
+        self.loaded_at = time.time()
+        return len(added), len(removed)
+
+    def _rebuild(self, names: Iterable[NameKey], keys: Dict[NameKey, Dict[str, Any]]) -> None:
+        fresh = NameIndex()
+        fresh._key_attributes = self._key_attributes
+        for name in names:
+            normalized = normalize_name(f"{name[0]} {name[1]}")
+            if normalized and name not in fresh._ids:
+                fresh._add(name, normalized, keys.get(name))
+        with self._lock:
+            self._ids, self._names, self._key_values = fresh._ids, fresh._names, fresh._key_values
+            self._normalized, self._trigrams, self._phonetic = fresh._normalized, fresh._trigrams, fresh._phonetic
+
+    def search(self, query: str, limit: int = 5) -> List[Dict[str, Any]]:
+        """Ranked candidates for a typed name, best first. Only exact (normalized) matches score 1.0"""
+        normalized = normalize_name(query)
+        if not normalized:
+            return []
+        query_grams = trigrams(normalized)
+        query_codes = phonetic_keys(normalized)
+
+        with self._lock:
+            exact = self._normalized.get(normalized, ())
+            exact = set(exact) if isinstance(exact, tuple) else {exact}
+            # Rare trigrams select a small candidate set; a one-letter typo only spoils a few of them.
+            # Common ones ("  s", "th ") would pull in most of the table.
+            postings = sorted((self._trigrams.get(gram, ()) for gram in query_grams), key=len)
+            hits = Counter()
+            for posting in postings[:max(1, int(len(postings) * _CANDIDATE_GRAM_FRACTION + 0.5))]:
+                hits.update(posting)
+            # Names that sound the same in every part, however they are spelled
+            phonetic_postings = sorted((self._phonetic.get(code, ()) for code in query_codes), key=len)
+            if phonetic_postings and phonetic_postings[0]:
+                for entry_id in set(phonetic_postings[0]).intersection(*phonetic_postings[1:]):
+                    hits[entry_id] += 1
+            # Only the entries sharing the most rare trigrams are worth scoring in full
+            candidates = {entry_id for entry_id, _ in hits.most_common(_MAX_VERIFIED_CANDIDATES)} | exact
+            names = [(entry_id, self._names[entry_id]) for entry_id in candidates]
+
+        scored = []
+        for entry_id, name in names:
+            if name is None:
+                continue
+            if entry_id in exact:
+                scored.append((1.0, name))
+                continue
+            entry_normalized = normalize_name(f"{name[0]} {name[1]}")
+            entry_grams = trigrams(entry_normalized)
+            dice = 2.0 * len(query_grams & entry_grams) / (len(query_grams) + len(entry_grams))
+            phonetic = len(query_codes & phonetic_keys(entry_normalized)) / len(query_codes)
+            # Reordered or respelled names can score a perfect overlap; only exact matches get 1.0
+            scored.append((min(_MAX_FUZZY_SCORE, (1 - _PHONETIC_WEIGHT) * dice + _PHONETIC_WEIGHT * phonetic), name))
+        scored.sort(reverse=True)
+
+        return [{"first_name": first, "last_name": last, "score": round(score, 3)}
+                for score, (first, last) in scored[:limit]]
+
+    def resolve(self, query: str, limit: int = 3) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        """The customer whose name matches exactly (ignoring case, accents and punctuation), or None
+        and "did you mean" suggestions. A fuzzy match is never resolved on its own"""
+        candidates = self.search(query, limit=limit + 1)
+        exact = [c for c in candidates if c["score"] == 1.0]
+        if len(exact) == 1:
+            return exact[0], []
+        return None, [c for c in candidates[:limit] if c["score"] >= NAME_SUGGEST_THRESHOLD]
+
+
+def scan_customer_names(table, key_attributes: Iterable[str] = CUSTOMER_KEY_ATTRIBUTES) -> Dict[NameKey, Optional[Dict[str, Any]]]:
+    """Every customer name in the table with its item key, reading only those attributes"""
+    key_attributes = list(key_attributes)
+    attribute_names = {'#fn': 'first_name', '#ln': 'last_name'}
+    attribute_names.update({f'#k{i}': attribute for i, attribute in enumerate(key_attributes)})
+    request = {
+        'ProjectionExpression': ', '.join(attribute_names),
+        'ExpressionAttributeNames': attribute_names,
+    }
+    customers = {}
+    while True:
+        response = table.scan(**request)
+        for item in response.get('Items', []):
+            if item.get('first_name') or item.get('last_name'):
+                name = (item.get('first_name', ''), item.get('last_name', ''))
+                # Tables without the configured key attributes still get name matching, just no GetItem
+                key = {a: item[a] for a in key_attributes if a in item}
+                if name not in customers:
+                    customers[name] = key if key_attributes and len(key) == len(key_attributes) else None
+        if 'LastEvaluatedKey' not in response:
+            return customers
+        request['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+class CustomerNameIndex(NameIndex):
+    """NameIndex loaded from the customer table and refreshed in the background"""
+
+    def __init__(self, refresh_seconds: float = NAME_INDEX_REFRESH_SECONDS):
+        super().__init__()
+        self.refresh_seconds = refresh_seconds
+        self._load_lock = threading.Lock()
+        self._refreshing = False
+        # Names scanned for since the last refresh
+        self._scanned_misses: Set[NameKey] = set()
+        self._misses_lock = threading.Lock()
+
+    def ensure_loaded(self, dynamodb) -> bool:
+        """Load the index on first use and kick off a refresh once it is stale"""
+        if not self.ready:
+            with self._load_lock:
+                if not self.ready:
+                    self.refresh(dynamodb)
+        elif time.time() - self.loaded_at > self.refresh_seconds:
+            self._refresh_in_background(dynamodb)
+        return self.ready
+
+    def add_customer(self, customer: Dict[str, Any]) -> None:
+        """Index a customer item as it is written, so lookups find it before the next refresh"""
+        self.add(customer.get('first_name', ''), customer.get('last_name', ''),
+                 key={a: customer[a] for a in CUSTOMER_KEY_ATTRIBUTES if a in customer})
+
+    def claim_miss_scan(self, first_name: str, last_name: str) -> bool:
+        """
+        True the first time a name the index doesn't know is looked up since the last refresh
+        Repeated lookups of the same unknown name (typos, retries) don't scan the table again
+        """
+        # The values the scan filters on
+        name = (first_name.title(), last_name.title())
+        with self._misses_lock:
+            if name in self._scanned_misses or len(self._scanned_misses) >= _MAX_SCANNED_MISSES:
+                return False
+            self._scanned_misses.add(name)
+        return True
+
+    def _refresh_in_background(self, dynamodb) -> None:
+        with self._load_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self.refresh, args=(dynamodb,), daemon=True, name="name-index-refresh").start()
+
+    def refresh(self, dynamodb) -> None:
+        try:
+            start_time = time.perf_counter()
+            customers = scan_customer_names(dynamodb.Table(CUSTOMER_TABLE))
+            added, removed = self.sync(customers, {name: key for name, key in customers.items() if key})
+            with self._misses_lock:
+                self._scanned_misses.clear()
+            logger.info("Name index synced in %.2fs: %s customers, %s added, %s removed",
+                        time.perf_counter() - start_time, len(self), added, removed)
+        except Exception as e:
+            logger.error("Error loading customer name index: %s", e)
+        finally:
+            self._refreshing = False
+
+
+# Process-wide index shared by the app and the API
+customer_index = CustomerNameIndex()
+
+
+def _benchmark(customers: int = 20000, lookups: int = 2000):
+    import random
+    random.seed(7)
+    first_names = ["James", "Mary", "John", "Patricia", "Robert", "Jennifer", "Michael", "Linda", "William",
+                   "Elizabeth", "David", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah",
+                   "Charles", "Karen", "Mary Ann", "Jean-Luc", "Zoë", "Siobhan", "Aoife", "Nguyen", "Priya"]
+    last_names = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez",
+                  "Martinez", "Hernandez", "Lopez", "O'Neil", "McDonald", "Smith-Jones", "van der Berg",
+                  "Kowalski", "Nakamura", "Okafor", "Schmidt", "Müller", "Fitzgerald", "Thompson", "White"]
+    def made_up_surname():
+        return "".join(random.choice("bcdfghklmnprstvwz") + random.choice("aeiou") + random.choice(["", "n", "r", "l", "s"])
+                       for _ in range(random.randint(2, 3))).title()
+
+    index = NameIndex()
+    names = {(random.choice(first_names), random.choice(last_names) if i < 500 else made_up_surname())
+             for i in range(customers)}
+    start = time.perf_counter()
+    index.sync(names)
+    print(f"indexed {len(index)} names in {time.perf_counter() - start:.2f}s")
+
+    def typo(name):
+        chars = list(name)
+        position = random.randrange(len(chars))
+        chars[position] = random.choice("abcdefghijklmnopqrstuvwxyz")
+        return "".join(chars)
+
+    targets = random.sample(sorted(names), lookups)
+    queries = [typo(f"{first} {last}") for first, last in targets]
+    start = time.perf_counter()
+    results = [index.resolve(q) for q in queries]
+    elapsed = time.perf_counter() - start
+    resolved = sum(1 for match, _ in results if match)
+    found = sum(1 for (match, suggestions), target in zip(results, targets)
+                if any((c["first_name"], c["last_name"]) == target for c in ([match] if match else suggestions)))
+    print(f"{lookups} one-typo lookups: {elapsed / lookups * 1e6:.0f} us each, {resolved} resolved outright, "
+          f"intended customer offered for {found}")
+    print("'jon smyth' ->", index.resolve("jon smyth"))
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        _benchmark()
+    else:
+        print("usage: python name_index.py bench")
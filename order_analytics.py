@@ -0,0 +1,384 @@
+"""Order analytics for spend and history questions.
+
+A customer's orders are loaded into columnar NumPy arrays and every aggregate (totals,
+per-product counts, date range, monthly spend) comes out of one vectorized pass.
+Summaries are cached per customer. The same code builds a batch report over the whole
+customer table, reading orders where ORDER_READ_MODE says they live:
+
+    python order_analytics.py report --output order_report.csv
+"""
+import csv
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from dynamo_utils import get_customer_orders, resolve_customer_name
+from name_index import CUSTOMER_TABLE
+from order_store import customer_orders, ORDERS_TABLE, ORDER_READ_MODE, ORDER_PARTITION_KEY, READ_NESTED, READ_ORDERS
+
+logger = logging.getLogger(__name__)
+
+# Seconds a customer's summary is reused before the orders are read again
+ORDER_ANALYTICS_TTL = float(os.getenv('ORDER_ANALYTICS_TTL', '300'))
+# Customers whose summaries are kept in memory
+ORDER_ANALYTICS_CACHE_SIZE = int(os.getenv('ORDER_ANALYTICS_CACHE_SIZE', '1024'))
+
+INTENT_SPEND = "spend"
+INTENT_TOP_PRODUCTS = "top_products"
+INTENT_HISTORY = "history"
+INTENT_MONTHLY = "monthly"
+
+# Intent patterns; the name group may be "I"/"me"/"my", meaning the customer looked up last
+_NAME = r"([^?.!,]+?)"
+_INTENT_PATTERNS = [
+    (INTENT_MONTHLY, re.compile(rf"\bmonthly (?:spend|spending|totals?) (?:for|of) {_NAME}\s*[?.!]*$|\b(?:how much )?(?:did|has|have) {_NAME} spen[dt] (?:each|per|by) month\b", re.I)),
+    (INTENT_SPEND, re.compile(rf"\bhow much (?:has|have|did) {_NAME} (?:spent|spend)\b|\btotal (?:spend|spending|spent) (?:for|of|by) {_NAME}\s*[?.!]*$", re.I)),
+    (INTENT_TOP_PRODUCTS, re.compile(rf"\bwhat (?:has|have|did|do|does) {_NAME} (?:order|ordered|buy|bought)(?: the)? most\b|\b(?:top|most ordered) products? (?:for|of|by) {_NAME}\s*[?.!]*$", re.I)),
+    (INTENT_HISTORY, re.compile(rf"\border history (?:for|of) {_NAME}\s*[?.!]*$|\bwhen (?:was|did) {_NAME}(?:'s)? (?:first|last) order\b", re.I)),
+]
+_SELF_REFERENCES = {"i", "me", "my", "we", "us", "our"}
+
+_DATE_FORMATS = ('%Y-%m-%d', '%B %d, %Y')
+
+
+def _parse_date(value: Any) -> np.datetime64:
+    for date_format in _DATE_FORMATS:
+        try:
+            return np.datetime64(datetime.strptime(str(value), date_format).date(), 'D')
+        except ValueError:
+            continue
+    return np.datetime64('NaT', 'D')
+
+
+def _parse_dates(values: List[str]) -> np.ndarray:
+    """Dates as datetime64[D]; ISO dates (as stored) convert in one call, anything else row by row"""
+    try:
+        return np.array(values, dtype='datetime64[D]')
+    except ValueError:
+        return np.array([_parse_date(v) for v in values], dtype='datetime64[D]')
+
+
+class OrderColumns:
+    """Orders of one or more customers as parallel arrays"""
+
+    def __init__(self, products: np.ndarray, quantities: np.ndarray, totals: np.ndarray,
+                 dates: np.ndarray, customers: Optional[np.ndarray] = None):
+        self.products = products
+        self.quantities = quantities
+        self.totals = totals
+        self.dates = dates
+        self.customers = customers if customers is not None else np.zeros(len(products), dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self.products)
+
+    @classmethod
+    def from_orders(cls, orders: Iterable[Dict[str, Any]]) -> "OrderColumns":
+        return cls.from_customers([orders])
+
+    @classmethod
+    def from_customers(cls, orders_by_customer: Iterable[Iterable[Dict[str, Any]]]) -> "OrderColumns":
+        """One row per order; `customers` holds the position of each order's customer"""
+        products, quantities, totals, dates, customers = [], [], [], [], []
+        for position, orders in enumerate(orders_by_customer):
+            for order in orders or []:
+                products.append(str(order.get('product', '')))
+                quantities.append(order.get('quantity', 0) or 0)
+                totals.append(order.get('total_price', 0) or 0)
+                dates.append(str(order.get('order_date', '')))
+                customers.append(position)
+        return cls(
+            np.array(products, dtype=object),
+            np.array(quantities, dtype=np.int64),
+            np.array(totals, dtype=np.float64),
+            _parse_dates(dates),
+            np.array(customers, dtype=np.int32),
+        )
+
+
+def summarize(columns: OrderColumns) -> Dict[str, Any]:
+    """Totals, per-product counts, date range and monthly spend for one customer's orders"""
+    if not len(columns):
+        return {"order_count": 0, "total_spent": 0.0, "total_quantity": 0, "average_order": 0.0,
+                "first_order": None, "last_order": None, "products": [], "monthly_spend": {}}
+
+    product_names, product_codes = np.unique(columns.products, return_inverse=True)
+    product_orders = np.bincount(product_codes)
+    product_quantity = np.bincount(product_codes, weights=columns.quantities)
+    product_spend = np.bincount(product_codes, weights=columns.totals)
+    # Most units first, then most spent
+    ranking = np.lexsort((-product_spend, -product_quantity))
+
+    dated = ~np.isnat(columns.dates)
+    months, month_codes = np.unique(columns.dates[dated].astype('datetime64[M]'), return_inverse=True)
+    month_spend = np.bincount(month_codes, weights=columns.totals[dated], minlength=len(months))
+
+    total_spent = float(columns.totals.sum())
+    return {
+        "order_count": len(columns),
+        "total_spent": round(total_spent, 2),
+        "total_quantity": int(columns.quantities.sum()),
+        "average_order": round(total_spent / len(columns), 2),
+        "first_order": str(columns.dates[dated].min()) if dated.any() else None,
+        "last_order": str(columns.dates[dated].max()) if dated.any() else None,
+        "products": [
+            {"product": str(product_names[i]), "orders": int(product_orders[i]),
+             "quantity": int(product_quantity[i]), "spent": round(float(product_spend[i]), 2)}
+            for i in ranking
+        ],
+        "monthly_spend": {str(month): round(float(spend), 2) for month, spend in zip(months, month_spend)},
+    }
+
+
+class SummaryCache:
+    """LRU of per-customer summaries with a time-to-live"""
+
+    def __init__(self, size: int = ORDER_ANALYTICS_CACHE_SIZE, ttl: float = ORDER_ANALYTICS_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+    def get(self, key: Tuple[str, str]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry[0] > self.ttl:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: Tuple[str, str], summary: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = (time.time(), summary)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: Tuple[str, str]) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+_summaries = SummaryCache()
+
+
+def get_customer_summary(dynamodb, first_name: str, last_name: str) -> Optional[Dict[str, Any]]:
+    """Order summary for a customer (cached), or None if the customer isn't found"""
+    key = (first_name, last_name)
+    summary = _summaries.get(key)
+    if summary is not None:
+        return summary
+    orders = get_customer_orders(dynamodb, first_name, last_name)
+    if orders is None:
+        return None
+    summary = summarize(OrderColumns.from_orders(orders))
+    _summaries.put(key, summary)
+    return summary
+
+
+def invalidate_customer_summary(first_name: str, last_name: str) -> None:
+    _summaries.invalidate((first_name, last_name))
+
+
+def is_self_reference(typed_name: str) -> bool:
+    """True for "I"/"me"-style names, which are answered for the current customer"""
+    return typed_name.lower() in _SELF_REFERENCES
+
+
+def detect_analytics_intent(prompt: str) -> Optional[Tuple[str, str]]:
+    """(intent, typed customer name) for spend/history questions, or None"""
+    for intent, pattern in _INTENT_PATTERNS:
+        match = pattern.search(prompt or "")
+        if match:
+            name = next(group for group in match.groups() if group)
+            return intent, name.strip()
+    return None
+
+
+def _month_label(month: str) -> str:
+    return datetime.strptime(month, '%Y-%m').strftime('%B %Y')
+
+
+def _day_label(day: Optional[str]) -> str:
+    return datetime.strptime(day, '%Y-%m-%d').strftime('%B %d, %Y') if day else "unknown date"
+
+
+def format_summary(intent: str, customer_name: str, summary: Dict[str, Any]) -> str:
+    """Markdown answer for an analytics intent"""
+    if not summary["order_count"]:
+        return f"{customer_name} hasn't placed any orders yet."
+
+    if intent == INTENT_SPEND:
+        return (f"{customer_name} has spent **${summary['total_spent']:,.2f}** across "
+                f"{summary['order_count']} orders (average ${summary['average_order']:,.2f} per order).")
+    if intent == INTENT_TOP_PRODUCTS:
+        lines = [f"Most ordered products for {customer_name}:"]
+        for item in summary["products"][:5]:
+            lines.append(f"- **{item['product']}**: {item['quantity']} units over {item['orders']} orders "
+                         f"(${item['spent']:,.2f})")
+        return "\n".join(lines)
+    if intent == INTENT_MONTHLY:
+        lines = [f"Monthly spend for {customer_name}:"]
+        for month, spend in summary["monthly_spend"].items():
+            lines.append(f"- {_month_label(month)}: ${spend:,.2f}")
+        return "\n".join(lines)
+    return (f"{customer_name} has placed {summary['order_count']} orders ({summary['total_quantity']} items) "
+            f"between {_day_label(summary['first_order'])} and {_day_label(summary['last_order'])}, "
+            f"${summary['total_spent']:,.2f} in total.")
+
+
+def answer_analytics_question(dynamodb, prompt: str,
+                              current_customer: Optional[Tuple[str, str]] = None) -> Optional[Dict[str, Any]]:
+    """Answer a spend/history question from order data.
+
+    Returns None if the prompt isn't an analytics question (or names no customer that
+    resembles one on file), otherwise a dict with the
+    markdown "content" and the resolved "customer" (first_name, last_name) or None.
+    `current_customer` answers questions asked as "I"/"me".
+    """
+    detected = detect_analytics_intent(prompt)
+    if not detected:
+        return None
+    intent, typed_name = detected
+
+    if is_self_reference(typed_name):
+        if not current_customer:
+            return {"content": "Which customer should I look at? Try \"how much has Jane Doe spent?\"",
+                    "customer": None}
+        customer = current_customer
+    else:
+        match, suggestions = resolve_customer_name(dynamodb, typed_name)
+        if not match:
+            if not suggestions:
+                # "What do customers buy most?" is a general question, not a customer lookup
+                logger.info("No customer resembles %r; leaving the question to chat", typed_name)
+                return None
+            options = " or ".join(f"**{c['first_name']} {c['last_name']}**" for c in suggestions)
+            return {"content": f"I couldn't find a customer named {typed_name}. Did you mean {options}?",
+                    "customer": None}
+        customer = (match['first_name'], match['last_name'])
+
+    summary = get_customer_summary(dynamodb, *customer)
+    if summary is None:
+        return {"content": f"I couldn't find any orders for {' '.join(customer)}.", "customer": None}
+    return {"content": format_summary(intent, " ".join(customer), summary), "customer": customer}
+
+
+def build_report(customers: List[Dict[str, Any]], orders_by_customer: Optional[List[List[Dict[str, Any]]]] = None
+                 ) -> List[Dict[str, Any]]:
+    """Per-customer totals for many customers in one vectorized pass over all orders
+
+    `orders_by_customer` holds each customer's orders (see read_orders); by default the
+    nested `orders` list of each item.
+    """
+    if orders_by_customer is None:
+        orders_by_customer = [c.get('orders') for c in customers]
+    columns = OrderColumns.from_customers(orders_by_customer)
+    count = len(customers)
+    order_counts = np.bincount(columns.customers, minlength=count)
+    spent = np.bincount(columns.customers, weights=columns.totals, minlength=count)
+    quantity = np.bincount(columns.customers, weights=columns.quantities, minlength=count)
+
+    # First/last order dates: sort by (customer, date) once and take each customer's ends
+    dated = ~np.isnat(columns.dates)
+    order = np.lexsort((columns.dates[dated], columns.customers[dated]))
+    dated_customers = columns.customers[dated][order]
+    dated_dates = columns.dates[dated][order]
+    first = np.full(count, np.datetime64('NaT'), dtype='datetime64[D]')
+    last = np.full(count, np.datetime64('NaT'), dtype='datetime64[D]')
+    if len(dated_customers):
+        starts = np.flatnonzero(np.r_[True, dated_customers[1:] != dated_customers[:-1]])
+        ends = np.r_[starts[1:], len(dated_customers)] - 1
+        first[dated_customers[starts]] = dated_dates[starts]
+        last[dated_customers[ends]] = dated_dates[ends]
+
+    # Each customer's top product by units: sort (customer, product) pairs by units
+    top_products = [""] * count
+    if len(columns):
+        product_names, product_codes = np.unique(columns.products, return_inverse=True)
+        pair = columns.customers.astype(np.int64) * len(product_names) + product_codes
+        pairs, pair_codes = np.unique(pair, return_inverse=True)
+        pair_units = np.bincount(pair_codes, weights=columns.quantities)
+        pair_customers = pairs // len(product_names)
+        best = np.lexsort((-pair_units, pair_customers))
+        best_starts = best[np.r_[True, pair_customers[best][1:] != pair_customers[best][:-1]]]
+        for index in best_starts:
+            top_products[pair_customers[index]] = str(product_names[pairs[index] % len(product_names)])
+
+    report = []
+    for i, customer in enumerate(customers):
+        report.append({
+            "first_name": customer.get('first_name', ''),
+            "last_name": customer.get('last_name', ''),
+            "order_count": int(order_counts[i]),
+            "total_spent": round(float(spent[i]), 2),
+            "total_quantity": int(quantity[i]),
+            "average_order": round(float(spent[i] / order_counts[i]), 2) if order_counts[i] else 0.0,
+            "first_order": str(first[i]) if not np.isnat(first[i]) else "",
+            "last_order": str(last[i]) if not np.isnat(last[i]) else "",
+            "top_product": top_products[i],
+        })
+    return report
+
+
+def scan_customers(dynamodb, mode: str = ORDER_READ_MODE) -> List[Dict[str, Any]]:
+    """Every customer item; the nested orders are only read when `mode` may use them"""
+    table = dynamodb.Table(CUSTOMER_TABLE)
+    request = {}
+    if mode == READ_ORDERS:
+        request['ProjectionExpression'] = '#pk, first_name, last_name'
+        request['ExpressionAttributeNames'] = {'#pk': ORDER_PARTITION_KEY}
+    customers = []
+    while True:
+        response = table.scan(**request)
+        customers.extend(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return customers
+        request['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def read_orders(dynamodb, customers: List[Dict[str, Any]], mode: str = ORDER_READ_MODE,
+                workers: int = 8) -> List[List[Dict[str, Any]]]:
+    """Each customer's orders as ORDER_READ_MODE reads them, one orders-table Query per customer"""
+    orders_table = dynamodb.Table(ORDERS_TABLE)
+    if mode == READ_NESTED:
+        return [customer_orders(orders_table, c, mode) for c in customers]
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="report") as pool:
+        return list(pool.map(lambda c: customer_orders(orders_table, c, mode), customers))
+
+
+def write_report(report: List[Dict[str, Any]], path: str) -> None:
+    fields = ["first_name", "last_name", "order_count", "total_spent", "total_quantity",
+              "average_order", "first_order", "last_order", "top_product"]
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(report)
+
+
+if __name__ == "__main__":
+    import argparse
+    from dynamo_utils import init_dynamodb
+
+    parser = argparse.ArgumentParser(description="Order analytics")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    report_parser = subparsers.add_parser("report", help="Per-customer order report for the whole table")
+    report_parser.add_argument("--output", default="order_report.csv")
+    report_parser.add_argument("--workers", type=int, default=8, help="parallel orders-table reads")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    dynamodb = init_dynamodb()
+    customers = scan_customers(dynamodb)
+    orders = read_orders(dynamodb, customers, workers=args.workers)
+    start_time = time.perf_counter()
+    rows = build_report(customers, orders)
+    logger.info("Summarized %s customers in %.3fs", len(rows), time.perf_counter() - start_time)
+    write_report(rows, args.output)
+    logger.info("Wrote %s", args.output)
@@ -0,0 +1,344 @@
+"""One item per order, keyed by customer and order date.
+
+`Rivertownball-cus` keeps each customer's orders as a nested list, so showing a single
+order reads the whole customer item (DynamoDB caps items at 400 KB) and adding one
+rewrites it. The orders table stores every order as its own item:
+
+    customer_id (partition key) | order_key = "<order_date>#<order_id>" (sort key) | order fields
+
+The partition key is the customer table's own key attribute (the first of
+CUSTOMER_KEY_ATTRIBUTES, `customer_id` by default) under the same name.
+
+A customer's orders then come back in date order from one Query, a date range or the
+latest N is a key condition plus Limit, and a new order is one small PutItem.
+
+Cutover, with the app running throughout:
+
+1. Create the orders table (see README) and set `ORDER_READ_MODE=dual`: reads merge the
+   orders table with the nested list by order ID, so customers not migrated yet and
+   orders appended to nested lists after their customer was migrated both show up.
+2. `python order_store.py migrate --segments 8` copies every nested order with a
+   parallel scan and batched writes. It is idempotent and resumable (`--checkpoint`);
+   run it again to pick up orders appended to nested lists in the meantime.
+3. `python order_store.py verify` compares both layouts customer by customer.
+4. Set `ORDER_READ_MODE=orders`.
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional
+
+from local_dynamodb import json_default
+from name_index import CUSTOMER_TABLE, CUSTOMER_KEY_ATTRIBUTES
+
+logger = logging.getLogger(__name__)
+
+# Table holding one item per order
+ORDERS_TABLE = os.getenv('ORDERS_TABLE', 'Rivertownball-orders')
+# Where get_customer_orders() reads orders: "nested" (customer item), "dual" (both, merged by order ID) or "orders"
+ORDER_READ_MODE = os.getenv('ORDER_READ_MODE', 'nested')
+
+READ_NESTED = "nested"
+READ_DUAL = "dual"
+READ_ORDERS = "orders"
+
+# Orders are partitioned by the customer table's key attribute, so one setting names both
+ORDER_PARTITION_KEY = CUSTOMER_KEY_ATTRIBUTES[0] if CUSTOMER_KEY_ATTRIBUTES else "customer_id"
+ORDER_SORT_KEY = "order_key"
+
+# Sorts after any order ID, so "<date>#\uffff" closes a date range inclusively
+_RANGE_END = "\uffff"
+
+
+def order_sort_key(order_date: str, order_id: Any) -> str:
+    return f"{order_date}#{order_id}"
+
+
+def order_item(customer_id: Any, order: Dict[str, Any]) -> Dict[str, Any]:
+    """Orders-table item for one nested order"""
+    item = dict(order)
+    item[ORDER_PARTITION_KEY] = customer_id
+    item[ORDER_SORT_KEY] = order_sort_key(order['order_date'], order['order_id'])
+    return item
+
+
+def put_order(table, customer_id: Any, order: Dict[str, Any]) -> Dict[str, Any]:
+    """Write a new order as its own item; returns the item"""
+    item = order_item(customer_id, order)
+    table.put_item(Item=item)
+    return item
+
+
+def query_orders(table, customer_id: Any, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                 limit: Optional[int] = None, newest_first: bool = False) -> List[Dict[str, Any]]:
+    """A customer's orders, optionally between two YYYY-MM-DD dates (inclusive), oldest first by default"""
+    request = {
+        'KeyConditionExpression': '#pk = :pk',
+        'ExpressionAttributeNames': {'#pk': ORDER_PARTITION_KEY},
+        'ExpressionAttributeValues': {':pk': customer_id},
+        'ScanIndexForward': not newest_first,
+    }
+    if start_date or end_date:
+        request['ExpressionAttributeNames']['#sk'] = ORDER_SORT_KEY
+        if start_date and end_date:
+            request['KeyConditionExpression'] += ' and #sk between :start and :end'
+        else:
+            request['KeyConditionExpression'] += ' and #sk >= :start' if start_date else ' and #sk <= :end'
+        if start_date:
+            request['ExpressionAttributeValues'][':start'] = start_date
+        if end_date:
+            request['ExpressionAttributeValues'][':end'] = f"{end_date}#{_RANGE_END}"
+
+    orders: List[Dict[str, Any]] = []
+    while True:
+        if limit:
+            request['Limit'] = limit - len(orders)
+        response = table.query(**request)
+        orders.extend(response.get('Items', []))
+        if (limit and len(orders) >= limit) or 'LastEvaluatedKey' not in response:
+            return orders
+        request['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def latest_orders(table, customer_id: Any, count: int = 1) -> List[Dict[str, Any]]:
+    """The customer's most recent orders, newest first, reading only those items"""
+    return query_orders(table, customer_id, limit=count, newest_first=True)
+
+
+def merge_orders(nested: List[Dict[str, Any]], stored: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Nested and orders-table orders of one customer, each order ID once, oldest first"""
+    merged = {str(order.get('order_id')): order for order in nested if order.get('order_id')}
+    merged.update((str(order.get('order_id')), order) for order in stored)
+    orders = list(merged.values()) + [order for order in nested if not order.get('order_id')]
+    return sorted(orders, key=lambda order: str(order.get('order_date', '')))
+
+
+def customer_orders(orders_table, customer: Dict[str, Any], mode: str = ORDER_READ_MODE) -> List[Dict[str, Any]]:
+    """Raw orders of a customer item as ORDER_READ_MODE reads them (the nested list, the orders table or both)"""
+    customer_id = customer.get(ORDER_PARTITION_KEY)
+    if mode == READ_NESTED or customer_id is None:
+        return customer.get('orders') or []
+    items = query_orders(orders_table, customer_id)
+    if mode == READ_DUAL:
+        return merge_orders(customer.get('orders') or [], items)
+    return items
+
+
+def _scan_segment(table, segment: int, total_segments: int, start_key: Optional[Dict[str, Any]],
+                  page_size: Optional[int]) -> Iterator[tuple]:
+    """(customers, LastEvaluatedKey) for each page of one parallel scan segment"""
+    request = {
+        'ProjectionExpression': '#pk, orders',
+        'ExpressionAttributeNames': {'#pk': ORDER_PARTITION_KEY},
+        'Segment': segment,
+        'TotalSegments': total_segments,
+    }
+    if page_size:
+        request['Limit'] = page_size
+    if start_key:
+        request['ExclusiveStartKey'] = start_key
+    while True:
+        response = table.scan(**request)
+        yield response.get('Items', []), response.get('LastEvaluatedKey')
+        if 'LastEvaluatedKey' not in response:
+            return
+        request['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+class _Checkpoint:
+    """Per-segment scan position, saved after every page so an interrupted migration resumes
+
+    A read-only checkpoint (dry runs) resumes from the file but never writes it, so a dry
+    run can't mark segments done that a real migration hasn't copied.
+    """
+
+    def __init__(self, path: Optional[str], total_segments: int, read_only: bool = False):
+        self.path = path
+        self.read_only = read_only
+        self._lock = threading.Lock()
+        self.positions: Dict[str, Any] = {}
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            if saved.get('total_segments') == total_segments:
+                self.positions = saved['positions']
+            else:
+                logger.warning("Ignoring checkpoint %s written for %s segments", path, saved.get('total_segments'))
+        self.total_segments = total_segments
+
+    def start_key(self, segment: int) -> Optional[Dict[str, Any]]:
+        return self.positions.get(str(segment))
+
+    def done(self, segment: int) -> bool:
+        return self.positions.get(str(segment), {}) is None
+
+    def save(self, segment: int, last_key: Optional[Dict[str, Any]]) -> None:
+        if not self.path or self.read_only:
+            return
+        with self._lock:
+            self.positions[str(segment)] = last_key
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'total_segments': self.total_segments, 'positions': self.positions}, f, default=json_default)
+            os.replace(tmp_path, self.path)
+
+
+def migrate(dynamodb, segments: int = 8, checkpoint_path: Optional[str] = None, page_size: Optional[int] = None,
+            max_writes_per_second: float = 0, dry_run: bool = False) -> Dict[str, Any]:
+    """Copy every nested order into the orders table with a parallel scan and batched writes"""
+    customers_table = dynamodb.Table(CUSTOMER_TABLE)
+    orders_table = dynamodb.Table(ORDERS_TABLE)
+    checkpoint = _Checkpoint(checkpoint_path, segments, read_only=dry_run)
+    # Each segment paces itself to its share of the write rate
+    segment_rate = max_writes_per_second / segments if max_writes_per_second else 0
+
+    def run(segment: int) -> Dict[str, int]:
+        totals = {"customers": 0, "orders": 0, "skipped": 0}
+        if checkpoint.done(segment):
+            return totals
+        started, written = time.perf_counter(), 0
+        for customers, last_key in _scan_segment(customers_table, segment, segments,
+                                                 checkpoint.start_key(segment), page_size):
+            # One writer per page: leaving it flushes the page's writes before the checkpoint moves past them
+            with orders_table.batch_writer(overwrite_by_pkeys=[ORDER_PARTITION_KEY, ORDER_SORT_KEY]) as batch:
+                for customer in customers:
+                    totals["customers"] += 1
+                    for order in customer.get('orders') or []:
+                        if not order.get('order_date') or not order.get('order_id'):
+                            totals["skipped"] += 1
+                            continue
+                        if not dry_run:
+                            batch.put_item(Item=order_item(customer[ORDER_PARTITION_KEY], order))
+                        totals["orders"] += 1
+                        written += 1
+                        if segment_rate and written > segment_rate * (time.perf_counter() - started):
+                            time.sleep(written / segment_rate - (time.perf_counter() - started))
+            checkpoint.save(segment, last_key)
+        logger.info("Segment %s: %s customers, %s orders", segment, totals["customers"], totals["orders"])
+        return totals
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=segments, thread_name_prefix="migrate") as pool:
+        results = list(pool.map(run, range(segments)))
+    report = {key: sum(r[key] for r in results) for key in ("customers", "orders", "skipped")}
+    report["seconds"] = round(time.perf_counter() - start, 2)
+    report["dry_run"] = dry_run
+    return report
+
+
+def verify(dynamodb, segments: int = 8, max_mismatches: int = 20) -> Dict[str, Any]:
+    """Compare each customer's nested order IDs with the orders table"""
+    customers_table = dynamodb.Table(CUSTOMER_TABLE)
+    orders_table = dynamodb.Table(ORDERS_TABLE)
+    lock = threading.Lock()
+    report: Dict[str, Any] = {"customers": 0, "matched": 0, "mismatched": 0, "examples": []}
+
+    def run(segment: int) -> None:
+        for customers, _ in _scan_segment(customers_table, segment, segments, None, None):
+            for customer in customers:
+                customer_id = customer[ORDER_PARTITION_KEY]
+                nested = {str(o.get('order_id')) for o in customer.get('orders') or []}
+                stored = {str(o.get('order_id')) for o in query_orders(orders_table, customer_id)}
+                with lock:
+                    report["customers"] += 1
+                    if nested <= stored:
+                        report["matched"] += 1
+                        continue
+                    report["mismatched"] += 1
+                    if len(report["examples"]) < max_mismatches:
+                        report["examples"].append({"customer_id": customer_id, "missing": sorted(nested - stored)[:5]})
+
+    with ThreadPoolExecutor(max_workers=segments, thread_name_prefix="verify") as pool:
+        list(pool.map(run, range(segments)))
+    return report
+
+
+def _benchmark(customers: int = 20000, lookups: int = 300, heavy_orders: int = 2000, seed: int = 42) -> None:
+    """Read capacity and latency of nested vs one-item-per-order reads on the in-process stand-in"""
+    import random
+    from local_dynamodb import LocalDynamoDB, item_size
+    from synthetic_data import generate_customers, load_into_table
+
+    dynamodb = LocalDynamoDB()
+    customers_table, orders_table = dynamodb.Table(CUSTOMER_TABLE), dynamodb.Table(ORDERS_TABLE)
+    groups: Dict[str, List[str]] = {"1-9 orders": [], "30+ orders": [], f"{heavy_orders} orders": []}
+
+    def sorted_by_size(items):
+        for customer in items:
+            count = len(customer['orders'])
+            if 1 <= count < 10:
+                groups["1-9 orders"].append(customer[ORDER_PARTITION_KEY])
+            elif count >= 30:
+                groups["30+ orders"].append(customer[ORDER_PARTITION_KEY])
+            yield customer
+
+    load_into_table(customers_table, sorted_by_size(generate_customers(customers, seed)))
+    # One long-standing wholesale account, a few hundred KB as a nested item
+    heavy = next(generate_customers(1, seed, start=customers))
+    template = heavy['orders'][0] if heavy['orders'] else next(
+        c for c in generate_customers(10, seed) if c['orders'])['orders'][0]
+    heavy['orders'] = [dict(template, order_id=f"ORD-HEAVY-{n:05d}", order_date=f"{2015 + n * 10 // heavy_orders}-01-01")
+                       for n in range(heavy_orders)]
+    customers_table.put_item(Item=heavy)
+    groups[f"{heavy_orders} orders"].append(heavy[ORDER_PARTITION_KEY])
+    print(f"heavy customer item: {item_size(heavy) / 1024:.0f} KB")
+
+    print(f"migrate: {migrate(dynamodb, segments=8)}")
+    print(f"verify: {verify(dynamodb)['mismatched']} mismatched customers")
+
+    rng = random.Random(seed)
+    reads = {
+        "nested item (any read)": (customers_table, lambda c: customers_table.get_item(Key={ORDER_PARTITION_KEY: c})),
+        "orders table, all orders": (orders_table, lambda c: query_orders(orders_table, c)),
+        "orders table, latest order": (orders_table, lambda c: latest_orders(orders_table, c)),
+    }
+    for group, ids in groups.items():
+        sample = [rng.choice(ids) for _ in range(lookups)]
+        print(f"{group} ({len(ids)} customers):")
+        for label, (table, read) in reads.items():
+            before = table.capacity()['read_units']
+            start = time.perf_counter()
+            for customer_id in sample:
+                read(customer_id)
+            elapsed = (time.perf_counter() - start) / lookups
+            print(f"  {label:<27} {(table.capacity()['read_units'] - before) / lookups:>6.2f} RCU, "
+                  f"{elapsed * 1e6:>7.0f} us per read")
+
+    # Adding an order: rewrite the nested item vs put one order item
+    new_order = dict(template, order_id="ORD-NEW", order_date="2025-06-01")
+    before = customers_table.capacity()['write_units']
+    heavy['orders'].append(new_order)
+    customers_table.put_item(Item=heavy)
+    nested_wcu = customers_table.capacity()['write_units'] - before
+    before = orders_table.capacity()['write_units']
+    put_order(orders_table, heavy[ORDER_PARTITION_KEY], new_order)
+    print(f"new order for the {heavy_orders}-order customer: nested rewrite {nested_wcu:.0f} WCU, "
+          f"order item {orders_table.capacity()['write_units'] - before:.0f} WCU")
+
+
+if __name__ == "__main__":
+    from log_utils import configure_logging
+    configure_logging(fmt="text")
+    parser = argparse.ArgumentParser(description="Orders table migration")
+    parser.add_argument("command", choices=["migrate", "verify", "bench"])
+    parser.add_argument("--segments", type=int, default=8, help="parallel scan segments (and threads)")
+    parser.add_argument("--checkpoint", help="file recording scan progress, to resume an interrupted migration")
+    parser.add_argument("--page-size", type=int, help="customers per scan page")
+    parser.add_argument("--max-writes-per-second", type=float, default=0, help="write rate cap across segments")
+    parser.add_argument("--dry-run", action="store_true", help="scan and count without writing")
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        _benchmark()
+    else:
+        from dynamo_utils import init_dynamodb
+        db = init_dynamodb()
+        if args.command == "migrate":
+            result = migrate(db, args.segments, args.checkpoint, args.page_size, args.max_writes_per_second, args.dry_run)
+        else:
+            result = verify(db, args.segments)
+        print(json.dumps(result, indent=2, default=json_default))
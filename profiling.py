@@ -0,0 +1,255 @@
+"""On-demand sampling profiler for chat turns.
+
+A turn is profiled when it falls in the `PROFILE_SAMPLE_RATE` fraction of requests or
+its session is listed in `PROFILE_SESSIONS` (or was marked with `profile_session()`).
+A background thread then samples the turn's threads every `PROFILE_INTERVAL_MS`
+(wall clock, so time blocked on AWS calls shows up too) and, when the turn ends,
+writes to `PROFILE_DIR`:
+
+- `<time>-<label>-<request id>.collapsed`: collapsed stacks for flamegraph.pl,
+  inferno or speedscope
+- `<time>-<label>-<request id>.txt`: the top functions by self and total samples
+
+When profiling is off the hook is a context variable read and a set lookup per turn.
+"""
+import contextvars
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from log_utils import current_request_id
+
+logger = logging.getLogger(__name__)
+
+# Fraction of turns to profile
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+# Sessions whose every turn is profiled (comma-separated session IDs)
+PROFILE_SESSIONS = {s.strip() for s in os.getenv('PROFILE_SESSIONS', '').split(',') if s.strip()}
+# Milliseconds between stack samples
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '2'))
+# Where profiles are written
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+# Functions listed in each summary
+PROFILE_TOP_N = int(os.getenv('PROFILE_TOP_N', '25'))
+
+# Profiler of the turn running in this context, if any
+_active: contextvars.ContextVar[Optional["SamplingProfiler"]] = contextvars.ContextVar('active_profiler', default=None)
+# Set inside the outermost profile_turn() block, whether or not it was selected, so nested hooks don't re-roll
+_decided: contextvars.ContextVar[bool] = contextvars.ContextVar('profile_decided', default=False)
+
+# Profiles running and the interpreter switch interval to restore when the last one ends
+_running = 0
+_saved_switch_interval = None
+_running_lock = threading.Lock()
+
+# Sessions marked at runtime: session -> turns left to profile
+_marked_sessions: Dict[str, int] = {}
+_marked_lock = threading.Lock()
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Samples the stacks of a set of threads from a background thread"""
+
+    def __init__(self, interval: float = PROFILE_INTERVAL_MS / 1000):
+        self.interval = interval
+        self._threads: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started = 0.0
+        self.elapsed = 0.0
+
+    def add_thread(self, ident: int, name: str) -> None:
+        with self._lock:
+            self._threads[ident] = name
+
+    def remove_thread(self, ident: int) -> None:
+        with self._lock:
+            self._threads.pop(ident, None)
+
+    def start(self) -> None:
+        global _running, _saved_switch_interval
+        with _running_lock:
+            # CPU-bound code only releases the GIL every switch interval (5 ms), which would starve the sampler
+            if _running == 0 and sys.getswitchinterval() > self.interval / 2:
+                _saved_switch_interval = sys.getswitchinterval()
+                sys.setswitchinterval(self.interval / 2)
+            _running += 1
+        self.started = time.perf_counter()
+        self._sampler = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+        self._sampler.start()
+
+    def stop(self) -> None:
+        global _running, _saved_switch_interval
+        self.elapsed = time.perf_counter() - self.started
+        with self._lock:
+            # Stop sampling before joining, so the profile doesn't end in its own shutdown
+            self._threads.clear()
+        self._stop.set()
+        if self._sampler:
+            self._sampler.join()
+        with _running_lock:
+            _running -= 1
+            if _running == 0 and _saved_switch_interval is not None:
+                sys.setswitchinterval(_saved_switch_interval)
+                _saved_switch_interval = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                threads = dict(self._threads)
+            frames = sys._current_frames()
+            for ident, name in threads.items():
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(name)
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self, label: str, top: int = PROFILE_TOP_N) -> str:
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")[1:]
+            if not frames:
+                continue
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        stack_samples = sum(self.stacks.values()) or 1
+        lines = [f"{label}: {self.elapsed * 1000:.1f} ms wall, {self.samples} sampling rounds "
+                 f"every {self.interval * 1000:.1f} ms, {stack_samples} thread samples", ""]
+        for title, counter in (("Self", own), ("Total", total)):
+            lines.append(f"{title} samples:")
+            for frame, count in counter.most_common(top):
+                lines.append(f"  {count:>6}  {count / stack_samples:>6.1%}  {frame}")
+            lines.append("")
+        return "\n".join(lines)
+
+
+def profile_session(session_id: str, turns: int = 1) -> None:
+    """Profile the next `turns` turns of a session"""
+    with _marked_lock:
+        _marked_sessions[session_id] = turns
+
+
+def _should_profile(session_id: Optional[str]) -> bool:
+    if session_id in PROFILE_SESSIONS:
+        return True
+    if _marked_sessions and session_id in _marked_sessions:
+        with _marked_lock:
+            left = _marked_sessions.get(session_id, 0)
+            if left <= 1:
+                _marked_sessions.pop(session_id, None)
+            else:
+                _marked_sessions[session_id] = left - 1
+        return left > 0
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _write(profiler: SamplingProfiler, label: str) -> Optional[str]:
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{label}-{current_request_id() or 'none'}")
+        with open(base + ".collapsed", "w") as f:
+            f.write(profiler.collapsed())
+        with open(base + ".txt", "w") as f:
+            f.write(profiler.summary(label))
+        return base
+    except OSError as e:
+        logger.error("Error writing profile: %s", e)
+        return None
+
+
+@contextmanager
+def profile_turn(label: str, session_id: Optional[str] = None):
+    """Profile the enclosed block if this turn is selected; nested calls follow the outer decision"""
+    if _decided.get():
+        yield None
+        return
+    decided = _decided.set(True)
+    try:
+        if not _should_profile(session_id):
+            yield None
+            return
+
+        profiler = SamplingProfiler()
+        profiler.add_thread(threading.get_ident(), threading.current_thread().name)
+        token = _active.set(profiler)
+        profiler.start()
+        try:
+            yield profiler
+        finally:
+            profiler.stop()
+            _active.reset(token)
+            path = _write(profiler, label)
+            logger.info("Profiled %s for session %s: %.1f ms, written to %s",
+                        label, session_id, profiler.elapsed * 1000, path)
+    finally:
+        _decided.reset(decided)
+
+
+@contextmanager
+def profiled_thread():
+    """Include the current worker thread in the active profile, if the caller's turn has one"""
+    profiler = _active.get()
+    if profiler is None:
+        yield
+        return
+    ident = threading.get_ident()
+    profiler.add_thread(ident, threading.current_thread().name)
+    try:
+        yield
+    finally:
+        profiler.remove_thread(ident)
+
+
+def _benchmark(turns: int = 20000) -> None:
+    """Cost of the hook on turns that aren't profiled, and of a profiled turn"""
+    def work():
+        return sum(i * i for i in range(2000))
+
+    start = time.perf_counter()
+    for _ in range(turns):
+        work()
+    bare = (time.perf_counter() - start) / turns
+    start = time.perf_counter()
+    for _ in range(turns):
+        with profile_turn("bench", "session"):
+            work()
+    hooked = (time.perf_counter() - start) / turns
+    print(f"hook off: {(hooked - bare) * 1e6:.2f} us per turn ({bare * 1e6:.0f} us of work)")
+
+    global PROFILE_DIR
+    PROFILE_DIR = os.path.join(os.getenv('TMPDIR', '/tmp'), 'profile-bench')
+    profile_session("session", turns=1)
+    start = time.perf_counter()
+    with profile_turn("bench", "session") as profiler:
+        for _ in range(200):
+            work()
+    print(f"profiled turn: {(time.perf_counter() - start) * 1000:.1f} ms for {bare * 200 * 1000:.1f} ms of work, "
+          f"{profiler.samples} samples, written to {PROFILE_DIR}")
+
+
+if __name__ == "__main__":
+    _benchmark()
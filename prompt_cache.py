@@ -0,0 +1,187 @@
+"""Cacheable prompt prefix for Claude calls.
+
+Every model call starts with the same instructions, so they go in the Messages API
+`system` field as a fixed prefix built once per process. When the model supports
+Bedrock prompt caching, the prefix also carries the knowledge base sections customers
+ask about most (`PROMPT_REFERENCE_SECTIONS`) and ends in a cache checkpoint: Bedrock
+then reads the prefix from its cache, at a tenth of the input-token price and without
+processing it again, for every call within the cache lifetime. Retrieved context and
+the customer query come after the checkpoint and are never cached.
+
+`get_prompt_cache_stats()` compares cached and uncached input tokens, and model
+latency of calls that hit the cache against calls that didn't.
+"""
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from answer_store import KNOWLEDGE_BASE_PATH
+from usage_tracking import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Prompt caching: "auto" on models that support it, "1" always, "0" never
+PROMPT_CACHE = os.getenv('PROMPT_CACHE', 'auto').lower()
+# Bedrock models that accept cache checkpoints (comma-separated; "us."/"eu." inference profile prefixes are ignored)
+PROMPT_CACHE_MODELS = {m.strip() for m in os.getenv(
+    'PROMPT_CACHE_MODELS',
+    'anthropic.claude-3-5-haiku-20241022-v1:0,anthropic.claude-3-7-sonnet-20250219-v1:0,'
+    'anthropic.claude-sonnet-4-20250514-v1:0,anthropic.claude-opus-4-20250514-v1:0'
+).split(',') if m.strip()}
+# Knowledge base sections placed in the cached prefix (comma-separated)
+PROMPT_REFERENCE_SECTIONS = [s.strip() for s in os.getenv('PROMPT_REFERENCE_SECTIONS', 'Products,FAQs').split(',') if s.strip()]
+# Shortest prefix, in tokens, the model will cache; shorter prefixes are sent without a checkpoint
+PROMPT_CACHE_MIN_TOKENS = int(os.getenv('PROMPT_CACHE_MIN_TOKENS', '1024'))
+
+# Input-token price multipliers for cache writes and reads
+CACHE_WRITE_PRICE = 1.25
+CACHE_READ_PRICE = 0.1
+
+_CHECKPOINT = {"type": "ephemeral"}
+
+# (system prompt, model) -> system blocks, built once per process
+_prefixes: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+_prefixes_lock = threading.Lock()
+
+
+def supports_caching(model_id: str) -> bool:
+    if PROMPT_CACHE == '0':
+        return False
+    if PROMPT_CACHE == '1':
+        return True
+    # Cross-region inference profiles prefix the model ID with a geography
+    geography, _, base = model_id.partition('.')
+    return (base if geography in ('us', 'eu', 'apac') else model_id) in PROMPT_CACHE_MODELS
+
+
+def _reference_text(path: str = KNOWLEDGE_BASE_PATH) -> str:
+    """The reference sections as plain text, formatted like convert_to_text.py"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            knowledge_base = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error("Error loading reference sections from %s: %s", path, e)
+        return ""
+    parts = []
+    for section in PROMPT_REFERENCE_SECTIONS:
+        if section not in knowledge_base:
+            logger.warning("Reference section %s not in %s", section, path)
+            continue
+        entries = [entry.replace('**', '').replace('*', '') for entry in knowledge_base[section]]
+        parts.append(f"### {section}\n\n" + "\n\n---\n\n".join(entries))
+    if not parts:
+        return ""
+    return "Reference information about Rivertown Ball Company:\n\n" + "\n\n".join(parts)
+
+
+def _build_prefix(system_prompt: str, model_id: str) -> List[Dict[str, Any]]:
+    blocks = [{"type": "text", "text": system_prompt}]
+    if not supports_caching(model_id):
+        return blocks
+    reference = _reference_text()
+    if reference:
+        blocks.append({"type": "text", "text": reference})
+    tokens = sum(estimate_tokens(block["text"]) for block in blocks)
+    if tokens < PROMPT_CACHE_MIN_TOKENS:
+        logger.warning("Prompt prefix of ~%s tokens is below the %s-token cache minimum, sending it uncached",
+                       tokens, PROMPT_CACHE_MIN_TOKENS)
+        return blocks
+    # The checkpoint on the last block caches everything up to and including it
+    blocks[-1]["cache_control"] = _CHECKPOINT
+    logger.info("Prompt prefix for %s: %s blocks, ~%s tokens, cached", model_id, len(blocks), tokens)
+    return blocks
+
+
+def system_blocks(system_prompt: str, model_id: str) -> List[Dict[str, Any]]:
+    """System field for a request; the same list is returned on every call, so don't modify it"""
+    key = (system_prompt, model_id)
+    prefix = _prefixes.get(key)
+    if prefix is None:
+        with _prefixes_lock:
+            prefix = _prefixes.get(key)
+            if prefix is None:
+                prefix = _prefixes[key] = _build_prefix(system_prompt, model_id)
+    return prefix
+
+
+def user_blocks(prompt: str, context: Optional[str] = None) -> List[Dict[str, Any]]:
+    """User message content: per-turn context, then the query"""
+    if context is None:
+        return [{"type": "text", "text": prompt}]
+    return [
+        {"type": "text", "text": f"Context:\n{context if context else 'No additional context available.'}"},
+        {"type": "text", "text": f"Customer Query:\n{prompt}"},
+    ]
+
+
+class PromptCacheStats:
+    """Process-wide cached vs uncached input tokens and latency"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hits = 0
+        self.writes = 0
+        self.input_tokens = 0
+        self.cache_read_tokens = 0
+        self.cache_write_tokens = 0
+        self.hit_latency = 0.0
+        self.miss_latency = 0.0
+
+    def record(self, usage: Dict[str, Any], latency: float) -> Tuple[int, int]:
+        """Record a call's usage block; returns its (cache read, cache write) tokens"""
+        read = int(usage.get('cache_read_input_tokens') or 0)
+        written = int(usage.get('cache_creation_input_tokens') or 0)
+        with self._lock:
+            self.calls += 1
+            self.input_tokens += int(usage.get('input_tokens') or 0)
+            self.cache_read_tokens += read
+            self.cache_write_tokens += written
+            if written:
+                self.writes += 1
+            if read:
+                self.hits += 1
+                self.hit_latency += latency
+            else:
+                self.miss_latency += latency
+        return read, written
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            prompt_tokens = self.input_tokens + self.cache_read_tokens + self.cache_write_tokens
+            billed = (self.input_tokens + self.cache_write_tokens * CACHE_WRITE_PRICE
+                      + self.cache_read_tokens * CACHE_READ_PRICE)
+            misses = self.calls - self.hits
+            return {
+                "calls": self.calls,
+                "cache_hits": self.hits,
+                "cache_writes": self.writes,
+                "uncached_input_tokens": self.input_tokens,
+                "cache_read_input_tokens": self.cache_read_tokens,
+                "cache_write_input_tokens": self.cache_write_tokens,
+                "cached_fraction": round(self.cache_read_tokens / prompt_tokens, 3) if prompt_tokens else 0.0,
+                # Input-token cost relative to sending every prompt uncached
+                "input_cost_ratio": round(billed / prompt_tokens, 3) if prompt_tokens else 1.0,
+                "mean_latency_ms_hit": round(self.hit_latency / self.hits * 1000, 1) if self.hits else 0.0,
+                "mean_latency_ms_miss": round(self.miss_latency / misses * 1000, 1) if misses else 0.0,
+            }
+
+
+stats = PromptCacheStats()
+
+
+def get_prompt_cache_stats() -> Dict[str, Any]:
+    snapshot = stats.snapshot()
+    with _prefixes_lock:
+        snapshot["prefixes"] = [
+            {
+                "model": model_id,
+                "blocks": len(blocks),
+                "tokens": sum(estimate_tokens(block["text"]) for block in blocks),
+                "cached": "cache_control" in blocks[-1],
+            }
+            for (_, model_id), blocks in _prefixes.items()
+        ]
+    return snapshot
@@ -0,0 +1,307 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Dict, List, Optional
+from botocore.exceptions import ClientError, BotoCoreError
+
+logger = logging.getLogger(__name__)
+
+# Smoothing factor for per-region latency and error averages
+REGION_EWMA_ALPHA = float(os.getenv('REGION_EWMA_ALPHA', '0.2'))
+# Consecutive failures before a region is taken out of rotation
+REGION_FAILURE_THRESHOLD = int(os.getenv('REGION_FAILURE_THRESHOLD', '3'))
+# Seconds an unhealthy region stays out of rotation
+REGION_COOLDOWN_SECONDS = float(os.getenv('REGION_COOLDOWN_SECONDS', '30'))
+# A hedge request goes to the next region once the primary is this many times slower than usual
+HEDGE_LATENCY_FACTOR = float(os.getenv('HEDGE_LATENCY_FACTOR', '2.0'))
+# Bounds on the hedge delay in seconds
+HEDGE_MIN_DELAY = float(os.getenv('HEDGE_MIN_DELAY', '1.0'))
+HEDGE_MAX_DELAY = float(os.getenv('HEDGE_MAX_DELAY', '8.0'))
+
+# Operations whose responses can be raced; streaming responses can't be abandoned cleanly
+HEDGEABLE_OPERATIONS = frozenset({'invoke_model', 'retrieve', 'retrieve_and_generate'})
+
+# Error codes worth retrying in another region
+RETRYABLE_ERROR_CODES = frozenset({
+    'ThrottlingException', 'ServiceUnavailableException', 'InternalServerException',
+    'ModelNotReadyException', 'ModelTimeoutException', 'ServiceQuotaExceededException',
+    'TooManyRequestsException', 'RequestTimeout', 'InternalFailure',
+})
+
+# Conversation sessions remembered per router for pinning follow-up calls to their region
+_MAX_PINNED_SESSIONS = 10000
+
+_hedge_pool = ThreadPoolExecutor(max_workers=int(os.getenv('HEDGE_POOL_SIZE', '32')),
+                                 thread_name_prefix="region-hedge")
+
+# Routers by name, for metrics
+_routers: Dict[str, "RegionRouter"] = {}
+
+
+def parse_regions(value: Optional[str], default: str = 'us-east-1') -> List[str]:
+    """Parse a comma-separated region list"""
+    regions = [r.strip() for r in (value or '').split(',') if r.strip()]
+    return regions or [default]
+
+
+def parse_region_overrides(value: Optional[str], parameter: str) -> Dict[str, Dict[str, str]]:
+    """Parse "us-west-2=ID,eu-west-1=ID" into per-region request overrides"""
+    overrides = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            region, override = item.split('=', 1)
+            overrides[region.strip()] = {parameter: override.strip()}
+    return overrides
+
+
+def is_retryable(error: Exception) -> bool:
+    """Whether a failure should fail over to another region"""
+    if isinstance(error, ClientError):
+        code = error.response.get('Error', {}).get('Code', '')
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        return code in RETRYABLE_ERROR_CODES or status >= 500
+    return isinstance(error, (BotoCoreError, ConnectionError, TimeoutError))
+
+
+class RegionStats:
+    """Latency and error tracking for one region"""
+
+    def __init__(self, region: str):
+        self.region = region
+        self.latency = None
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.calls = 0
+        self.failures = 0
+        self.hedges_won = 0
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.cooldown_until
+
+    def record_success(self, latency: float) -> None:
+        self.calls += 1
+        self.consecutive_failures = 0
+        self.latency = latency if self.latency is None else \
+            REGION_EWMA_ALPHA * latency + (1 - REGION_EWMA_ALPHA) * self.latency
+        self.error_rate = (1 - REGION_EWMA_ALPHA) * self.error_rate
+
+    def record_failure(self, now: float) -> None:
+        self.calls += 1
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.error_rate = REGION_EWMA_ALPHA + (1 - REGION_EWMA_ALPHA) * self.error_rate
+        if self.consecutive_failures >= REGION_FAILURE_THRESHOLD:
+            self.cooldown_until = now + REGION_COOLDOWN_SECONDS
+            logger.warning("Region %s failed %s times, out of rotation for %ss",
+                           self.region, self.consecutive_failures, REGION_COOLDOWN_SECONDS)
+
+    def score(self) -> float:
+        # Unknown regions are tried optimistically; errors inflate the expected latency
+        latency = self.latency if self.latency is not None else 0.0
+        return latency * (1.0 + 4.0 * self.error_rate)
+
+    def as_dict(self, now: float) -> Dict[str, Any]:
+        return {
+            "latency_ewma": self.latency,
+            "error_rate": self.error_rate,
+            "calls": self.calls,
+            "failures": self.failures,
+            "hedges_won": self.hedges_won,
+            "healthy": self.healthy(now),
+        }
+
+
+class RegionRouter:
+    """Routes client calls to the fastest healthy region with failover and hedging.
+
+    `clients` maps region names to clients with identical APIs (boto3 clients or fakes).
+    `overrides` maps region names to request parameters that differ per region.
+    """
+
+    def __init__(self, name: str, clients: Dict[str, Any],
+                 overrides: Optional[Dict[str, Dict[str, Any]]] = None, hedging: bool = True):
+        if not clients:
+            raise ValueError("RegionRouter needs at least one regional client")
+        self.name = name
+        self.clients = clients
+        self.overrides = overrides or {}
+        self.hedging = hedging and len(clients) > 1
+        self._lock = threading.Lock()
+        self._stats = {region: RegionStats(region) for region in clients}
+        # Conversation sessionId -> region that created it
+        self._session_regions = OrderedDict()
+        _routers[name] = self
+
+    def ranked_regions(self) -> List[str]:
+        """Healthy regions fastest first, then regions in cooldown as a last resort"""
+        now = time.time()
+        with self._lock:
+            stats = list(self._stats.values())
+        healthy = sorted((s for s in stats if s.healthy(now)), key=lambda s: s.score())
+        cooling = sorted((s for s in stats if not s.healthy(now)), key=lambda s: s.cooldown_until)
+        return [s.region for s in healthy + cooling]
+
+    def _hedge_delay(self, region: str) -> float:
+        latency = self._stats[region].latency
+        if latency is None:
+            return HEDGE_MAX_DELAY
+        return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, latency * HEDGE_LATENCY_FACTOR))
+
+    def _invoke(self, region: str, operation: str, args, kwargs):
+        request = dict(kwargs, **self.overrides.get(region, {}))
+        start_time = time.perf_counter()
+        try:
+            result = getattr(self.clients[region], operation)(*args, **request)
+        except Exception as e:
+            # Client errors (bad request, access denied) say nothing about the region's health
+            if is_retryable(e):
+                with self._lock:
+                    self._stats[region].record_failure(time.time())
+            raise
+        with self._lock:
+            self._stats[region].record_success(time.perf_counter() - start_time)
+            if isinstance(result, dict) and result.get('sessionId'):
+                self._session_regions[result['sessionId']] = region
+                self._session_regions.move_to_end(result['sessionId'])
+                while len(self._session_regions) > _MAX_PINNED_SESSIONS:
+                    self._session_regions.popitem(last=False)
+        return result
+
+    def call(self, operation: str, *args, **kwargs):
+        """Call an operation on the best region, failing over on retryable errors"""
+        with self._lock:
+            pinned = self._session_regions.get(kwargs.get('sessionId'))
+        if pinned:
+            # Sessions only exist in the region that created them: no hedging or failover
+            return self._invoke(pinned, operation, args, kwargs)
+
+        regions = self.ranked_regions()
+        if self.hedging and operation in HEDGEABLE_OPERATIONS:
+            return self._hedged_call(regions, operation, args, kwargs)
+
+        last_error = None
+        for region in regions:
+            try:
+                return self._invoke(region, operation, args, kwargs)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                logger.warning("%s.%s failed in %s, failing over: %s", self.name, operation, region, e)
+                last_error = e
+        raise last_error
+
+    def _hedged_call(self, regions: List[str], operation: str, args, kwargs):
+        """Race the primary against the next region if it is slower than usual"""
+        pending = {}
+        remaining = list(regions)
+        last_error = None
+
+        def launch():
+            region = remaining.pop(0)
+            pending[_hedge_pool.submit(self._invoke, region, operation, args, kwargs)] = region
+
+        launch()
+        while pending:
+            delay = self._hedge_delay(pending[next(iter(pending))]) if remaining else None
+            done, _ = wait(list(pending), timeout=delay, return_when=FIRST_COMPLETED)
+            if not done:
+                logger.info("%s.%s slow in %s, hedging to %s", self.name, operation, list(pending.values()), remaining[0])
+                launch()
+                continue
+            for future in done:
+                region = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    if not is_retryable(e):
+                        raise
+                    last_error = e
+                    continue
+                if region != regions[0]:
+                    with self._lock:
+                        self._stats[region].hedges_won += 1
+                # Slower duplicates finish in the background and only update stats
+                return result
+            if not pending and remaining:
+                launch()
+        raise last_error
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            return {region: s.as_dict(now) for region, s in self._stats.items()}
+
+
+class RoutedClient:
+    """Client-shaped proxy that sends every operation through a RegionRouter"""
+
+    def __init__(self, router: RegionRouter):
+        self._router = router
+
+    @property
+    def meta(self):
+        return self.clients[self._router.ranked_regions()[0]].meta
+
+    @property
+    def clients(self) -> Dict[str, Any]:
+        return self._router.clients
+
+    @property
+    def exceptions(self):
+        # Clients for the same service share their exception classes
+        return next(iter(self.clients.values())).exceptions
+
+    def _is_operation(self, name: str) -> bool:
+        client = next(iter(self.clients.values()))
+        operations = getattr(getattr(client, 'meta', None), 'method_to_api_mapping', None)
+        if operations is not None:
+            return name in operations
+        # Fakes without botocore metadata: any public method
+        return callable(getattr(client, name, None))
+
+    def __getattr__(self, name):
+        if name.startswith('_') or not self._is_operation(name):
+            raise AttributeError(f"{type(self).__name__} only routes client operations, not {name!r}")
+        return lambda *args, **kwargs: self._router.call(name, *args, **kwargs)
+
+
+def get_region_stats() -> Dict[str, Any]:
+    """Per-region latency and error stats for every router in the process"""
+    return {name: router.stats() for name, router in _routers.items()}
+
+
+if __name__ == "__main__":
+    # Simulated regions: us-east-1 degrades halfway through, us-west-2 stays steady
+    import random
+
+    class SimulatedClient:
+        def __init__(self, region, latency, jitter=0.02):
+            self.region = region
+            self.latency = latency
+            self.jitter = jitter
+
+        def invoke_model(self, **kwargs):
+            time.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+            return {"region": self.region}
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    HEDGE_MIN_DELAY = 0.05
+    east = SimulatedClient('us-east-1', 0.05)
+    west = SimulatedClient('us-west-2', 0.12)
+    router = RegionRouter('simulation', {'us-east-1': east, 'us-west-2': west})
+    client = RoutedClient(router)
+
+    served = {}
+    for i in range(60):
+        if i == 30:
+            east.latency = 0.6
+        start = time.perf_counter()
+        region = client.invoke_model()["region"]
+        served[region] = served.get(region, 0) + 1
+        if i % 10 == 9:
+            print(f"call {i + 1}: served by {served}, last latency {time.perf_counter() - start:.3f}s")
+    print(router.stats())
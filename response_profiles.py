@@ -0,0 +1,121 @@
+import json
+import logging
+import os
+import re
+from typing import Dict, List, Optional, Any
+from usage_tracking import tracker
+
+logger = logging.getLogger(__name__)
+
+# Stop generating if the model starts writing the next turn of the transcript itself
+TURN_STOP_SEQUENCES = ["\n\nHuman:"]
+
+DEFAULT_PROFILE = "general"
+
+# Response-length profiles: max_tokens, stop sequences and a hint appended to the prompt
+RESPONSE_PROFILES: Dict[str, Dict[str, Any]] = {
+    "short_faq": {
+        "max_tokens": 300,
+        "temperature": 0.5,
+        "stop_sequences": TURN_STOP_SEQUENCES,
+        "hint": "Answer in two or three sentences.",
+    },
+    "product_detail": {
+        "max_tokens": 700,
+        "temperature": 0.7,
+        "stop_sequences": TURN_STOP_SEQUENCES,
+        "hint": "Cover the relevant product details briefly; use a short list if it helps.",
+    },
+    "escalation": {
+        "max_tokens": 200,
+        "temperature": 0.3,
+        "stop_sequences": TURN_STOP_SEQUENCES,
+        "hint": "Keep it to one or two sentences.",
+    },
+    "general": {
+        "max_tokens": 1024,
+        "temperature": 0.7,
+        "stop_sequences": TURN_STOP_SEQUENCES,
+        "hint": "",
+    },
+}
+
+# Keyword rules evaluated in order; the first match wins
+_PROFILE_RULES = [
+    ("escalation", re.compile(
+        r"\b(speak|talk)\s+(to|with)\b|\bcall\s*(me|back)\b|\bphone\b|\brepresentative\b|\bhuman\b|\bcomplain", re.I)),
+    ("product_detail", re.compile(
+        r"\b(product|products|spec|specs|specification|specifications|size|sizes|diameter|material|materials|wood|finish|custom|compare|catalog)\b", re.I)),
+    ("short_faq", re.compile(
+        r"\b(hours|ship|shipping|return|returns|refund|warranty|price|cost|how long|where|when|who|payment|discount)\b", re.I)),
+]
+
+
+def _load_overrides() -> None:
+    """Apply tuned profile values from RESPONSE_PROFILES_PATH, if set"""
+    path = os.getenv('RESPONSE_PROFILES_PATH')
+    if not path:
+        return
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            overrides = json.load(f)
+        for name, values in overrides.items():
+            RESPONSE_PROFILES.setdefault(name, dict(RESPONSE_PROFILES[DEFAULT_PROFILE])).update(values)
+        logger.info("Loaded response profile overrides from %s", path)
+    except Exception as e:
+        logger.warning("Could not load response profile overrides from %s: %s", path, e)
+
+
+_load_overrides()
+
+
+def select_profile(prompt: str) -> str:
+    """Pick a response-length profile for a customer query"""
+    for name, pattern in _PROFILE_RULES:
+        if pattern.search(prompt or ""):
+            return name
+    return DEFAULT_PROFILE
+
+
+def get_profile(name: Optional[str]) -> Dict[str, Any]:
+    """Return the settings for a profile, falling back to the default profile"""
+    return RESPONSE_PROFILES.get(name or DEFAULT_PROFILE, RESPONSE_PROFILES[DEFAULT_PROFILE])
+
+
+def _percentile(sorted_values: List[int], pct: float) -> int:
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def output_token_distribution() -> Dict[str, Dict[str, Any]]:
+    """Output-token distribution per profile from recent Claude calls"""
+    by_profile: Dict[str, List[Dict[str, Any]]] = {}
+    for record in tracker.recent_calls(source="invoke_model"):
+        by_profile.setdefault(record.get("profile") or DEFAULT_PROFILE, []).append(record)
+
+    distribution = {}
+    for name, records in by_profile.items():
+        tokens = sorted(r["output_tokens"] for r in records)
+        truncated = sum(1 for r in records if r.get("stop_reason") == "max_tokens")
+        distribution[name] = {
+            "calls": len(records),
+            "max_tokens": get_profile(name)["max_tokens"],
+            "p50": _percentile(tokens, 50),
+            "p90": _percentile(tokens, 90),
+            "p99": _percentile(tokens, 99),
+            "max": tokens[-1] if tokens else 0,
+            "truncated_ratio": truncated / len(records) if records else 0.0,
+        }
+    return distribution
+
+
+def suggest_max_tokens(headroom: float = 1.25, min_calls: int = 20) -> Dict[str, int]:
+    """Suggest max_tokens per profile from the observed p99 output length"""
+    suggestions = {}
+    for name, stats in output_token_distribution().items():
+        if stats["calls"] < min_calls:
+            continue
+        suggestions[name] = max(64, int(stats["p99"] * headroom))
+    return suggestions
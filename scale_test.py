@@ -0,0 +1,175 @@
+"""Scale test for customer lookups: filtered scan vs name index + GetItem vs a name GSI.
+
+Each table size is generated with synthetic_data.py into the in-process stand-in
+(local_dynamodb.py), then timed with the same lookup functions the app uses. Read
+capacity is metered the way DynamoDB bills it (4 KB units, eventually consistent), and
+the modeled latency adds a network round trip per request, which the stand-in doesn't
+have.
+
+    python scale_test.py                         # 1k, 10k and 100k customers
+    python scale_test.py --sizes 1000000 --scan-lookups 5
+    python scale_test.py --miss-scan             # as with NAME_INDEX_MISS_SCAN=true
+"""
+import argparse
+import random
+import statistics
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Tuple
+
+import dynamo_utils
+from dynamo_utils import find_customer_by_scan, lookup_customer_orders
+from local_dynamodb import LocalDynamoDB
+from name_index import customer_index, CUSTOMER_TABLE, CustomerNameIndex
+from shared_cache import get_cache
+from synthetic_data import generate_customers, load_into_table
+
+# Round trip added per DynamoDB request in the modeled latency column
+DEFAULT_ROUND_TRIP_MS = 8.0
+
+Lookup = Callable[[str, str], Optional[Dict]]
+
+
+def _typo(name: str, rng: random.Random) -> str:
+    chars = list(name)
+    position = rng.randrange(len(chars))
+    chars[position] = rng.choice("abcdefghijklmnopqrstuvwxyz")
+    return "".join(chars)
+
+
+def _gsi_lookup(table) -> Lookup:
+    def lookup(first_name: str, last_name: str) -> Optional[Dict]:
+        response = table.query(
+            IndexName='name-index',
+            KeyConditionExpression='#ln = :ln and #fn = :fn',
+            ExpressionAttributeNames={'#fn': 'first_name', '#ln': 'last_name'},
+            ExpressionAttributeValues={':fn': first_name, ':ln': last_name},
+        )
+        items = response.get('Items', [])
+        return items[0] if items else None
+    return lookup
+
+
+def _app_lookup(dynamodb) -> Lookup:
+    """The app's own lookup (process-wide name index, GetItem, miss handling); found means orders came back"""
+    def lookup(first_name: str, last_name: str) -> Optional[List[Dict]]:
+        _, orders, _ = lookup_customer_orders(dynamodb, f"{first_name} {last_name}")
+        return orders
+    return lookup
+
+
+def _measure(table, lookup: Lookup, queries: List[Tuple[str, str]], round_trip_ms: float) -> Dict[str, float]:
+    latencies, found = [], 0
+    # Each strategy starts cold: orders cached by an earlier one would read nothing
+    get_cache().clear()
+    before = table.capacity()
+    for first_name, last_name in queries:
+        start = time.perf_counter()
+        if lookup(first_name, last_name) is not None:
+            found += 1
+        latencies.append((time.perf_counter() - start) * 1000)
+    after = table.capacity()
+    requests = (after['requests'] - before['requests']) / len(queries)
+    latencies.sort()
+    p50 = statistics.median(latencies)
+    return {
+        "queries": len(queries),
+        "found": found,
+        "p50_ms": p50,
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "rcu": (after['read_units'] - before['read_units']) / len(queries),
+        "requests": requests,
+        "modeled_ms": p50 + requests * round_trip_ms,
+    }
+
+
+def run_size(size: int, lookups: int, scan_lookups: int, seed: int, round_trip_ms: float) -> Dict:
+    rng = random.Random(seed)
+    dynamodb = LocalDynamoDB()
+    table = dynamodb.Table(CUSTOMER_TABLE)
+    names = []
+
+    def remember(customers):
+        for customer in customers:
+            names.append((customer['first_name'], customer['last_name']))
+            yield customer
+
+    start = time.perf_counter()
+    load_into_table(table, remember(generate_customers(size, seed)))
+    load_seconds = time.perf_counter() - start
+    table_bytes = table.size_bytes
+
+    index = CustomerNameIndex()
+    before = table.capacity()
+    start = time.perf_counter()
+    index.refresh(dynamodb)
+    build_seconds = time.perf_counter() - start
+    build_rcu = table.capacity()['read_units'] - before['read_units']
+    # Second build under tracemalloc for the memory the index keeps
+    tracemalloc.start()
+    measured = CustomerNameIndex()
+    measured.refresh(dynamodb)
+    index_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del measured
+    # The app's lookups go through the process-wide index, loaded from this table
+    customer_index.refresh(dynamodb)
+
+    existing = rng.sample(names, min(lookups, len(names)))
+    typos = [(first, _typo(last, rng)) for first, last in existing]
+    missing = [(rng.choice(names)[0], f"Zzyx{rng.randrange(10**6)}") for _ in range(len(existing))]
+    scan_count = max(1, min(scan_lookups, len(existing)))
+
+    strategies = {
+        "scan": lambda f, l: find_customer_by_scan(table, f, l),
+        "app": _app_lookup(dynamodb),
+        "gsi query": _gsi_lookup(table),
+    }
+    results = []
+    for label, queries in (("existing", existing), ("one typo", typos), ("missing", missing)):
+        for strategy, lookup in strategies.items():
+            sample = queries[:scan_count] if strategy == "scan" else queries
+            results.append((label, strategy, _measure(table, lookup, sample, round_trip_ms)))
+
+    return {
+        "size": size,
+        "load_seconds": load_seconds,
+        "table_mb": table_bytes / 2**20,
+        "index_names": len(index),
+        "build_seconds": build_seconds,
+        "build_rcu": build_rcu,
+        "index_mb": index_bytes / 2**20,
+        "results": results,
+    }
+
+
+def print_report(report: Dict) -> None:
+    print(f"\n== {report['size']:,} customers: {report['table_mb']:.1f} MB table, loaded in {report['load_seconds']:.1f}s")
+    print(f"   name index: {report['index_names']:,} names, built in {report['build_seconds']:.2f}s "
+          f"for {report['build_rcu']:,.0f} RCU, {report['index_mb']:.1f} MB "
+          f"({report['index_mb'] * 2**20 / report['size']:.0f} B/customer)")
+    print(f"   {'queries':<9} {'strategy':<10} {'n':>4} {'found':>5} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'RCU/lookup':>10} {'req/lookup':>10} {'modeled ms':>10}")
+    for label, strategy, r in report["results"]:
+        print(f"   {label:<9} {strategy:<10} {r['queries']:>4} {r['found']:>5} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} "
+              f"{r['rcu']:>10.1f} {r['requests']:>10.1f} {r['modeled_ms']:>10.1f}")
+
+
+if __name__ == "__main__":
+    import logging
+    from log_utils import configure_logging
+    configure_logging(level="WARNING", fmt="text")
+    logging.getLogger().setLevel(logging.WARNING)
+    parser = argparse.ArgumentParser(description="Customer lookup scale test")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated table sizes")
+    parser.add_argument("--lookups", type=int, default=200, help="lookups per query type for indexed access")
+    parser.add_argument("--scan-lookups", type=int, default=20, help="lookups per query type for scans")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--round-trip-ms", type=float, default=DEFAULT_ROUND_TRIP_MS)
+    parser.add_argument("--miss-scan", action="store_true",
+                        help="scan for names the index doesn't know, as with NAME_INDEX_MISS_SCAN=true")
+    args = parser.parse_args()
+    if args.miss_scan:
+        dynamo_utils.NAME_INDEX_MISS_SCAN = True
+    for size in (int(s) for s in args.sizes.split(",")):
+        print_report(run_size(size, args.lookups, args.scan_lookups, args.seed, args.round_trip_ms))
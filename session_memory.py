@@ -0,0 +1,461 @@
+"""Bounded per-session chat transcripts.
+
+Messages are compact __slots__ records, and order lookups keep the raw order fields
+instead of rendered HTML. Once a session goes over its memory cap its oldest turns are
+spilled to a local SQLite file, and idle sessions are moved out of memory entirely.
+Spilled turns are deleted when their session is reset and once they are older than
+`SESSION_SPILL_RETENTION_SECONDS`.
+
+Run `python session_memory.py bench` to compare against dict + rendered-HTML history.
+"""
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Messages kept in memory per session
+SESSION_MEMORY_MAX_MESSAGES = int(os.getenv('SESSION_MEMORY_MAX_MESSAGES', '40'))
+# Approximate bytes of message content kept in memory per session
+SESSION_MEMORY_MAX_BYTES = int(os.getenv('SESSION_MEMORY_MAX_BYTES', '65536'))
+# Seconds without activity before a whole session is moved out of memory
+SESSION_IDLE_SECONDS = float(os.getenv('SESSION_IDLE_SECONDS', '1800'))
+# Messages brought back into memory when an evicted session becomes active again
+SESSION_RESTORE_MESSAGES = int(os.getenv('SESSION_RESTORE_MESSAGES', '10'))
+# SQLite file holding spilled turns
+SESSION_SPILL_PATH = os.getenv('SESSION_SPILL_PATH', 'session_spill.db')
+# Seconds spilled turns are kept before they are purged; 0 keeps them until their session is reset
+SESSION_SPILL_RETENTION_SECONDS = float(os.getenv('SESSION_SPILL_RETENTION_SECONDS', '86400'))
+
+# Bumped when the spill table changes; older files are emptied rather than migrated
+_SPILL_SCHEMA_VERSION = 2
+
+KIND_TEXT = "text"
+KIND_ORDERS = "orders"
+
+# (order_id, product, quantity, order_date, total_price)
+OrderRow = Tuple[str, str, int, str, float]
+
+
+def compact_orders(orders: Optional[Iterable[Dict[str, Any]]]) -> Tuple[OrderRow, ...]:
+    """Reduce DynamoDB order maps to the fields the chat displays"""
+    rows = []
+    for order in orders or []:
+        rows.append((
+            str(order.get('order_id', '')),
+            str(order.get('product', '')),
+            int(order.get('quantity', 0) or 0),
+            str(order.get('order_date', '')),
+            float(order.get('total_price', 0) or 0),
+        ))
+    return tuple(rows)
+
+
+def _content_size(value: Any) -> int:
+    """Approximate bytes held by a message's content"""
+    if isinstance(value, tuple):
+        return sys.getsizeof(value) + sum(_content_size(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class Message:
+    """One chat turn. Order results hold (customer name, order rows), rendered at display time"""
+
+    __slots__ = ('role', 'kind', 'content', 'timestamp', 'size')
+
+    def __init__(self, role: str, content: Any, kind: str = KIND_TEXT, timestamp: Optional[float] = None):
+        self.role = role
+        self.kind = kind
+        self.content = content
+        self.timestamp = timestamp or time.time()
+        self.size = _content_size(content)
+
+    def to_json(self) -> str:
+        return json.dumps([self.role, self.kind, self.content, self.timestamp])
+
+    @classmethod
+    def from_json(cls, data: str) -> "Message":
+        role, kind, content, timestamp = json.loads(data)
+        if kind == KIND_ORDERS:
+            name, rows = content
+            content = (name, tuple(tuple(row) for row in rows))
+        return cls(role, content, kind, timestamp)
+
+
+class SpillStore:
+    """SQLite file holding turns that no longer fit in memory"""
+
+    def __init__(self, path: str = SESSION_SPILL_PATH, retention_seconds: float = SESSION_SPILL_RETENTION_SECONDS):
+        self.path = path
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+        self._conn = None
+        self.purged = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.path != ':memory:' and not os.path.exists(self.path):
+                # Transcripts hold customer names and phone numbers, so the file is private to this user
+                os.close(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600))
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            # Spilled turns are an archive, so trade fsync-per-commit for throughput
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            if conn.execute("PRAGMA user_version").fetchone()[0] != _SPILL_SCHEMA_VERSION:
+                conn.execute("DROP TABLE IF EXISTS spilled_messages")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS spilled_messages ("
+                "session_id TEXT NOT NULL, seq INTEGER NOT NULL, message TEXT NOT NULL, "
+                "created REAL NOT NULL, PRIMARY KEY (session_id, seq))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS spilled_messages_created ON spilled_messages (created)")
+            conn.execute(f"PRAGMA user_version = {_SPILL_SCHEMA_VERSION}")
+            conn.commit()
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(self.path + suffix):
+                    os.chmod(self.path + suffix, 0o600)
+            self._conn = conn
+            self._purge(conn, time.time())
+        return self._conn
+
+    def _purge(self, conn: sqlite3.Connection, now: float) -> int:
+        if self.retention_seconds <= 0:
+            return 0
+        deleted = conn.execute("DELETE FROM spilled_messages WHERE created < ?",
+                               (now - self.retention_seconds,)).rowcount
+        conn.commit()
+        if deleted:
+            self.purged += deleted
+            logger.info("Purged %s spilled messages older than %ss", deleted, self.retention_seconds)
+        return deleted
+
+    def purge_expired(self, now: Optional[float] = None) -> int:
+        """Delete spilled turns older than the retention period"""
+        with self._lock:
+            return self._purge(self._connection(), now or time.time())
+
+    def append(self, session_id: str, first_seq: int, messages: List[Message]) -> None:
+        rows = [(session_id, first_seq + i, m.to_json(), m.timestamp) for i, m in enumerate(messages)]
+        with self._lock:
+            conn = self._connection()
+            # A reused sequence number raises instead of overwriting an archived turn
+            with conn:
+                conn.executemany("INSERT INTO spilled_messages VALUES (?, ?, ?, ?)", rows)
+
+    def load(self, session_id: str, limit: Optional[int] = None) -> List[Message]:
+        """The most recent spilled messages for a session, oldest first"""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT message FROM spilled_messages WHERE session_id = ? ORDER BY seq DESC LIMIT ?",
+                (session_id, -1 if limit is None else limit)
+            ).fetchall()
+        return [Message.from_json(row[0]) for row in reversed(rows)]
+
+    def pop_tail(self, session_id: str, limit: int) -> List[Message]:
+        """Remove and return the most recent spilled messages, oldest first"""
+        with self._lock:
+            conn = self._connection()
+            rows = conn.execute(
+                "SELECT seq, message FROM spilled_messages WHERE session_id = ? ORDER BY seq DESC LIMIT ?",
+                (session_id, limit)
+            ).fetchall()
+            if rows:
+                conn.execute("DELETE FROM spilled_messages WHERE session_id = ? AND seq >= ?",
+                             (session_id, rows[-1][0]))
+                conn.commit()
+        return [Message.from_json(row[1]) for row in reversed(rows)]
+
+    def next_seq(self, session_id: str) -> int:
+        """Sequence number after the session's latest spilled turn (purges leave gaps below it)"""
+        with self._lock:
+            return self._connection().execute(
+                "SELECT COALESCE(MAX(seq) + 1, 0) FROM spilled_messages WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+
+    def count(self, session_id: str) -> int:
+        with self._lock:
+            return self._connection().execute(
+                "SELECT COUNT(*) FROM spilled_messages WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM spilled_messages WHERE session_id = ?", (session_id,))
+            conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class SessionTranscript:
+    """Recent turns of one session in memory, older turns in the spill store"""
+
+    def __init__(self, session_id: str, store: SpillStore,
+                 max_messages: int = SESSION_MEMORY_MAX_MESSAGES,
+                 max_bytes: int = SESSION_MEMORY_MAX_BYTES):
+        self.session_id = session_id
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self._store = store
+        self._lock = threading.Lock()
+        self._messages = deque()
+        self._bytes = 0
+        self.spilled = 0
+        self._next_seq = 0
+        self.last_active = time.time()
+
+    def restore(self, limit: int = SESSION_RESTORE_MESSAGES) -> None:
+        """Bring the latest spilled turns of an evicted session back into memory"""
+        with self._lock:
+            for message in self._store.pop_tail(self.session_id, limit):
+                self._messages.append(message)
+                self._bytes += message.size
+            self.spilled = self._store.count(self.session_id)
+            self._next_seq = self._store.next_seq(self.session_id)
+
+    def append(self, role: str, content: Any, kind: str = KIND_TEXT) -> Message:
+        message = Message(role, content, kind)
+        with self._lock:
+            self._messages.append(message)
+            self._bytes += message.size
+            self.last_active = message.timestamp
+            self._compact()
+        return message
+
+    def _compact(self) -> None:
+        if len(self._messages) <= self.max_messages and self._bytes <= self.max_bytes:
+            return
+        # Spill down to three quarters of the cap so spills happen in batches, not on every turn;
+        # the latest turn always stays in memory, however large
+        max_messages = self.max_messages * 3 // 4
+        max_bytes = self.max_bytes * 3 // 4
+        overflow = []
+        while len(self._messages) > 1 and (len(self._messages) > max_messages or self._bytes > max_bytes):
+            message = self._messages.popleft()
+            self._bytes -= message.size
+            overflow.append(message)
+        if overflow:
+            self._spill(overflow)
+
+    def _spill(self, messages: List[Message]) -> None:
+        try:
+            try:
+                self._store.append(self.session_id, self._next_seq, messages)
+            except sqlite3.IntegrityError:
+                # Another process spilled for this session meanwhile: continue after its turns
+                self._next_seq = self._store.next_seq(self.session_id)
+                self._store.append(self.session_id, self._next_seq, messages)
+            self._next_seq += len(messages)
+            self.spilled += len(messages)
+        except Exception as e:
+            # Dropping old turns beats growing without bound
+            logger.error("Could not spill %s messages for session %s: %s", len(messages), self.session_id, e)
+
+    def spill_all(self) -> None:
+        with self._lock:
+            messages = list(self._messages)
+            self._messages.clear()
+            self._bytes = 0
+            if messages:
+                self._spill(messages)
+
+    def messages(self) -> List[Message]:
+        """Turns currently held in memory, oldest first"""
+        with self._lock:
+            self.last_active = time.time()
+            return list(self._messages)
+
+    def earlier_messages(self, limit: Optional[int] = None) -> List[Message]:
+        """Spilled turns, oldest first"""
+        return self._store.load(self.session_id, limit)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._messages.clear()
+            self._bytes = 0
+            self.spilled = 0
+            self._next_seq = 0
+            self._store.delete(self.session_id)
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "messages": len(self._messages),
+                "bytes": self._bytes,
+                "spilled": self.spilled,
+                "idle_seconds": now - self.last_active,
+            }
+
+
+class SessionMemory:
+    """Process-wide registry of session transcripts with idle eviction"""
+
+    def __init__(self, store: Optional[SpillStore] = None, idle_seconds: float = SESSION_IDLE_SECONDS):
+        self.store = store or SpillStore()
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, SessionTranscript] = {}
+        self._last_sweep = time.time()
+        self.evicted = 0
+
+    def transcript(self, session_id: str) -> SessionTranscript:
+        """The transcript for a session, restored from the spill store if it was evicted"""
+        self._maybe_evict_idle()
+        with self._lock:
+            transcript = self._sessions.get(session_id)
+            if transcript is not None:
+                return transcript
+            transcript = SessionTranscript(session_id, self.store)
+            self._sessions[session_id] = transcript
+        transcript.restore()
+        return transcript
+
+    def drop(self, session_id: str) -> None:
+        """End a session: forget it and delete its spilled turns"""
+        with self._lock:
+            transcript = self._sessions.pop(session_id, None)
+        if transcript is not None:
+            transcript.clear()
+        else:
+            # Evicted sessions only exist in the spill store
+            self.store.delete(session_id)
+
+    def _maybe_evict_idle(self) -> None:
+        now = time.time()
+        if now - self._last_sweep < min(60.0, self.idle_seconds):
+            return
+        self._last_sweep = now
+        self.evict_idle(now)
+        try:
+            self.store.purge_expired(now)
+        except sqlite3.Error as e:
+            logger.error("Could not purge spilled messages: %s", e)
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """Spill sessions idle for longer than idle_seconds and release their memory"""
+        now = now or time.time()
+        with self._lock:
+            idle = [t for t in self._sessions.values() if now - t.last_active >= self.idle_seconds]
+            for transcript in idle:
+                del self._sessions[transcript.session_id]
+        for transcript in idle:
+            transcript.spill_all()
+        if idle:
+            self.evicted += len(idle)
+            logger.info("Moved %s idle sessions out of memory", len(idle))
+        return len(idle)
+
+    def report(self, top: int = 20) -> Dict[str, Any]:
+        """Memory held per session, largest first"""
+        now = time.time()
+        with self._lock:
+            transcripts = list(self._sessions.values())
+        by_session = {t.session_id: t.stats(now) for t in transcripts}
+        largest = sorted(by_session.items(), key=lambda item: item[1]["bytes"], reverse=True)[:top]
+        return {
+            "sessions": len(by_session),
+            "messages": sum(s["messages"] for s in by_session.values()),
+            "bytes": sum(s["bytes"] for s in by_session.values()),
+            "spilled_messages": sum(s["spilled"] for s in by_session.values()),
+            "evicted_sessions": self.evicted,
+            "purged_messages": self.store.purged,
+            "process_max_rss_kb": _max_rss_kb(),
+            "by_session": dict(largest),
+        }
+
+
+def _max_rss_kb() -> Optional[int]:
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+# Process-wide registry shared by all sessions
+memory = SessionMemory()
+
+
+def get_transcript(session_id: str) -> SessionTranscript:
+    return memory.transcript(session_id)
+
+
+def get_memory_report() -> Dict[str, Any]:
+    return memory.report()
+
+
+def _benchmark(sessions: int = 500, turns: int = 60, path: str = 'session_spill_bench.db'):
+    """Compare list-of-dicts history with rendered order HTML against bounded transcripts"""
+    import tracemalloc
+    from decimal import Decimal
+
+    orders = [{"order_id": f"ORD-{i:05d}", "product": "Maple Ball 2in", "quantity": Decimal(12),
+               "order_date": "2024-03-0%d" % (i % 9 + 1), "total_price": Decimal("23.40")} for i in range(5)]
+    card = ('<div style="background-color: rgba(255, 255, 255, 0.1); padding: 15px; border-radius: 10px; '
+            'margin: 10px 0;">\n\n🔖 **Order ID**: `{order_id}`\n\n🎁 **Product**: {product}\n\n'
+            '📊 **Quantity**: {quantity}\n\n📅 **Date**: {order_date}\n\n💰 **Total**: ${total_price}\n</div>')
+    answer = "Our wooden balls are made from sustainably sourced maple and birch. " * 8
+
+    def legacy():
+        histories = {}
+        for s in range(sessions):
+            history = histories.setdefault(f"session-{s}", [])
+            for t in range(turns):
+                history.append({"role": "user", "content": f"question {t} from session {s}"})
+                if t % 5 == 0:
+                    rendered = "\n".join(["## 📦 Orders for Jane Doe"] + [card.format(**o) for o in orders])
+                    history.append({"role": "assistant", "content": rendered})
+                else:
+                    history.append({"role": "assistant", "content": answer + str(t)})
+        return histories
+
+    def bounded():
+        registry = SessionMemory(SpillStore(path))
+        for s in range(sessions):
+            transcript = registry.transcript(f"session-{s}")
+            for t in range(turns):
+                transcript.append("user", f"question {t} from session {s}")
+                if t % 5 == 0:
+                    transcript.append("assistant", ("Jane Doe", compact_orders(orders)), KIND_ORDERS)
+                else:
+                    transcript.append("assistant", answer + str(t))
+        return registry
+
+    def remove_spill_files():
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    for label, func in (("dicts + rendered HTML", legacy), ("bounded transcripts", bounded)):
+        remove_spill_files()
+        tracemalloc.start()
+        start = time.perf_counter()
+        kept = func()
+        elapsed = time.perf_counter() - start
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{label:<24} {current / 1024 / 1024:8.1f} MiB retained  {elapsed:6.2f}s "
+              f"({sessions} sessions x {turns} turns)")
+        if isinstance(kept, SessionMemory):
+            kept.store.close()
+    remove_spill_files()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        _benchmark()
+    else:
+        print("usage: python session_memory.py bench")
@@ -0,0 +1,353 @@
+"""Cache tier shared by all worker processes on a host and kept across restarts.
+
+Chat answers and order lookups are cached here instead of in per-process dicts, so
+every Streamlit or API worker behind the load balancer sees the same entries and a
+deploy starts warm. Entries live in namespaces, each value with its own time-to-live,
+and the store is kept under `CACHE_MAX_BYTES` by evicting the least recently used
+entries.
+
+Backends (`CACHE_BACKEND`):
+
+- `sqlite` (default): one SQLite database in WAL mode at `CACHE_PATH`. Readers never
+  block the writer, and concurrent processes are serialized by SQLite's own locking.
+- `memory`: an in-process LRU, as before, for single-process runs and tests.
+
+Secrets are never cached here, since the store is a file on disk. Cache errors are
+logged and treated as misses, so a broken cache file can't take the chat down.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# "sqlite" for the cross-process store, "memory" for a per-process LRU
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'sqlite')
+# SQLite database shared by the processes on this host
+CACHE_PATH = os.getenv('CACHE_PATH', 'cache/shared.db')
+# Total size of cached values; least recently used entries are evicted past it
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+# Entries kept by the memory backend
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '10000'))
+
+_SCHEMA_VERSION = 1
+# Sets between size checks in the SQLite backend
+_EVICT_CHECK_EVERY = 64
+# Last-access times are only rewritten when older than this, so hot reads don't turn into writes
+_ACCESS_RESOLUTION = 60.0
+# Evictions free space down to this fraction of the limit, so they don't run on every set
+_EVICT_TARGET = 0.9
+
+
+class CacheBackend(ABC):
+    """Namespaced key-value cache of JSON-serializable values with per-entry TTL"""
+
+    name = "backend"
+
+    def __init__(self):
+        self._counter_lock = threading.Lock()
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, namespace: str, event: str) -> None:
+        with self._counter_lock:
+            counters = self._counters.setdefault(namespace, {"hits": 0, "misses": 0, "sets": 0})
+            counters[event] = counters.get(event, 0) + 1
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        """Cached value, or None if absent or expired"""
+        value = self._get(namespace, key)
+        self._count(namespace, "hits" if value is not None else "misses")
+        return value
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """Store a value; ttl in seconds, None to keep it until evicted"""
+        self._set(namespace, key, value, ttl)
+        self._count(namespace, "sets")
+
+    @abstractmethod
+    def _get(self, namespace: str, key: str) -> Optional[Any]:
+        ...
+
+    @abstractmethod
+    def _set(self, namespace: str, key: str, value: Any, ttl: Optional[float]) -> None:
+        ...
+
+    @abstractmethod
+    def delete(self, namespace: str, key: str) -> None:
+        ...
+
+    @abstractmethod
+    def clear(self, namespace: Optional[str] = None) -> None:
+        ...
+
+    def stats(self) -> Dict[str, Any]:
+        with self._counter_lock:
+            return {"backend": self.name, "namespaces": {k: dict(v) for k, v in self._counters.items()}}
+
+
+class MemoryCache(CacheBackend):
+    """Per-process LRU with TTL, bounded by entry count and value bytes"""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES):
+        super().__init__()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # (namespace, key) -> (expires or None, size, value)
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[Optional[float], int, Any]]" = OrderedDict()
+        self._bytes = 0
+        self.evictions = 0
+
+    def _get(self, namespace: str, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+            if entry is None:
+                return None
+            if entry[0] is not None and entry[0] <= time.time():
+                self._remove((namespace, key))
+                return None
+            self._entries.move_to_end((namespace, key))
+            return entry[2]
+
+    def _set(self, namespace: str, key: str, value: Any, ttl: Optional[float]) -> None:
+        # Serialized size, so both backends enforce the same limit
+        size = len(json.dumps(value, separators=(',', ':')))
+        with self._lock:
+            self._remove((namespace, key))
+            self._entries[(namespace, key)] = (time.time() + ttl if ttl else None, size, value)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, entry_key: Tuple[str, str]) -> None:
+        entry = self._entries.pop(entry_key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def delete(self, namespace: str, key: str) -> None:
+        with self._lock:
+            self._remove((namespace, key))
+
+    def clear(self, namespace: Optional[str] = None) -> None:
+        with self._lock:
+            for entry_key in [k for k in self._entries if namespace is None or k[0] == namespace]:
+                self._remove(entry_key)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        with self._lock:
+            stats.update(entries=len(self._entries), bytes=self._bytes, max_bytes=self.max_bytes,
+                         evictions=self.evictions)
+        return stats
+
+
+class SQLiteCache(CacheBackend):
+    """SQLite (WAL) store shared by every process that opens the same file"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str = CACHE_PATH, max_bytes: int = CACHE_MAX_BYTES):
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._sets = 0
+        self._sets_lock = threading.Lock()
+        self.evictions = 0
+        self.expired = 0
+        self.errors = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self._connection()
+        if connection.execute("PRAGMA user_version").fetchone()[0] != _SCHEMA_VERSION:
+            connection.execute("DROP TABLE IF EXISTS entries")
+        connection.execute("""CREATE TABLE IF NOT EXISTS entries (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            expires REAL,
+            accessed REAL NOT NULL,
+            PRIMARY KEY (namespace, key))""")
+        connection.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        connection.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+        # Customer names and orders are cached, so keep the files private to this user
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.chmod(path + suffix, 0o600)
+        self._purge_expired(connection)
+        # Entries carried over from before this process started
+        self.warm_entries = connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        logger.info("Shared cache %s opened with %s entries", path, self.warm_entries)
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread; SQLite connections can't be shared between threads safely
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # WAL with NORMAL sync can lose the last commits on power loss, which a cache can afford
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _get(self, namespace: str, key: str) -> Optional[Any]:
+        try:
+            connection = self._connection()
+            now = time.time()
+            row = connection.execute("SELECT value, expires, accessed FROM entries WHERE namespace = ? AND key = ?",
+                                     (namespace, key)).fetchone()
+            if row is None:
+                return None
+            value, expires, accessed = row
+            if expires is not None and expires <= now:
+                connection.execute("DELETE FROM entries WHERE namespace = ? AND key = ? AND expires <= ?",
+                                   (namespace, key, now))
+                self.expired += 1
+                return None
+            if now - accessed > _ACCESS_RESOLUTION:
+                connection.execute("UPDATE entries SET accessed = ? WHERE namespace = ? AND key = ?",
+                                   (now, namespace, key))
+            return json.loads(value)
+        except (sqlite3.Error, ValueError) as e:
+            self.errors += 1
+            logger.error("Error reading shared cache entry %s/%s: %s", namespace, key, e)
+            return None
+
+    def _set(self, namespace: str, key: str, value: Any, ttl: Optional[float]) -> None:
+        try:
+            data = json.dumps(value, separators=(',', ':'))
+            now = time.time()
+            self._connection().execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, key, data, len(data), now + ttl if ttl else None, now))
+            with self._sets_lock:
+                self._sets += 1
+                check = self._sets % _EVICT_CHECK_EVERY == 0
+            if check or len(data) > self.max_bytes // _EVICT_CHECK_EVERY:
+                self.evict()
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            self.errors += 1
+            logger.error("Error writing shared cache entry %s/%s: %s", namespace, key, e)
+
+    def _purge_expired(self, connection: sqlite3.Connection) -> None:
+        self.expired += connection.execute("DELETE FROM entries WHERE expires IS NOT NULL AND expires <= ?",
+                                           (time.time(),)).rowcount
+
+    def evict(self) -> None:
+        """Drop expired entries, then least recently used ones until under the size limit"""
+        connection = self._connection()
+        self._purge_expired(connection)
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - int(self.max_bytes * _EVICT_TARGET)
+        freed, victims = 0, []
+        for namespace, key, size in connection.execute("SELECT namespace, key, size FROM entries ORDER BY accessed"):
+            victims.append((namespace, key))
+            freed += size
+            if freed >= excess:
+                break
+        connection.executemany("DELETE FROM entries WHERE namespace = ? AND key = ?", victims)
+        self.evictions += len(victims)
+        logger.info("Shared cache evicted %s entries (%s bytes)", len(victims), freed)
+
+    def delete(self, namespace: str, key: str) -> None:
+        try:
+            self._connection().execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+        except sqlite3.Error as e:
+            logger.error("Error deleting shared cache entry %s/%s: %s", namespace, key, e)
+
+    def clear(self, namespace: Optional[str] = None) -> None:
+        try:
+            if namespace is None:
+                self._connection().execute("DELETE FROM entries")
+            else:
+                self._connection().execute("DELETE FROM entries WHERE namespace = ?", (namespace,))
+        except sqlite3.Error as e:
+            logger.error("Error clearing shared cache: %s", e)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats.update(path=self.path, max_bytes=self.max_bytes, warm_entries=self.warm_entries,
+                     evictions=self.evictions, expired=self.expired, errors=self.errors)
+        try:
+            entries, size = self._connection().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+            stats.update(entries=entries, bytes=size)
+        except sqlite3.Error as e:
+            logger.error("Error reading shared cache size: %s", e)
+        return stats
+
+
+_cache: Optional[CacheBackend] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> CacheBackend:
+    """Process-wide cache backend from CACHE_BACKEND, falling back to memory if the store can't be opened"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                if CACHE_BACKEND == 'sqlite':
+                    try:
+                        _cache = SQLiteCache()
+                    except (sqlite3.Error, OSError) as e:
+                        logger.error("Error opening shared cache %s, using an in-process cache: %s", CACHE_PATH, e)
+                        _cache = MemoryCache()
+                else:
+                    _cache = MemoryCache()
+    return _cache
+
+
+def get_cache_stats() -> Dict[str, Any]:
+    return get_cache().stats()
+
+
+def _worker(path: str, worker: int, operations: int, results) -> None:
+    cache = SQLiteCache(path)
+    start = time.perf_counter()
+    hits = 0
+    for i in range(operations):
+        key = f"k{(i * 7 + worker) % 500}"
+        if cache.get("bench", key) is not None:
+            hits += 1
+        else:
+            cache.set("bench", key, {"worker": worker, "content": "x" * 400}, ttl=60)
+    results.put((worker, time.perf_counter() - start, hits))
+
+
+def _benchmark(processes: int = 4, operations: int = 5000) -> None:
+    """Concurrent processes sharing one store, then a restart that finds it warm"""
+    import multiprocessing
+    import tempfile
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        SQLiteCache(path).clear()
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=_worker, args=(path, w, operations, results)) for w in range(processes)]
+        for process in workers:
+            process.start()
+        for process in workers:
+            process.join()
+        for worker, seconds, hits in sorted(results.get() for _ in workers):
+            print(f"worker {worker}: {operations} ops in {seconds:.2f}s ({seconds / operations * 1e6:.0f} us/op), "
+                  f"{hits / operations:.0%} hits")
+        restarted = SQLiteCache(path)
+        print(f"after restart: {restarted.warm_entries} warm entries, "
+              f"first read {'hit' if restarted.get('bench', 'k1') is not None else 'miss'}")
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -0,0 +1,186 @@
+"""Synthetic customers for the Rivertownball-cus table.
+
+Items have the production shape (first_name, last_name and a nested orders list) plus a
+customer_id key. Names mix common, hyphenated, multi-part and accented forms with a long
+tail of rarer surnames; order counts are heavy-tailed and dates, quantities and prices
+follow the product catalog. Generation is deterministic for a given seed.
+
+    python synthetic_data.py --customers 100000 --output customers-100k.jsonl.gz
+    python synthetic_data.py --customers 10000 --load        # write into DYNAMODB_ENDPOINT_URL
+
+`--load` writes into the customer table that init_dynamodb() connects to, so it refuses
+unless DYNAMODB_ENDPOINT_URL (DynamoDB Local) or DYNAMODB_LOCAL_DATA (in-process table)
+is set; writing into the real AWS table takes an explicit `--i-know-this-is-aws`.
+"""
+import argparse
+import gzip
+import json
+import logging
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Any, Dict, Iterable, Iterator
+
+from local_dynamodb import json_default
+from name_index import customer_index, CUSTOMER_TABLE
+
+logger = logging.getLogger(__name__)
+
+# Catalog products and unit prices
+PRODUCTS = [
+    ("LuminaSphere 6in", Decimal("89.00")),
+    ("LuminaSphere 12in", Decimal("179.00")),
+    ("Maple Craft Ball 1in", Decimal("0.45")),
+    ("Maple Craft Ball 2in", Decimal("0.95")),
+    ("Birch Craft Ball 1.5in", Decimal("0.60")),
+    ("Oak Decorative Sphere 3in", Decimal("6.50")),
+    ("Walnut Sphere 4in", Decimal("18.00")),
+    ("Cherry Sphere 5in", Decimal("27.50")),
+    ("Drilled Beech Bead 20mm", Decimal("0.25")),
+    ("Custom Engraved Sphere", Decimal("45.00")),
+    ("Exotic Wood Sphere (Padauk)", Decimal("64.00")),
+    ("Bulk Craft Ball Pack (500)", Decimal("120.00")),
+]
+# Craft balls are ordered by the hundred, spheres one or two at a time
+_PRODUCT_WEIGHTS = [3, 1, 8, 8, 6, 5, 4, 2, 6, 2, 1, 3]
+
+FIRST_NAMES = [
+    "James", "Mary", "John", "Patricia", "Robert", "Jennifer", "Michael", "Linda", "William", "Elizabeth",
+    "David", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Charles", "Karen",
+    "Christopher", "Nancy", "Daniel", "Lisa", "Matthew", "Betty", "Anthony", "Margaret", "Mark", "Sandra",
+    "Steven", "Ashley", "Paul", "Emily", "Andrew", "Donna", "Joshua", "Michelle", "Kenneth", "Carol",
+    "Kevin", "Amanda", "Brian", "Melissa", "George", "Deborah", "Timothy", "Stephanie", "Ronald", "Rebecca",
+    "Jason", "Laura", "Ryan", "Sharon", "Jacob", "Cynthia", "Gary", "Kathleen", "Nicholas", "Amy",
+    "Eric", "Angela", "Jonathan", "Shirley", "Larry", "Anna", "Justin", "Brenda", "Scott", "Pamela",
+    "Priya", "Wei", "Hiroshi", "Aoife", "Siobhan", "Olumide", "Mateo", "Sofia", "Ahmed", "Fatima",
+]
+# Multi-part and accented first names
+SPECIAL_FIRST_NAMES = ["Mary Ann", "Jean-Luc", "Anne-Marie", "José", "Zoë", "Renée", "Chloé", "Björn",
+                       "Nuñez", "Ana Lucía", "Søren", "Dónal"]
+LAST_NAMES = [
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+    "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin",
+    "Lee", "Perez", "Thompson", "White", "Harris", "Sanchez", "Clark", "Ramirez", "Lewis", "Robinson",
+    "Walker", "Young", "Allen", "King", "Wright", "Scott", "Torres", "Nguyen", "Hill", "Flores",
+    "Green", "Adams", "Nelson", "Baker", "Hall", "Rivera", "Campbell", "Mitchell", "Carter", "Roberts",
+    "O'Neil", "McDonald", "van der Berg", "Kowalski", "Nakamura", "Okafor", "Schmidt", "Müller",
+    "Fitzgerald", "Patel", "Singh", "Chen", "Kim", "Ivanova", "Rossi", "Dubois", "García Márquez",
+]
+# Share of customers with a generated (rare) surname, and with a double-barrelled one
+_RARE_SURNAME_SHARE = 0.6
+_HYPHENATED_SHARE = 0.05
+_SPECIAL_FIRST_SHARE = 0.04
+
+_FIRST_ORDER_DATE = date(2019, 1, 1)
+_ORDER_SPAN_DAYS = (date(2024, 12, 31) - _FIRST_ORDER_DATE).days
+
+
+def _rare_surname(rng: random.Random) -> str:
+    syllables = [rng.choice("bcdfghklmnprstvwz") + rng.choice("aeiou") + rng.choice(["", "n", "r", "l", "s", "th"])
+                 for _ in range(rng.randint(2, 4))]
+    return "".join(syllables).title()
+
+
+def _name(rng: random.Random):
+    first = rng.choice(SPECIAL_FIRST_NAMES) if rng.random() < _SPECIAL_FIRST_SHARE else rng.choice(FIRST_NAMES)
+    last = _rare_surname(rng) if rng.random() < _RARE_SURNAME_SHARE else rng.choice(LAST_NAMES)
+    if rng.random() < _HYPHENATED_SHARE:
+        last = f"{last}-{rng.choice(LAST_NAMES)}"
+    return first, last
+
+
+def _quantity(rng: random.Random, unit_price: Decimal) -> int:
+    if unit_price < 1:
+        return rng.choice([50, 100, 100, 200, 250, 500, 1000])
+    if unit_price < 20:
+        return rng.randint(1, 24)
+    return rng.choice([1, 1, 1, 2, 2, 3])
+
+
+def _orders(rng: random.Random, customer_number: int) -> list:
+    # Most customers order a handful of times; a few wholesale accounts order constantly
+    count = min(int(rng.expovariate(1 / 4)), 60)
+    first_day = rng.randrange(_ORDER_SPAN_DAYS)
+    days = sorted(rng.randint(first_day, _ORDER_SPAN_DAYS) for _ in range(count))
+    orders = []
+    for n, day in enumerate(days):
+        product, unit_price = rng.choices(PRODUCTS, weights=_PRODUCT_WEIGHTS)[0]
+        quantity = _quantity(rng, unit_price)
+        orders.append({
+            'order_id': f"ORD-{customer_number:07d}-{n + 1:03d}",
+            'product': product,
+            'quantity': Decimal(quantity),
+            'order_date': (_FIRST_ORDER_DATE + timedelta(days=day)).isoformat(),
+            'total_price': (unit_price * quantity).quantize(Decimal("0.01")),
+        })
+    return orders
+
+
+def generate_customers(count: int, seed: int = 42, start: int = 0) -> Iterator[Dict[str, Any]]:
+    """Yield `count` customer items; the same seed and start always give the same customers"""
+    rng = random.Random(f"{seed}:{start}")
+    for number in range(start, start + count):
+        first, last = _name(rng)
+        email_name = f"{first}.{last}".lower().replace(" ", "").replace("'", "")
+        yield {
+            'customer_id': f"CUS-{number:07d}",
+            'first_name': first,
+            'last_name': last,
+            'email': f"{email_name}{number % 97}@example.com",
+            'orders': _orders(rng, number),
+        }
+
+
+def write_jsonl(path: str, customers: Iterable[Dict[str, Any]]) -> int:
+    """Write items as JSON lines (gzipped if the path ends in .gz)"""
+    opener = gzip.open if path.endswith('.gz') else open
+    count = 0
+    with opener(path, 'wt', encoding='utf-8') as f:
+        for customer in customers:
+            f.write(json.dumps(customer, default=json_default, ensure_ascii=False, separators=(',', ':')))
+            f.write('\n')
+            count += 1
+    return count
+
+
+def load_into_table(table, customers: Iterable[Dict[str, Any]]) -> int:
+    """Batch-write items into a boto3 or local table, and into the name index if this process has it loaded"""
+    count = 0
+    with table.batch_writer() as batch:
+        for customer in customers:
+            batch.put_item(Item=customer)
+            if customer_index.ready:
+                customer_index.add_customer(customer)
+            count += 1
+            if count % 10000 == 0:
+                logger.info("Loaded %s customers", count)
+    return count
+
+
+if __name__ == "__main__":
+    from log_utils import configure_logging
+    configure_logging(fmt="text")
+    parser = argparse.ArgumentParser(description="Generate synthetic Rivertownball-cus customers")
+    parser.add_argument("--customers", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="JSON lines file to write (.gz to compress)")
+    parser.add_argument("--load", action="store_true",
+                        help="write into the customer table (set DYNAMODB_ENDPOINT_URL for DynamoDB Local)")
+    parser.add_argument("--i-know-this-is-aws", dest="allow_aws", action="store_true",
+                        help="let --load write into the AWS table when no local endpoint is configured")
+    args = parser.parse_args()
+    if not args.output and not args.load:
+        parser.error("pass --output and/or --load")
+    if args.load:
+        from dynamo_utils import DYNAMODB_ENDPOINT_URL, DYNAMODB_LOCAL_DATA
+        if not (DYNAMODB_ENDPOINT_URL or DYNAMODB_LOCAL_DATA or args.allow_aws):
+            parser.error(f"--load would write into the AWS table {CUSTOMER_TABLE}; set DYNAMODB_ENDPOINT_URL "
+                         f"or DYNAMODB_LOCAL_DATA, or pass --i-know-this-is-aws")
+
+    if args.output:
+        written = write_jsonl(args.output, generate_customers(args.customers, args.seed))
+        print(f"wrote {written} customers to {args.output}")
+    if args.load:
+        from dynamo_utils import init_dynamodb
+        loaded = load_into_table(init_dynamodb().Table(CUSTOMER_TABLE), generate_customers(args.customers, args.seed))
+        print(f"loaded {loaded} customers into {CUSTOMER_TABLE}")
@@ -0,0 +1,117 @@
+"""RegionRouter failover, health and hedging against fake regional clients"""
+import threading
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+import region_router
+from region_router import RegionRouter, RoutedClient, REGION_FAILURE_THRESHOLD
+
+
+def client_error(code: str, status: int) -> ClientError:
+    return ClientError({'Error': {'Code': code, 'Message': code},
+                        'ResponseMetadata': {'HTTPStatusCode': status}}, 'InvokeModel')
+
+
+class FakeClient:
+    """Regional client answering with its region name, after `delay`, or raising `error`"""
+
+    def __init__(self, region: str, delay: float = 0.0, error: Exception = None):
+        self.region = region
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _answer(self, **kwargs):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return {"region": self.region, **kwargs}
+
+    def invoke_model(self, **kwargs):
+        return self._answer(**kwargs)
+
+    def retrieve_and_generate(self, **kwargs):
+        response = self._answer(**kwargs)
+        response.setdefault('sessionId', f"session-{self.region}")
+        return response
+
+
+def make_router(name: str, hedging: bool = False, **clients) -> RegionRouter:
+    return RegionRouter(name, dict(clients), hedging=hedging)
+
+
+def test_cooldown_after_failure_threshold():
+    east = FakeClient('us-east-1', error=client_error('ThrottlingException', 429))
+    west = FakeClient('us-west-2')
+    client = RoutedClient(make_router('cooldown', **{'us-east-1': east, 'us-west-2': west}))
+
+    for _ in range(REGION_FAILURE_THRESHOLD):
+        assert client.invoke_model()["region"] == 'us-west-2'
+    assert east.calls == REGION_FAILURE_THRESHOLD
+    assert client._router.stats()['us-east-1']['healthy'] is False
+
+    # Out of rotation: the next call goes straight to the healthy region
+    assert client.invoke_model()["region"] == 'us-west-2'
+    assert east.calls == REGION_FAILURE_THRESHOLD
+    assert client._router.ranked_regions() == ['us-west-2', 'us-east-1']
+
+
+def test_client_errors_do_not_count_against_region_health():
+    east = FakeClient('us-east-1', error=client_error('ValidationException', 400))
+    west = FakeClient('us-west-2')
+    router = make_router('client-errors', **{'us-east-1': east, 'us-west-2': west})
+
+    for _ in range(REGION_FAILURE_THRESHOLD + 1):
+        with pytest.raises(ClientError):
+            router.call('invoke_model')
+    stats = router.stats()['us-east-1']
+    assert stats['healthy'] is True
+    assert stats['failures'] == 0
+    assert stats['error_rate'] == 0.0
+    # A bad request is the caller's problem, so it is not retried elsewhere
+    assert west.calls == 0
+
+
+def test_hedge_winner_is_returned(monkeypatch):
+    monkeypatch.setattr(region_router, 'HEDGE_MIN_DELAY', 0.01)
+    monkeypatch.setattr(region_router, 'HEDGE_MAX_DELAY', 0.05)
+    slow = FakeClient('us-east-1', delay=1.0)
+    fast = FakeClient('us-west-2')
+    router = make_router('hedge', hedging=True, **{'us-east-1': slow, 'us-west-2': fast})
+
+    start = time.perf_counter()
+    result = router.call('invoke_model')
+    assert result["region"] == 'us-west-2'
+    assert time.perf_counter() - start < 0.5
+    assert slow.calls == 1 and fast.calls == 1
+    assert router.stats()['us-west-2']['hedges_won'] == 1
+
+
+def test_session_pinned_calls_never_fail_over(monkeypatch):
+    monkeypatch.setattr(region_router, 'HEDGE_MIN_DELAY', 0.01)
+    monkeypatch.setattr(region_router, 'HEDGE_MAX_DELAY', 0.05)
+    east = FakeClient('us-east-1')
+    west = FakeClient('us-west-2')
+    router = make_router('pinned', hedging=True, **{'us-east-1': east, 'us-west-2': west})
+
+    session_id = router.call('retrieve_and_generate')['sessionId']
+    pinned = 'us-east-1' if session_id == 'session-us-east-1' else 'us-west-2'
+    pinned_client, other_client = (east, west) if pinned == 'us-east-1' else (west, east)
+    other_calls = other_client.calls
+
+    # Slow: no hedge to the other region
+    pinned_client.delay = 0.2
+    assert router.call('retrieve_and_generate', sessionId=session_id)["region"] == pinned
+
+    # Failing with a retryable error: the error surfaces instead of a failover
+    pinned_client.delay = 0.0
+    pinned_client.error = client_error('ServiceUnavailableException', 503)
+    for _ in range(REGION_FAILURE_THRESHOLD + 1):
+        with pytest.raises(ClientError):
+            router.call('retrieve_and_generate', sessionId=session_id)
+    assert other_client.calls == other_calls
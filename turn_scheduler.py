@@ -0,0 +1,285 @@
+"""Knowledge base prefetch for a chat turn.
+
+Intent detection is a few regular expressions, so it runs first, on the caller's
+thread. Order lookups and spend/history answers run there too, with the caller's
+DynamoDB resource. A turn headed for the chat model, and not answered from the
+precomputed answer store, starts knowledge base retrieval on a shared thread pool.
+So does a spend/history question naming someone: if the name matches no customer
+the question goes to the chat model, and its context has been retrieving while the
+name was resolved. The caller then works on the rest of the turn and takes the
+context when it needs it. If the turn doesn't use it after all (an analytics
+question answered from order data), queued retrieval is cancelled, and a retrieval
+already running finishes in the background with its result dropped.
+
+Each turn reports how much stage time overlapped (time a strictly sequential turn
+would have spent waiting) and how much speculative work was wasted; totals are in
+`get_turn_stats()`.
+"""
+import contextvars
+import logging
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from answer_store import get_precomputed_answer
+from dynamo_utils import lookup_customer_orders
+from knowledge_base import get_knowledge_base_response
+from order_analytics import answer_analytics_question, detect_analytics_intent, is_self_reference
+from profiling import profiled_thread
+from usage_tracking import get_budget_state, BUDGET_EXHAUSTED
+
+logger = logging.getLogger(__name__)
+
+# Start knowledge base retrieval for chat turns before the caller asks for it (0 retrieves in sequence, as before)
+TURN_PREFETCH = os.getenv('TURN_PREFETCH', '1') == '1'
+# Threads shared by all turns for prefetched retrieval
+TURN_PREFETCH_WORKERS = int(os.getenv('TURN_PREFETCH_WORKERS', '32'))
+
+ROUTE_ANALYTICS = "analytics"
+ROUTE_ORDERS = "orders"
+ROUTE_CHAT = "chat"
+
+STAGE_KB = "kb"
+STAGE_ORDERS = "orders"
+
+# Everything after the phrase is the name, so multi-part, hyphenated and misspelled names get through
+_ORDER_LOOKUP = re.compile(r'(?:show orders for|orders for|order for)\s+(.+)', re.IGNORECASE)
+
+Route = namedtuple("Route", ["kind", "name"])
+
+_pool = ThreadPoolExecutor(max_workers=TURN_PREFETCH_WORKERS, thread_name_prefix="turn-prefetch")
+
+
+def detect_order_lookup(prompt: str) -> Optional[str]:
+    """Typed customer name of an "orders for <name>" request, or None"""
+    match = _ORDER_LOOKUP.search(prompt or "")
+    if not match:
+        return None
+    return match.group(1).strip(" ?.!,") or None
+
+
+def detect_route(prompt: str, order_lookups: bool = True) -> Route:
+    """Which handler answers the prompt: order analytics, an order lookup or the chat model"""
+    analytics = detect_analytics_intent(prompt)
+    if analytics:
+        return Route(ROUTE_ANALYTICS, analytics[1])
+    name = detect_order_lookup(prompt) if order_lookups else None
+    if name:
+        return Route(ROUTE_ORDERS, name)
+    return Route(ROUTE_CHAT, None)
+
+
+class TurnStats:
+    """Process-wide totals of overlapped and wasted stage time"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.turns = 0
+        self.routes: Dict[str, int] = {}
+        self.overlapped = 0.0
+        self.sequential = 0.0
+        self.wasted = 0.0
+        self.cancelled = 0
+        self.discarded = 0
+
+    def record_turn(self, route: str, sequential: float, overlapped: float) -> None:
+        with self._lock:
+            self.turns += 1
+            self.routes[route] = self.routes.get(route, 0) + 1
+            self.sequential += sequential
+            self.overlapped += overlapped
+
+    def record_discard(self, cancelled: bool) -> None:
+        with self._lock:
+            if cancelled:
+                self.cancelled += 1
+            else:
+                self.discarded += 1
+
+    def record_waste(self, seconds: float) -> None:
+        with self._lock:
+            self.wasted += seconds
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "turns": self.turns,
+                "routes": dict(self.routes),
+                "overlapped_ms": round(self.overlapped * 1000, 1),
+                "mean_overlapped_ms": round(self.overlapped / self.turns * 1000, 1) if self.turns else 0.0,
+                "overlapped_fraction": round(self.overlapped / self.sequential, 3) if self.sequential else 0.0,
+                "wasted_ms": round(self.wasted * 1000, 1),
+                "cancelled_stages": self.cancelled,
+                "discarded_stages": self.discarded,
+            }
+
+
+stats = TurnStats()
+
+
+class Turn:
+    """Stages of one chat turn; `route` is known from the start"""
+
+    def __init__(self, prompt: str, route: Route):
+        self.prompt = prompt
+        self.route = route
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._futures: Dict[str, Future] = {}
+        # stage -> (start, end) perf_counter times, once it has run
+        self._spans: Dict[str, Tuple[float, float]] = {}
+        self._discarded = set()
+        self._used = set()
+        # Time the caller spent blocked waiting for stage results
+        self._blocked = 0.0
+
+    def submit(self, stage: str, func: Callable, *args, **kwargs) -> Future:
+        """Run a stage on the prefetch pool with the caller's logging context"""
+        context = contextvars.copy_context()
+
+        def call():
+            # Runs inside the copied context, so a profiled turn also samples this worker
+            with profiled_thread():
+                return func(*args, **kwargs)
+
+        def run():
+            start = time.perf_counter()
+            try:
+                return context.run(call)
+            finally:
+                end = time.perf_counter()
+                with self._lock:
+                    self._spans[stage] = (start, end)
+                    wasted = stage in self._discarded
+                if wasted:
+                    stats.record_waste(end - start)
+
+        future = _pool.submit(run)
+        with self._lock:
+            self._futures[stage] = future
+        return future
+
+    def run(self, stage: str, func: Callable, *args, **kwargs) -> Any:
+        """Run a stage on the caller's thread; its time counts as time the caller waited"""
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self._spans[stage] = (start, end)
+                self._used.add(stage)
+                self._blocked += end - start
+
+    def has(self, stage: str) -> bool:
+        with self._lock:
+            return stage in self._futures
+
+    def result(self, stage: str, timeout: Optional[float] = None) -> Any:
+        """Wait for a stage; exceptions raised by the stage are re-raised here"""
+        with self._lock:
+            future = self._futures[stage]
+            self._used.add(stage)
+        start = time.perf_counter()
+        try:
+            return future.result(timeout=timeout)
+        finally:
+            with self._lock:
+                self._blocked += time.perf_counter() - start
+
+    def provider(self, stage: str) -> Callable[[], Any]:
+        """Zero-argument callable returning the stage's result, for code that may not need it"""
+        return lambda: self.result(stage)
+
+    def discard(self, *stages: str) -> None:
+        """Drop stages the route doesn't need: cancel them if queued, ignore their result if running"""
+        for stage in stages:
+            with self._lock:
+                future = self._futures.get(stage)
+                if future is None or stage in self._discarded:
+                    continue
+                self._discarded.add(stage)
+                span = self._spans.get(stage)
+            cancelled = future.cancel()
+            stats.record_discard(cancelled)
+            # A stage that already ran wasn't counted as waste when it finished
+            if span and not cancelled:
+                stats.record_waste(span[1] - span[0])
+            logger.debug("Discarded %s stage (%s)", stage, "cancelled" if cancelled else "result dropped")
+
+    def finish(self, route: str) -> Dict[str, Any]:
+        """Discard stages whose result nobody asked for and record how much of the rest overlapped.
+
+        Overlapped time is stage work the caller didn't wait for, because it was busy
+        with other stages or its own work meanwhile: a sequential turn would have paid it.
+        """
+        with self._lock:
+            unused = [stage for stage in self._futures if stage not in self._used and stage not in self._discarded]
+        self.discard(*unused)
+        with self._lock:
+            spans = [span for stage, span in self._spans.items() if stage not in self._discarded]
+            blocked = self._blocked
+        sequential = sum(end - start for start, end in spans)
+        overlapped = max(0.0, sequential - blocked)
+        stats.record_turn(route, sequential, overlapped)
+        report = {
+            "route": route,
+            "wall_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "stage_ms": round(sequential * 1000, 1),
+            "overlapped_ms": round(overlapped * 1000, 1),
+        }
+        logger.info("Turn %s: %.0f ms of stage work, %.0f ms overlapped",
+                    route, report["stage_ms"], report["overlapped_ms"])
+        return report
+
+
+def start_turn(prompt: str, kb_client, session_id: Optional[str] = None, order_lookups: bool = True) -> Turn:
+    """Route the prompt and, for a turn that may reach the chat model, start knowledge base retrieval.
+
+    `order_lookups=False` leaves "orders for <name>" prompts to the chat model.
+    """
+    turn = Turn(prompt, detect_route(prompt, order_lookups))
+    if not TURN_PREFETCH or turn.route.kind == ROUTE_ORDERS:
+        return turn
+    # "How much have I spent" is always answered from order data
+    if turn.route.kind == ROUTE_ANALYTICS and is_self_reference(turn.route.name):
+        return turn
+    # Precomputed answers and sessions over budget (served from cache) never use the context
+    if get_precomputed_answer(prompt) or get_budget_state(session_id) == BUDGET_EXHAUSTED:
+        return turn
+    turn.submit(STAGE_KB, get_knowledge_base_response, kb_client, prompt, session_id=session_id)
+    return turn
+
+
+def route_turn(turn: Turn, dynamodb, current_customer: Optional[Tuple[str, str]] = None) -> Tuple[Route, Any]:
+    """The turn's route and, for analytics and order lookups, their result.
+
+    Returns (route, result): the answer_analytics_question() dict for analytics, the
+    (match, orders, suggestions) tuple for order lookups and None for chat (including
+    analytics-shaped questions that name no customer). Order data is read here, on
+    the caller's thread, with the caller's `dynamodb`.
+    """
+    route = turn.route
+    if route.kind == ROUTE_ANALYTICS:
+        result = turn.run(STAGE_ORDERS, answer_analytics_question, dynamodb, turn.prompt, current_customer)
+        if result is None:
+            # The "name" wasn't a customer: a general question for the chat model, context already on its way
+            return Route(ROUTE_CHAT, None), None
+        turn.discard(STAGE_KB)
+        return route, result
+    if route.kind == ROUTE_ORDERS:
+        return route, turn.run(STAGE_ORDERS, lookup_customer_orders, dynamodb, route.name)
+    return route, None
+
+
+def context_provider(turn: Turn) -> Optional[Callable[[], str]]:
+    """Prefetched knowledge base context for chat_service, or None to retrieve it there"""
+    return turn.provider(STAGE_KB) if turn.has(STAGE_KB) else None
+
+
+def get_turn_stats() -> Dict[str, Any]:
+    return stats.snapshot()
@@ -0,0 +1,212 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Optional, Any
+
+logger = logging.getLogger(__name__)
+
+# Per-session token budget (input + output). 0 disables enforcement.
+SESSION_TOKEN_BUDGET = int(os.getenv('SESSION_TOKEN_BUDGET', '60000'))
+# Fraction of the budget after which responses are shortened
+SESSION_SOFT_BUDGET_RATIO = float(os.getenv('SESSION_SOFT_BUDGET_RATIO', '0.8'))
+# max_tokens used once a session is over its soft budget
+DEGRADED_MAX_TOKENS = int(os.getenv('DEGRADED_MAX_TOKENS', '256'))
+# Number of individual call records kept for inspection
+RECENT_CALLS_LIMIT = int(os.getenv('USAGE_RECENT_CALLS', '1000'))
+# Sessions whose usage is kept; the least recently active are dropped beyond this
+USAGE_MAX_SESSIONS = int(os.getenv('USAGE_MAX_SESSIONS', '10000'))
+# Seconds without a model call after which a session's usage (and budget) is dropped; 0 keeps it
+USAGE_SESSION_IDLE_SECONDS = float(os.getenv('USAGE_SESSION_IDLE_SECONDS', '3600'))
+
+BUDGET_OK = "ok"
+BUDGET_DEGRADED = "degraded"
+BUDGET_EXHAUSTED = "exhausted"
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate for APIs that don't report usage (~4 chars per token)"""
+    if not text:
+        return 0
+    return max(1, len(text) // 4)
+
+
+def _empty_totals() -> Dict[str, Any]:
+    return {
+        "calls": 0,
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "total_tokens": 0,
+        "latency_seconds": 0.0,
+        "estimated_calls": 0,
+    }
+
+
+def _add_to_totals(totals: Dict[str, Any], record: Dict[str, Any]) -> None:
+    totals["calls"] += 1
+    totals["input_tokens"] += record["input_tokens"]
+    totals["output_tokens"] += record["output_tokens"]
+    totals["total_tokens"] += record["input_tokens"] + record["output_tokens"]
+    totals["latency_seconds"] += record["latency_seconds"]
+    if record.get("estimated"):
+        totals["estimated_calls"] += 1
+
+
+class UsageTracker:
+    """Thread-safe aggregation of model usage per session, per model and per process
+
+    Per-session totals are kept for at most `max_sessions` sessions, each until it has
+    been idle for `session_idle_seconds` or is ended with end_session().
+    """
+
+    def __init__(self, session_budget: int = SESSION_TOKEN_BUDGET,
+                 soft_ratio: float = SESSION_SOFT_BUDGET_RATIO,
+                 recent_limit: int = RECENT_CALLS_LIMIT,
+                 max_sessions: int = USAGE_MAX_SESSIONS,
+                 session_idle_seconds: float = USAGE_SESSION_IDLE_SECONDS):
+        self.session_budget = session_budget
+        self.soft_ratio = soft_ratio
+        self.max_sessions = max_sessions
+        self.session_idle_seconds = session_idle_seconds
+        self._lock = threading.Lock()
+        self._process = _empty_totals()
+        # Least recently active first
+        self._sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._session_active: Dict[str, float] = {}
+        self.evicted_sessions = 0
+        self._models: Dict[str, Dict[str, Any]] = {}
+        self._sources: Dict[str, Dict[str, Any]] = {}
+        self._recent = deque(maxlen=recent_limit)
+        self._started = time.time()
+
+    def record(self, session_id: Optional[str], model: str, input_tokens: int,
+               output_tokens: int, latency_seconds: float, source: str = "invoke_model",
+               estimated: bool = False, **extra) -> Dict[str, Any]:
+        """Record a single model call"""
+        record = {
+            "timestamp": time.time(),
+            "session_id": session_id,
+            "model": model,
+            "source": source,
+            "input_tokens": int(input_tokens or 0),
+            "output_tokens": int(output_tokens or 0),
+            "latency_seconds": float(latency_seconds),
+            "estimated": estimated,
+        }
+        record.update(extra)
+
+        with self._lock:
+            _add_to_totals(self._process, record)
+            _add_to_totals(self._models.setdefault(model, _empty_totals()), record)
+            _add_to_totals(self._sources.setdefault(source, _empty_totals()), record)
+            if session_id:
+                _add_to_totals(self._sessions.setdefault(session_id, _empty_totals()), record)
+                self._sessions.move_to_end(session_id)
+                self._session_active[session_id] = record["timestamp"]
+                self._evict_sessions(record["timestamp"])
+            self._recent.append(record)
+
+        logger.debug("Recorded usage: %s", record)
+        return record
+
+    def _evict_sessions(self, now: float) -> None:
+        # Called with the lock held; the oldest session is always the least recently active
+        while self._sessions:
+            oldest = next(iter(self._sessions))
+            idle = now - self._session_active[oldest]
+            if len(self._sessions) <= self.max_sessions and \
+                    (self.session_idle_seconds <= 0 or idle < self.session_idle_seconds):
+                break
+            del self._sessions[oldest]
+            del self._session_active[oldest]
+            self.evicted_sessions += 1
+
+    def end_session(self, session_id: Optional[str]) -> None:
+        """Drop a finished session's usage"""
+        with self._lock:
+            if self._sessions.pop(session_id, None) is not None:
+                del self._session_active[session_id]
+
+    def session_usage(self, session_id: Optional[str]) -> Dict[str, Any]:
+        """Aggregated usage for a single session"""
+        with self._lock:
+            totals = dict(self._sessions.get(session_id, _empty_totals()))
+        totals["budget"] = self.session_budget
+        totals["budget_state"] = self._state_for(totals["total_tokens"])
+        return totals
+
+    def budget_state(self, session_id: Optional[str]) -> str:
+        """Return ok / degraded / exhausted for the session's token budget"""
+        if not session_id or self.session_budget <= 0:
+            return BUDGET_OK
+        with self._lock:
+            used = self._sessions.get(session_id, {}).get("total_tokens", 0)
+        return self._state_for(used)
+
+    def _state_for(self, used: int) -> str:
+        if self.session_budget <= 0:
+            return BUDGET_OK
+        if used >= self.session_budget:
+            return BUDGET_EXHAUSTED
+        if used >= self.session_budget * self.soft_ratio:
+            return BUDGET_DEGRADED
+        return BUDGET_OK
+
+    def recent_calls(self, source: Optional[str] = None) -> list:
+        """Most recent call records, optionally filtered by source"""
+        with self._lock:
+            records = list(self._recent)
+        if source:
+            records = [r for r in records if r["source"] == source]
+        return records
+
+    def metrics(self) -> Dict[str, Any]:
+        """Snapshot of all aggregated usage"""
+        with self._lock:
+            return {
+                "uptime_seconds": time.time() - self._started,
+                "process": dict(self._process),
+                "by_model": {k: dict(v) for k, v in self._models.items()},
+                "by_source": {k: dict(v) for k, v in self._sources.items()},
+                "sessions": {k: dict(v) for k, v in self._sessions.items()},
+                "evicted_sessions": self.evicted_sessions,
+                "session_budget": self.session_budget,
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._process = _empty_totals()
+            self._sessions.clear()
+            self._session_active.clear()
+            self._models.clear()
+            self._sources.clear()
+            self._recent.clear()
+            self._started = time.time()
+
+
+# Process-wide tracker shared by all sessions
+tracker = UsageTracker()
+
+
+def record_usage(session_id: Optional[str], model: str, input_tokens: int, output_tokens: int,
+                 latency_seconds: float, **kwargs) -> Dict[str, Any]:
+    """Record usage on the process-wide tracker"""
+    return tracker.record(session_id, model, input_tokens, output_tokens, latency_seconds, **kwargs)
+
+
+def get_budget_state(session_id: Optional[str]) -> str:
+    """Budget state for a session on the process-wide tracker"""
+    return tracker.budget_state(session_id)
+
+
+def end_usage_session(session_id: Optional[str]) -> None:
+    """Drop a session's usage from the process-wide tracker (batch jobs whose sessions never come back)"""
+    tracker.end_session(session_id)
+
+
+def get_usage_metrics(session_id: Optional[str] = None) -> Dict[str, Any]:
+    """Metrics API: full process snapshot, or a single session's usage"""
+    if session_id:
+        return tracker.session_usage(session_id)
+    return tracker.metrics()